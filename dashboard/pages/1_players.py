@@ -40,9 +40,9 @@ def main():
     positions = ["Tutti", "Goalkeeper", "Defence", "Midfield", "Offence"]
     selected_position = st.sidebar.selectbox("Ruolo", positions)
 
-    # Query dati dalla vista
+    # Query dati dallo snapshot (aggiornato a fine sync)
     try:
-        query = supabase.table("player_season_cards").select("*")
+        query = supabase.table("player_risk_features").select("*")
 
         if selected_team != "Tutte":
             query = query.eq("team_name", selected_team)
@@ -106,7 +106,7 @@ def main():
 
     except Exception as e:
         st.error(f"Errore nel caricamento dati: {e}")
-        st.info("Assicurati di aver eseguito lo script di sincronizzazione e creato le viste SQL")
+        st.info("Assicurati di aver eseguito la migration 011 e lo script di sincronizzazione")
 
 
 if __name__ == "__main__":
@@ -221,6 +221,12 @@ def main():
     with col3:
         referee = st.selectbox("Arbitro", referees_list)
 
+    st.sidebar.header("Opzioni")
+    use_rpc = st.sidebar.checkbox(
+        "Calcolo nel database",
+        help="Usa analyze_match_risk_v2: tutta l'analisi in una sola chiamata RPC"
+    )
+
     if st.button("🔍 Analizza Partita", type="primary", use_container_width=True):
         if home_team == away_team:
             st.error("Seleziona due squadre diverse")
@@ -229,7 +235,7 @@ def main():
         # Chiama analyze_match_risk
         ref_param = referee if referee != "Non designato" else None
         with st.spinner("Analisi in corso..."):
-            result_json = analyze_match_risk(home_team, away_team, ref_param)
+            result_json = analyze_match_risk(home_team, away_team, ref_param, use_rpc=use_rpc)
 
         try:
             result = json.loads(result_json)
@@ -1,6 +1,26 @@
 -- YellowOracle - Viste e Funzioni per Analisi Cartellini
 -- Esegui questo script nell'SQL Editor di Supabase DOPO schema_v2.sql
 -- Data: 2026-01-26
+--
+-- SCHEMA DI PARTENZA (solo installazioni nuove): eseguire UNA volta, dopo schema_v2.sql e
+-- prima delle migration in database/migrations/ (001 in poi). Non rieseguire dopo le
+-- migration: molti oggetti qui definiti sono ridefiniti da loro e verrebbero riportati
+-- alla versione iniziale:
+--   player_season_cards, player_season_cards_total, match_analysis_summary -> 015 (tabelle)
+--   team_fouls_stats -> 016 (da match_card_summary)
+--   get_player_season_stats*, get_referee_player_cards, get_head_to_head_cards,
+--   get_team_fouls_stats -> 014 (ricerca nomi con indici trigram)
+-- Le modifiche a questi oggetti vanno in una nuova migration, non qui.
+
+-- Blocca la riesecuzione su un database già migrato (014 è la prima migration che
+-- ridefinisce oggetti di questo file)
+DO $$
+BEGIN
+    IF to_regprocedure('normalize_name(text)') IS NOT NULL THEN
+        RAISE EXCEPTION 'analysis_views.sql è lo schema di partenza: database già migrato (014+), usare le migration';
+    END IF;
+END;
+$$;
 
 -- ============================================
 -- VISTE PER ANALISI
@@ -0,0 +1,44 @@
+-- database/migrations/005_sync_journal.sql
+-- Journal dei run di sincronizzazione per ripresa con --resume
+-- Eseguire in Supabase SQL Editor
+
+-- 1. Un record per ogni esecuzione di sync_season (competizione + stagione)
+CREATE TABLE IF NOT EXISTS sync_runs (
+    id UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
+    competition_code VARCHAR(10) NOT NULL,
+    season VARCHAR(10) NOT NULL,
+    mode VARCHAR(20),  -- full, incremental, days, basic
+    status VARCHAR(20) NOT NULL DEFAULT 'RUNNING',  -- RUNNING, COMPLETED, FAILED
+    -- Finestra partite del run (fissata al primo avvio, riusata dalla ripresa)
+    date_from DATE,
+    date_to DATE,
+    started_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    finished_at TIMESTAMP WITH TIME ZONE,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS idx_sync_runs_lookup ON sync_runs(competition_code, season, started_at DESC);
+
+COMMENT ON TABLE sync_runs IS 'Esecuzioni di sync_football_data.py per competizione/stagione';
+COMMENT ON COLUMN sync_runs.status IS 'RUNNING=in corso o interrotto, COMPLETED=terminato, FAILED=errore';
+
+-- 2. Unità di lavoro completate all'interno di un run
+-- unit_key = '' indica l'intera fase completata, altrimenti l'endpoint API dell'unità
+CREATE TABLE IF NOT EXISTS sync_checkpoints (
+    id UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
+    run_id UUID REFERENCES sync_runs(id) ON DELETE CASCADE NOT NULL,
+    stage VARCHAR(30) NOT NULL,  -- teams, players, matches, match_details, player_stats, referee_stats
+    unit_key TEXT NOT NULL DEFAULT '',
+    fetched_at TIMESTAMP WITH TIME ZONE,    -- Payload scaricato dall'API
+    persisted_at TIMESTAMP WITH TIME ZONE,  -- Dati salvati nel DB
+    UNIQUE(run_id, stage, unit_key)
+);
+
+COMMENT ON TABLE sync_checkpoints IS 'Checkpoint per fase/endpoint di un run di sync (ripresa con --resume)';
+COMMENT ON COLUMN sync_checkpoints.unit_key IS 'Stringa vuota = fase completata, altrimenti endpoint (es. /matches/12345)';
+
+-- 3. Verifica
+SELECT competition_code, season, mode, status, started_at, finished_at
+FROM sync_runs
+ORDER BY started_at DESC
+LIMIT 10;
@@ -0,0 +1,68 @@
+-- database/migrations/006_referee_stats_refresh.sql
+-- Ricalcolo set-based delle statistiche aggregate arbitri (sostituisce il loop N+1 in Python)
+-- Eseguire in Supabase SQL Editor
+
+-- 1. Indice per aggregare le partite per arbitro
+CREATE INDEX IF NOT EXISTS idx_matches_referee_status ON matches(referee_id, status);
+
+-- 2. Funzione di ricalcolo
+-- p_referee_ids = NULL ricalcola tutti gli arbitri, altrimenti solo quelli indicati
+CREATE OR REPLACE FUNCTION refresh_referee_stats(p_referee_ids UUID[] DEFAULT NULL)
+RETURNS INTEGER
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_updated INTEGER;
+BEGIN
+    WITH referee_matches AS (
+        SELECT m.referee_id, m.id AS match_id
+        FROM matches m
+        WHERE m.status = 'FINISHED'
+          AND m.referee_id IS NOT NULL
+          AND (p_referee_ids IS NULL OR m.referee_id = ANY(p_referee_ids))
+    ),
+    match_totals AS (
+        SELECT
+            ms.match_id,
+            SUM(COALESCE(ms.yellow_cards, 0)) AS yellows,
+            SUM(COALESCE(ms.red_cards, 0)) AS reds,
+            SUM(COALESCE(ms.fouls_committed, 0)) AS fouls
+        FROM match_statistics ms
+        WHERE ms.match_id IN (SELECT match_id FROM referee_matches)
+        GROUP BY ms.match_id
+    ),
+    referee_totals AS (
+        SELECT
+            rm.referee_id,
+            COUNT(*) AS total_matches,
+            COALESCE(SUM(mt.yellows), 0) AS total_yellows,
+            COALESCE(SUM(mt.reds), 0) AS total_reds,
+            COALESCE(SUM(mt.fouls), 0) AS total_fouls
+        FROM referee_matches rm
+        LEFT JOIN match_totals mt ON mt.match_id = rm.match_id
+        GROUP BY rm.referee_id
+    )
+    UPDATE referees r
+    SET
+        total_matches = rt.total_matches,
+        total_yellows = rt.total_yellows,
+        total_reds = rt.total_reds,
+        avg_yellows_per_match = ROUND(rt.total_yellows::NUMERIC / rt.total_matches, 2),
+        avg_fouls_per_match = ROUND(rt.total_fouls::NUMERIC / rt.total_matches, 2),
+        updated_at = NOW()
+    FROM referee_totals rt
+    WHERE r.id = rt.referee_id;
+
+    GET DIAGNOSTICS v_updated = ROW_COUNT;
+    RETURN v_updated;
+END;
+$$;
+
+COMMENT ON FUNCTION refresh_referee_stats IS 'Ricalcola total_matches, cartellini e medie degli arbitri indicati (NULL = tutti) da matches e match_statistics';
+
+-- 3. Verifica
+SELECT refresh_referee_stats() AS arbitri_aggiornati;
+SELECT name, total_matches, total_yellows, total_reds, avg_yellows_per_match, avg_fouls_per_match
+FROM referees
+ORDER BY total_matches DESC
+LIMIT 10;
@@ -0,0 +1,104 @@
+-- database/migrations/007_player_season_stats_derived.sql
+-- Calcolo di player_season_stats da lineups e match_events (senza API /persons)
+-- Eseguire in Supabase SQL Editor
+
+-- 1. Funzione di ricalcolo
+-- Un giocatore è "derivabile" se ha almeno una presenza in formazione nella stagione e
+-- tutte le partite concluse delle sue squadre hanno le formazioni salvate.
+-- Per gli altri (nessuna presenza nelle competizioni sincronizzate, dettagli mancanti)
+-- derived = FALSE: lo script li sincronizza con l'API /persons.
+-- Gli assist non sono nei dettagli salvati: la colonna non viene toccata (resta il valore
+-- dell'ultimo sync API, 0 per le righe nuove).
+-- Conta solo le competizioni sincronizzate: le presenze in coppe/competizioni non presenti
+-- nel DB mancano dai totali. Per questo la sync usa la fonte API di default e questa
+-- funzione solo con --player-stats derived.
+CREATE OR REPLACE FUNCTION refresh_player_season_stats(p_season TEXT, p_player_ids UUID[])
+RETURNS TABLE (player_id UUID, derived BOOLEAN)
+LANGUAGE sql
+AS $$
+    WITH season_lineups AS (
+        SELECT l.player_id, l.team_id, l.is_starter, l.subbed_in_minute, l.minutes_played
+        FROM lineups l
+        JOIN matches m ON m.id = l.match_id
+        WHERE m.season = p_season
+          AND m.status = 'FINISHED'
+          AND l.player_id = ANY(p_player_ids)
+    ),
+    team_coverage AS (
+        -- Squadre con formazioni salvate per tutte le partite concluse della stagione
+        SELECT
+            t.team_id,
+            BOOL_AND(EXISTS (
+                SELECT 1 FROM lineups l WHERE l.match_id = m.id AND l.team_id = t.team_id
+            )) AS complete
+        FROM (SELECT DISTINCT team_id FROM season_lineups) t
+        JOIN matches m ON m.home_team_id = t.team_id OR m.away_team_id = t.team_id
+        WHERE m.season = p_season
+          AND m.status = 'FINISHED'
+        GROUP BY t.team_id
+    ),
+    appearances AS (
+        SELECT
+            sl.player_id,
+            COUNT(*) FILTER (WHERE sl.is_starter OR sl.subbed_in_minute IS NOT NULL) AS matches_played,
+            COUNT(*) FILTER (WHERE sl.is_starter) AS matches_started,
+            -- minutes_played valorizzato solo per i sostituiti: titolare non sostituito = 90
+            SUM(CASE
+                WHEN sl.minutes_played IS NOT NULL THEN sl.minutes_played
+                WHEN sl.is_starter THEN 90
+                ELSE 0
+            END) AS minutes_played
+        FROM season_lineups sl
+        JOIN team_coverage tc ON tc.team_id = sl.team_id
+        GROUP BY sl.player_id
+        HAVING BOOL_AND(tc.complete)
+    ),
+    events AS (
+        SELECT
+            me.player_id,
+            COUNT(*) FILTER (WHERE me.event_type IN ('GOAL', 'PENALTY')) AS goals,
+            COUNT(*) FILTER (WHERE me.event_type = 'YELLOW_CARD') AS yellow_cards,
+            COUNT(*) FILTER (WHERE me.event_type = 'RED_CARD') AS red_cards
+        FROM match_events me
+        JOIN matches m ON m.id = me.match_id
+        WHERE m.season = p_season
+          AND m.status = 'FINISHED'
+          AND me.player_id IN (SELECT a.player_id FROM appearances a)
+        GROUP BY me.player_id
+    ),
+    upserted AS (
+        INSERT INTO player_season_stats (
+            player_id, team_id, season,
+            matches_played, matches_started, minutes_played,
+            goals, yellow_cards, red_cards, updated_at
+        )
+        SELECT
+            a.player_id, p.current_team_id, p_season,
+            a.matches_played, a.matches_started, a.minutes_played,
+            COALESCE(e.goals, 0), COALESCE(e.yellow_cards, 0), COALESCE(e.red_cards, 0), NOW()
+        FROM appearances a
+        JOIN players p ON p.id = a.player_id
+        LEFT JOIN events e ON e.player_id = a.player_id
+        ON CONFLICT (player_id, season) DO UPDATE SET
+            team_id = EXCLUDED.team_id,
+            matches_played = EXCLUDED.matches_played,
+            matches_started = EXCLUDED.matches_started,
+            minutes_played = EXCLUDED.minutes_played,
+            goals = EXCLUDED.goals,
+            yellow_cards = EXCLUDED.yellow_cards,
+            red_cards = EXCLUDED.red_cards,
+            -- assists: non aggiornato (vedi sopra)
+            updated_at = EXCLUDED.updated_at
+        RETURNING player_season_stats.player_id
+    )
+    SELECT ids.id, ids.id IN (SELECT u.player_id FROM upserted u)
+    FROM UNNEST(p_player_ids) AS ids(id);
+$$;
+
+COMMENT ON FUNCTION refresh_player_season_stats IS 'Ricalcola player_season_stats da lineups/match_events per i giocatori indicati (solo competizioni sincronizzate, assists non aggiornato); derived=FALSE se servono i dati API';
+
+-- 2. Verifica
+SELECT pss.season, COUNT(*) AS giocatori, SUM(pss.minutes_played) AS minuti, SUM(pss.yellow_cards) AS gialli
+FROM player_season_stats pss
+GROUP BY pss.season
+ORDER BY pss.season DESC;
@@ -0,0 +1,72 @@
+-- database/migrations/008_h2h_bulk.sql
+-- Storico scontri diretti per più giocatori in una sola chiamata (analyze_match_risk)
+-- Eseguire in Supabase SQL Editor
+
+-- 1. Funzione bulk: riceve ID già risolti (niente LIKE per giocatore/squadra)
+-- Restituisce una riga per ogni giocatore con almeno uno scontro diretto giocato
+CREATE OR REPLACE FUNCTION get_head_to_head_cards_bulk(
+    p_player_ids UUID[],
+    p_team1_id UUID,
+    p_team2_id UUID
+)
+RETURNS TABLE (
+    player_id UUID,
+    player_name TEXT,
+    team_name TEXT,
+    opponent TEXT,
+    total_h2h_matches BIGINT,
+    total_yellows BIGINT,
+    total_reds BIGINT,
+    card_percentage NUMERIC
+)
+LANGUAGE sql
+STABLE
+AS $$
+    WITH h2h_matches AS (
+        -- Scontri diretti tra le due squadre
+        SELECT m.id AS match_id
+        FROM matches m
+        WHERE m.status = 'FINISHED'
+        AND (
+            (m.home_team_id = p_team1_id AND m.away_team_id = p_team2_id)
+            OR (m.home_team_id = p_team2_id AND m.away_team_id = p_team1_id)
+        )
+    ),
+    player_matches AS (
+        -- Una riga per giocatore/partita con i cartellini ricevuti
+        SELECT
+            l.player_id,
+            l.team_id,
+            l.match_id,
+            COUNT(me.id) FILTER (WHERE me.event_type = 'YELLOW_CARD') AS yellows,
+            COUNT(me.id) FILTER (WHERE me.event_type = 'RED_CARD') AS reds
+        FROM h2h_matches h2h
+        JOIN lineups l ON l.match_id = h2h.match_id AND l.player_id = ANY(p_player_ids)
+        LEFT JOIN match_events me ON me.match_id = l.match_id
+            AND me.player_id = l.player_id
+            AND me.event_type IN ('YELLOW_CARD', 'RED_CARD')
+        GROUP BY l.player_id, l.team_id, l.match_id
+    )
+    SELECT
+        pm.player_id,
+        p.name::TEXT AS player_name,
+        MAX(t.name)::TEXT AS team_name,
+        MAX(o.name)::TEXT AS opponent,
+        COUNT(*) AS total_h2h_matches,
+        SUM(pm.yellows)::BIGINT AS total_yellows,
+        SUM(pm.reds)::BIGINT AS total_reds,
+        ROUND((SUM(pm.yellows) + SUM(pm.reds))::NUMERIC / COUNT(*)::NUMERIC * 100, 1) AS card_percentage
+    FROM player_matches pm
+    JOIN players p ON p.id = pm.player_id
+    JOIN teams t ON t.id = pm.team_id
+    JOIN teams o ON o.id = CASE WHEN pm.team_id = p_team1_id THEN p_team2_id ELSE p_team1_id END
+    GROUP BY pm.player_id, p.name;
+$$;
+
+COMMENT ON FUNCTION get_head_to_head_cards_bulk IS 'Storico cartellini negli scontri diretti per una lista di giocatori (ID) e una coppia di squadre (ID). Una chiamata per analisi.';
+
+-- 2. Verifica (sostituire con ID reali)
+-- SELECT * FROM get_head_to_head_cards_bulk(
+--     ARRAY(SELECT id FROM players WHERE current_team_id = '<team1_id>'),
+--     '<team1_id>', '<team2_id>'
+-- );
@@ -0,0 +1,440 @@
+-- database/migrations/009_analyze_match_risk_v2.sql
+-- Analisi rischio cartellino calcolata interamente nel DB (una sola chiamata RPC)
+-- Stessa logica di analyze_match_risk in mcp_server.py (verifica: tests/test_scoring_parity.py)
+-- Eseguire in Supabase SQL Editor DOPO 001-008
+
+-- 1. Rose delle due squadre con le feature per giocatore
+-- Funzione separata: le migrazioni successive cambiano la sorgente delle rose ridefinendo
+-- solo questa (011: snapshot player_risk_features), senza ricopiare analyze_match_risk_v2
+CREATE OR REPLACE FUNCTION match_risk_squads(
+    p_home_team_id UUID,
+    p_away_team_id UUID,
+    p_season TEXT
+)
+RETURNS TABLE (
+    player_id UUID,
+    player_name TEXT,
+    team_name TEXT,
+    "position" TEXT,
+    is_home BOOLEAN,
+    matches_played BIGINT,
+    yellow_cards BIGINT,
+    yellows_per_90 NUMERIC,
+    position_multiplier NUMERIC,
+    team_foul_to_card NUMERIC,
+    possession_multiplier NUMERIC
+)
+LANGUAGE sql
+STABLE
+AS $$
+    SELECT
+        psc.player_id,
+        psc.player_name::TEXT,
+        psc.team_name::TEXT,
+        psc.position::TEXT,
+        psc.team_id = p_home_team_id,
+        psc.matches_played::BIGINT,
+        psc.yellow_cards::BIGINT,
+        psc.yellows_per_90,
+        CASE WHEN psc.position IN ('Midfield', 'Defence') THEN 1.2 ELSE 1.0 END,
+        COALESCE(tfs.foul_to_card_pct, 0),
+        -- Stessa formula di get_possession_factor (possesso medio 50% se mancano statistiche)
+        ROUND(GREATEST(0.85, LEAST(1.15, 1 + (50 - COALESCE(tps.avg_possession, 50)) * 0.01)), 2)
+    FROM player_season_cards psc
+    LEFT JOIN team_fouls_stats tfs ON tfs.team_id = psc.team_id AND tfs.season = p_season
+    LEFT JOIN team_possession_stats tps ON tps.team_id = psc.team_id AND tps.season = p_season
+    WHERE psc.team_id IN (p_home_team_id, p_away_team_id)
+    AND psc.season = p_season;
+$$;
+
+COMMENT ON FUNCTION match_risk_squads IS 'Rose di casa/trasferta per analyze_match_risk_v2 (gialli/90, ruolo, falli e possesso squadra)';
+
+-- 2. Profilo outlier dell'arbitro (lega con più partite)
+-- Come match_risk_squads: ridefinita dalle migrazioni che cambiano la sorgente (017: per stagione)
+CREATE OR REPLACE FUNCTION match_risk_referee_profile(p_referee_id UUID, p_season TEXT)
+RETURNS TABLE (
+    referee_profile TEXT,
+    ref_avg_yellows NUMERIC,
+    league_avg_yellows NUMERIC,
+    ref_league_delta NUMERIC
+)
+LANGUAGE sql
+STABLE
+AS $$
+    SELECT
+        rlc.referee_profile::TEXT,
+        rlc.ref_avg_yellows::NUMERIC,
+        rlc.league_avg_yellows::NUMERIC,
+        rlc.ref_league_delta::NUMERIC
+    FROM referee_league_comparison rlc
+    WHERE rlc.referee_id = p_referee_id
+    ORDER BY rlc.matches_in_league DESC
+    LIMIT 1;
+$$;
+
+COMMENT ON FUNCTION match_risk_referee_profile IS 'Profilo arbitro per analyze_match_risk_v2 (delta e classificazione rispetto alla media lega)';
+
+-- 3. Funzione principale
+-- Riceve ID già risolti e restituisce lo stesso documento JSON del tool MCP:
+-- contesto (derby, possesso, arbitro, lega, falli squadra) + top 5 casa/trasferta/overall
+CREATE OR REPLACE FUNCTION analyze_match_risk_v2(
+    p_home_team_id UUID,
+    p_away_team_id UUID,
+    p_referee_id UUID DEFAULT NULL,
+    p_season TEXT DEFAULT '2025-2026'
+)
+RETURNS JSONB
+LANGUAGE plpgsql
+STABLE
+AS $$
+DECLARE
+    -- Pesi (con arbitro / senza arbitro)
+    c_weight_seasonal CONSTANT NUMERIC := 0.35;
+    c_weight_referee CONSTANT NUMERIC := 0.30;
+    c_weight_h2h CONSTANT NUMERIC := 0.15;
+    c_weight_fouls CONSTANT NUMERIC := 0.20;
+    c_weight_seasonal_no_ref CONSTANT NUMERIC := 0.45;
+    c_weight_h2h_no_ref CONSTANT NUMERIC := 0.25;
+    c_weight_fouls_no_ref CONSTANT NUMERIC := 0.30;
+    c_default_referee_score CONSTANT NUMERIC := 25;
+    c_h2h_threshold CONSTANT NUMERIC := 25;
+    -- Moltiplicatori home/away (studio CIES)
+    c_home_multiplier CONSTANT NUMERIC := 0.94;
+    c_away_multiplier CONSTANT NUMERIC := 1.06;
+
+    v_home_name TEXT;
+    v_away_name TEXT;
+    v_derby RECORD;
+    v_derby_multiplier NUMERIC := 1.0;
+    v_derby_json JSONB;
+    v_home_poss NUMERIC;
+    v_away_poss NUMERIC;
+    v_home_style TEXT;
+    v_away_style TEXT;
+    v_home_poss_factor NUMERIC;
+    v_away_poss_factor NUMERIC;
+    v_referee_name TEXT;
+    v_referee_stats JSONB;
+    v_referee_profile JSONB;
+    v_referee_delta NUMERIC;
+    v_referee_adjustment NUMERIC := 1.0;
+    v_comp_code TEXT;
+    v_league_multiplier NUMERIC := 1.0;
+    v_home_foul_to_card NUMERIC;
+    v_away_foul_to_card NUMERIC;
+    v_home_fouls JSONB;
+    v_away_fouls JSONB;
+    v_team_stats JSONB;
+    v_home_top5 JSONB;
+    v_away_top5 JSONB;
+    v_overall_top5 JSONB;
+    v_analysis JSONB;
+BEGIN
+    SELECT name INTO v_home_name FROM teams WHERE id = p_home_team_id;
+    SELECT name INTO v_away_name FROM teams WHERE id = p_away_team_id;
+    IF v_home_name IS NULL OR v_away_name IS NULL THEN
+        RETURN NULL;
+    END IF;
+
+    -- === DERBY: intensità 1=+10%, 2=+18%, 3=+26% ===
+    SELECT * INTO v_derby FROM is_derby_match(p_home_team_id, p_away_team_id);
+    IF v_derby.is_derby THEN
+        v_derby_multiplier := 1.0 + (0.08 * COALESCE(v_derby.intensity, 1) + 0.02);
+        v_derby_json := jsonb_build_object(
+            'is_derby', TRUE,
+            'name', v_derby.rivalry_name,
+            'type', v_derby.rivalry_type,
+            'intensity', COALESCE(v_derby.intensity, 1)
+        );
+    END IF;
+
+    -- === POSSESSO: stessa formula di get_possession_factor, ma per ID ===
+    SELECT tps.avg_possession, tps.play_style INTO v_home_poss, v_home_style
+    FROM team_possession_stats tps
+    WHERE tps.team_id = p_home_team_id AND tps.season = p_season;
+
+    SELECT tps.avg_possession, tps.play_style INTO v_away_poss, v_away_style
+    FROM team_possession_stats tps
+    WHERE tps.team_id = p_away_team_id AND tps.season = p_season;
+
+    v_home_poss := COALESCE(v_home_poss, 50);
+    v_away_poss := COALESCE(v_away_poss, 50);
+    v_home_style := COALESCE(v_home_style, 'BALANCED');
+    v_away_style := COALESCE(v_away_style, 'BALANCED');
+    v_home_poss_factor := ROUND(GREATEST(0.85, LEAST(1.15, 1 + (50 - v_home_poss) * 0.01)), 2);
+    v_away_poss_factor := ROUND(GREATEST(0.85, LEAST(1.15, 1 + (50 - v_away_poss) * 0.01)), 2);
+
+    -- === ARBITRO: statistiche + profilo outlier (max ±15%) ===
+    IF p_referee_id IS NOT NULL THEN
+        SELECT
+            r.name,
+            jsonb_build_object(
+                'name', r.name,
+                'total_matches', r.total_matches,
+                'total_yellows', r.total_yellows,
+                'avg_yellows_per_match', r.avg_yellows_per_match
+            )
+        INTO v_referee_name, v_referee_stats
+        FROM referees r
+        WHERE r.id = p_referee_id;
+
+        SELECT
+            COALESCE(rlc.ref_league_delta, 0),
+            jsonb_build_object(
+                'classification', rlc.referee_profile,
+                'delta', COALESCE(rlc.ref_league_delta, 0),
+                'ref_avg', COALESCE(rlc.ref_avg_yellows, 0),
+                'league_avg', COALESCE(rlc.league_avg_yellows, 0)
+            )
+        INTO v_referee_delta, v_referee_profile
+        FROM match_risk_referee_profile(p_referee_id, p_season) rlc;
+
+        IF v_referee_profile IS NOT NULL THEN
+            v_referee_adjustment := GREATEST(0.85, LEAST(1.15, 1.0 + (v_referee_delta * 0.10)));
+        END IF;
+    END IF;
+
+    -- === LEGA: competizione con più partite della squadra di casa nella stagione ===
+    SELECT c.code INTO v_comp_code
+    FROM matches m
+    JOIN competitions c ON c.id = m.competition_id
+    WHERE p_home_team_id IN (m.home_team_id, m.away_team_id)
+    AND m.season = p_season
+    GROUP BY c.code
+    ORDER BY COUNT(*) DESC
+    LIMIT 1;
+
+    IF v_comp_code IS NOT NULL THEN
+        SELECT COALESCE(lcb.normalization_factor, 1.0) INTO v_league_multiplier
+        FROM league_card_baselines lcb
+        WHERE lcb.competition_code = v_comp_code;
+        v_league_multiplier := COALESCE(v_league_multiplier, 1.0);
+    END IF;
+
+    -- === FALLI SQUADRA ===
+    SELECT
+        tfs.foul_to_card_pct,
+        jsonb_build_object(
+            'avg_fouls_per_match', COALESCE(tfs.avg_fouls_per_match, 0),
+            'avg_yellows_per_match', COALESCE(tfs.avg_yellows_per_match, 0),
+            'foul_to_card_pct', COALESCE(tfs.foul_to_card_pct, 0)
+        )
+    INTO v_home_foul_to_card, v_home_fouls
+    FROM team_fouls_stats tfs
+    WHERE tfs.team_id = p_home_team_id AND tfs.season = p_season;
+
+    SELECT
+        tfs.foul_to_card_pct,
+        jsonb_build_object(
+            'avg_fouls_per_match', COALESCE(tfs.avg_fouls_per_match, 0),
+            'avg_yellows_per_match', COALESCE(tfs.avg_yellows_per_match, 0),
+            'foul_to_card_pct', COALESCE(tfs.foul_to_card_pct, 0)
+        )
+    INTO v_away_foul_to_card, v_away_fouls
+    FROM team_fouls_stats tfs
+    WHERE tfs.team_id = p_away_team_id AND tfs.season = p_season;
+
+    -- Solo le squadre con statistiche (come il tool MCP)
+    v_team_stats := jsonb_strip_nulls(jsonb_build_object('home', v_home_fouls, 'away', v_away_fouls));
+
+    -- === SCORE PER GIOCATORE ===
+    WITH seasonal AS (
+        -- Rose intere (come il tool MCP) con ruolo, falli e possesso squadra già calcolati
+        SELECT
+            s.*,
+            COALESCE(s.yellows_per_90, 0) AS per_90,
+            LEAST(COALESCE(s.yellows_per_90, 0) * 100, 100) AS seasonal_score,
+            CASE WHEN s.is_home THEN c_home_multiplier ELSE c_away_multiplier END AS home_away_multiplier
+        FROM match_risk_squads(p_home_team_id, p_away_team_id, p_season) s
+    ),
+    referee_matches AS (
+        -- Partite dell'arbitro con almeno una delle due squadre
+        SELECT m.id AS match_id
+        FROM matches m
+        WHERE p_referee_id IS NOT NULL
+        AND m.referee_id = p_referee_id
+        AND (m.home_team_id IN (p_home_team_id, p_away_team_id)
+             OR m.away_team_id IN (p_home_team_id, p_away_team_id))
+    ),
+    referee_cards AS (
+        -- Stesso calcolo di get_referee_player_cards (solo giocatori ammoniti almeno una volta)
+        SELECT
+            l.player_id,
+            COUNT(me.id) AS times_booked,
+            COUNT(DISTINCT l.match_id) AS matches_with_referee,
+            ROUND(COUNT(me.id)::NUMERIC / COUNT(DISTINCT l.match_id)::NUMERIC * 100, 1) AS booking_percentage
+        FROM referee_matches rm
+        JOIN lineups l ON l.match_id = rm.match_id
+            AND l.team_id IN (p_home_team_id, p_away_team_id)
+        LEFT JOIN match_events me ON me.match_id = l.match_id
+            AND me.player_id = l.player_id
+            AND me.event_type IN ('YELLOW_CARD', 'RED_CARD')
+        GROUP BY l.player_id
+        HAVING COUNT(me.id) > 0
+    ),
+    h2h AS (
+        -- Scontri diretti solo per i giocatori sopra soglia stagionale
+        SELECT *
+        FROM get_head_to_head_cards_bulk(
+            ARRAY(SELECT DISTINCT player_id FROM seasonal WHERE seasonal_score > c_h2h_threshold),
+            p_home_team_id,
+            p_away_team_id
+        )
+    ),
+    components AS (
+        SELECT
+            s.*,
+            CASE
+                WHEN p_referee_id IS NULL THEN 0
+                WHEN rc.player_id IS NOT NULL THEN rc.booking_percentage
+                ELSE c_default_referee_score
+            END AS referee_score,
+            CASE WHEN rc.player_id IS NOT NULL
+                THEN rc.times_booked || ' in ' || rc.matches_with_referee || ' partite'
+            END AS referee_detail,
+            CASE WHEN s.seasonal_score > c_h2h_threshold AND h.total_h2h_matches > 0
+                THEN h.total_yellows::NUMERIC / h.total_h2h_matches * 100
+                ELSE 0
+            END AS h2h_score,
+            CASE WHEN s.seasonal_score > c_h2h_threshold AND h.total_h2h_matches > 0
+                THEN h.total_yellows || ' in ' || h.total_h2h_matches || ' H2H'
+            END AS h2h_detail,
+            LEAST(
+                (s.team_foul_to_card * 0.5 + LEAST(s.per_90 * 50, 50)) * s.position_multiplier,
+                100
+            ) AS fouls_score
+        FROM seasonal s
+        LEFT JOIN referee_cards rc ON rc.player_id = s.player_id
+        LEFT JOIN h2h h ON h.player_id = s.player_id
+    ),
+    scored AS (
+        SELECT
+            c.*,
+            CASE WHEN p_referee_id IS NOT NULL THEN
+                c.seasonal_score * c_weight_seasonal
+                + c.referee_score * c_weight_referee
+                + c.h2h_score * c_weight_h2h
+                + c.fouls_score * c_weight_fouls
+            ELSE
+                c.seasonal_score * c_weight_seasonal_no_ref
+                + c.h2h_score * c_weight_h2h_no_ref
+                + c.fouls_score * c_weight_fouls_no_ref
+            END AS base_score
+        FROM components c
+    ),
+    ranked AS (
+        SELECT
+            sc.is_home,
+            sc.yellow_cards,
+            sc.player_id,
+            -- Moltiplicatori contestuali (la normalizzazione lega è già nei dati stagionali)
+            ROUND(LEAST(
+                sc.base_score * v_derby_multiplier * sc.home_away_multiplier
+                * v_referee_adjustment * sc.possession_multiplier,
+                100
+            ), 1) AS combined_score,
+            jsonb_build_object(
+                'name', sc.player_name,
+                'team', sc.team_name,
+                'position', sc.position,
+                'combined_score', ROUND(LEAST(
+                    sc.base_score * v_derby_multiplier * sc.home_away_multiplier
+                    * v_referee_adjustment * sc.possession_multiplier,
+                    100
+                ), 1),
+                'base_score', ROUND(sc.base_score, 1),
+                'breakdown', jsonb_build_object(
+                    'seasonal', jsonb_build_object(
+                        'score', ROUND(sc.seasonal_score, 1),
+                        'yellows', COALESCE(sc.yellow_cards, 0),
+                        'matches', COALESCE(sc.matches_played, 0),
+                        'per_90', ROUND(sc.per_90, 2)
+                    ),
+                    'referee', CASE WHEN p_referee_id IS NOT NULL THEN jsonb_build_object(
+                        'score', ROUND(sc.referee_score, 1),
+                        'detail', sc.referee_detail
+                    ) END,
+                    'h2h', jsonb_build_object(
+                        'score', ROUND(sc.h2h_score, 1),
+                        'detail', sc.h2h_detail
+                    ),
+                    'fouls', jsonb_build_object(
+                        'score', ROUND(sc.fouls_score, 1),
+                        'team_foul_to_card_pct', ROUND(sc.team_foul_to_card, 1),
+                        'position_multiplier', sc.position_multiplier
+                    ),
+                    'multipliers', jsonb_build_object(
+                        'derby', v_derby_multiplier,
+                        'home_away', sc.home_away_multiplier,
+                        'referee_adj', v_referee_adjustment,
+                        'possession', sc.possession_multiplier
+                    )
+                )
+            ) AS player
+        FROM scored sc
+    ),
+    positioned AS (
+        SELECT
+            r.*,
+            -- A parità di score stesso ordine del calcolo Python (ordinamento stabile delle rose:
+            -- casa prima della trasferta, poi gialli decrescenti e player_id)
+            ROW_NUMBER() OVER (ORDER BY r.combined_score DESC, r.is_home DESC, r.yellow_cards DESC, r.player_id) AS overall_rank,
+            ROW_NUMBER() OVER (PARTITION BY r.is_home ORDER BY r.combined_score DESC, r.yellow_cards DESC, r.player_id) AS team_rank
+        FROM ranked r
+    )
+    SELECT
+        COALESCE(jsonb_agg(p.player ORDER BY p.team_rank) FILTER (WHERE p.is_home AND p.team_rank <= 5), '[]'::JSONB),
+        COALESCE(jsonb_agg(p.player ORDER BY p.team_rank) FILTER (WHERE NOT p.is_home AND p.team_rank <= 5), '[]'::JSONB),
+        COALESCE(jsonb_agg(p.player ORDER BY p.overall_rank) FILTER (WHERE p.overall_rank <= 5), '[]'::JSONB)
+    INTO v_home_top5, v_away_top5, v_overall_top5
+    FROM positioned p;
+
+    -- === DOCUMENTO FINALE (stessa forma del tool MCP) ===
+    v_analysis := jsonb_build_object(
+        'match', v_home_name || ' vs ' || v_away_name,
+        'referee', COALESCE(v_referee_name, 'Non designato'),
+        'referee_stats', v_referee_stats,
+        'referee_profile', v_referee_profile,
+        'referee_note', CASE WHEN p_referee_id IS NULL
+            THEN 'Arbitro non designato - analisi basata su dati stagionali, H2H e falli'
+        END,
+        'derby', v_derby_json,
+        'possession', jsonb_build_object(
+            'home_avg', v_home_poss,
+            'home_style', v_home_style,
+            'home_factor', v_home_poss_factor,
+            'away_avg', v_away_poss,
+            'away_style', v_away_style,
+            'away_factor', v_away_poss_factor,
+            'diff', ROUND(v_home_poss - v_away_poss, 1)
+        ),
+        'multipliers', jsonb_build_object(
+            'derby', ROUND(v_derby_multiplier, 2),
+            'home_away', jsonb_build_object('home', c_home_multiplier, 'away', c_away_multiplier),
+            'league', v_league_multiplier,
+            'referee_adjustment', ROUND(v_referee_adjustment, 2),
+            'possession', jsonb_build_object('home', v_home_poss_factor, 'away', v_away_poss_factor)
+        ),
+        'team_stats', v_team_stats,
+        'home_team_top5', v_home_top5,
+        'away_team_top5', v_away_top5,
+        'overall_top5', v_overall_top5
+    );
+
+    IF v_comp_code IS NOT NULL THEN
+        v_analysis := v_analysis || jsonb_build_object('competition', v_comp_code);
+    END IF;
+
+    RETURN v_analysis;
+END;
+$$;
+
+COMMENT ON FUNCTION analyze_match_risk_v2 IS 'Analisi rischio cartellino completa (stessi pesi e moltiplicatori di analyze_match_risk). Rose da match_risk_squads, team_stats con chiavi home/away.';
+
+-- 4. Verifica (sostituire con ID reali)
+-- SELECT jsonb_pretty(analyze_match_risk_v2(
+--     (SELECT id FROM teams WHERE name ILIKE '%Inter%' LIMIT 1),
+--     (SELECT id FROM teams WHERE name ILIKE '%Milan%' LIMIT 1),
+--     NULL,
+--     '2025-2026'
+-- ));
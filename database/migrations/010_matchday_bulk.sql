@@ -0,0 +1,109 @@
+-- database/migrations/010_matchday_bulk.sql
+-- Storico arbitro e H2H per tutte le partite di una giornata in una chiamata (analyze_matchday)
+-- Eseguire in Supabase SQL Editor
+
+-- 1. Storico arbitro-giocatore per più partite
+-- Array paralleli: l'elemento i descrive la partita i (arbitro, casa, trasferta)
+-- Stesso conteggio di get_referee_player_cards, ma per ID e solo giocatori ammoniti almeno una volta
+CREATE OR REPLACE FUNCTION get_referee_player_cards_bulk(
+    p_referee_ids UUID[],
+    p_home_team_ids UUID[],
+    p_away_team_ids UUID[]
+)
+RETURNS TABLE (
+    referee_id UUID,
+    player_id UUID,
+    times_booked BIGINT,
+    matches_with_referee BIGINT,
+    booking_percentage NUMERIC
+)
+LANGUAGE sql
+STABLE
+AS $$
+    WITH fixtures AS (
+        SELECT f.referee_id, f.home_team_id, f.away_team_id
+        FROM unnest(p_referee_ids, p_home_team_ids, p_away_team_ids) AS f(referee_id, home_team_id, away_team_id)
+        WHERE f.referee_id IS NOT NULL
+    )
+    SELECT
+        f.referee_id,
+        l.player_id,
+        COUNT(me.id) AS times_booked,
+        COUNT(DISTINCT l.match_id) AS matches_with_referee,
+        ROUND(COUNT(me.id)::NUMERIC / COUNT(DISTINCT l.match_id)::NUMERIC * 100, 1) AS booking_percentage
+    FROM fixtures f
+    JOIN matches m ON m.referee_id = f.referee_id
+    JOIN lineups l ON l.match_id = m.id
+        AND l.team_id IN (f.home_team_id, f.away_team_id)
+    LEFT JOIN match_events me ON me.match_id = l.match_id
+        AND me.player_id = l.player_id
+        AND me.event_type IN ('YELLOW_CARD', 'RED_CARD')
+    GROUP BY f.referee_id, l.player_id
+    HAVING COUNT(me.id) > 0;
+$$;
+
+COMMENT ON FUNCTION get_referee_player_cards_bulk IS 'Storico ammonizioni arbitro-giocatore per più partite (array paralleli arbitro/casa/trasferta).';
+
+-- 2. Storico scontri diretti per più giocatori, ognuno con la propria coppia di squadre
+-- Array paralleli: l'elemento i è il giocatore i e la partita che giocherà (team1, team2)
+CREATE OR REPLACE FUNCTION get_head_to_head_cards_multi(
+    p_player_ids UUID[],
+    p_team1_ids UUID[],
+    p_team2_ids UUID[]
+)
+RETURNS TABLE (
+    player_id UUID,
+    team1_id UUID,
+    team2_id UUID,
+    total_h2h_matches BIGINT,
+    total_yellows BIGINT,
+    total_reds BIGINT
+)
+LANGUAGE sql
+STABLE
+AS $$
+    WITH candidates AS (
+        SELECT DISTINCT c.player_id, c.team1_id, c.team2_id
+        FROM unnest(p_player_ids, p_team1_ids, p_team2_ids) AS c(player_id, team1_id, team2_id)
+    ),
+    player_matches AS (
+        -- Una riga per giocatore/partita con i cartellini ricevuti
+        SELECT
+            c.player_id,
+            c.team1_id,
+            c.team2_id,
+            l.match_id,
+            COUNT(me.id) FILTER (WHERE me.event_type = 'YELLOW_CARD') AS yellows,
+            COUNT(me.id) FILTER (WHERE me.event_type = 'RED_CARD') AS reds
+        FROM candidates c
+        JOIN matches m ON m.status = 'FINISHED'
+            AND (
+                (m.home_team_id = c.team1_id AND m.away_team_id = c.team2_id)
+                OR (m.home_team_id = c.team2_id AND m.away_team_id = c.team1_id)
+            )
+        JOIN lineups l ON l.match_id = m.id AND l.player_id = c.player_id
+        LEFT JOIN match_events me ON me.match_id = l.match_id
+            AND me.player_id = l.player_id
+            AND me.event_type IN ('YELLOW_CARD', 'RED_CARD')
+        GROUP BY c.player_id, c.team1_id, c.team2_id, l.match_id
+    )
+    SELECT
+        pm.player_id,
+        pm.team1_id,
+        pm.team2_id,
+        COUNT(*) AS total_h2h_matches,
+        SUM(pm.yellows)::BIGINT AS total_yellows,
+        SUM(pm.reds)::BIGINT AS total_reds
+    FROM player_matches pm
+    GROUP BY pm.player_id, pm.team1_id, pm.team2_id;
+$$;
+
+COMMENT ON FUNCTION get_head_to_head_cards_multi IS 'Storico cartellini negli scontri diretti per più giocatori, ognuno con la sua coppia di squadre (array paralleli).';
+
+-- 3. Verifica (sostituire con ID reali)
+-- SELECT * FROM get_referee_player_cards_bulk(
+--     ARRAY['<referee_id>']::UUID[], ARRAY['<inter_id>']::UUID[], ARRAY['<milan_id>']::UUID[]
+-- );
+-- SELECT * FROM get_head_to_head_cards_multi(
+--     ARRAY['<player_id>']::UUID[], ARRAY['<inter_id>']::UUID[], ARRAY['<milan_id>']::UUID[]
+-- );
@@ -0,0 +1,197 @@
+-- database/migrations/011_player_risk_features.sql
+-- Snapshot delle feature di rischio per giocatore/squadra/stagione, ricalcolato a fine sync
+-- L'analisi legge lo snapshot per chiave invece di aggregare lineups × matches × match_events
+-- Eseguire in Supabase SQL Editor DOPO 001-010
+
+-- 1. Tabella snapshot
+-- Una riga per giocatore/squadra/stagione (tutte le competizioni insieme)
+CREATE TABLE IF NOT EXISTS player_risk_features (
+    player_id UUID NOT NULL REFERENCES players(id) ON DELETE CASCADE,
+    team_id UUID NOT NULL REFERENCES teams(id) ON DELETE CASCADE,
+    season TEXT NOT NULL,
+    player_name TEXT NOT NULL,
+    team_name TEXT NOT NULL,
+    position TEXT,
+    competitions TEXT,
+    matches_played INTEGER NOT NULL DEFAULT 0,
+    yellow_cards INTEGER NOT NULL DEFAULT 0,
+    red_cards INTEGER NOT NULL DEFAULT 0,
+    minutes_played INTEGER NOT NULL DEFAULT 0,
+    yellows_per_90 NUMERIC(5,2),                            -- NULL sotto i 90 minuti
+    position_multiplier NUMERIC(3,2) NOT NULL DEFAULT 1.0,  -- 1.2 per Midfield/Defence
+    team_foul_to_card_pct NUMERIC(5,1) NOT NULL DEFAULT 0,  -- da team_fouls_stats
+    possession_factor NUMERIC(3,2) NOT NULL DEFAULT 1.0,    -- da team_possession_stats (0.85-1.15)
+    refreshed_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (player_id, team_id, season)
+);
+
+CREATE INDEX IF NOT EXISTS idx_player_risk_features_team_season ON player_risk_features(team_id, season);
+CREATE INDEX IF NOT EXISTS idx_player_risk_features_season_yellows ON player_risk_features(season, yellow_cards DESC);
+
+COMMENT ON TABLE player_risk_features IS 'Feature di rischio per giocatore/squadra/stagione (gialli/90, minuti, ruolo, falli e possesso squadra). Ricalcolata da refresh_player_risk_features a fine sync.';
+
+-- 2. Funzione di ricalcolo
+-- p_team_ids = NULL ricalcola tutte le squadre della stagione, altrimenti solo quelle indicate
+CREATE OR REPLACE FUNCTION refresh_player_risk_features(
+    p_season TEXT DEFAULT '2025-2026',
+    p_team_ids UUID[] DEFAULT NULL
+)
+RETURNS INTEGER
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_updated INTEGER;
+    v_refreshed_at TIMESTAMPTZ := NOW();
+BEGIN
+    WITH player_matches AS (
+        -- Una riga per giocatore/partita: i minuti non vengono moltiplicati dai cartellini
+        SELECT
+            l.player_id,
+            l.team_id,
+            l.match_id,
+            m.competition_id,
+            l.is_starter,
+            l.subbed_in_minute,
+            l.minutes_played,
+            COUNT(me.id) FILTER (WHERE me.event_type = 'YELLOW_CARD') AS yellows,
+            COUNT(me.id) FILTER (WHERE me.event_type = 'RED_CARD') AS reds
+        FROM lineups l
+        JOIN matches m ON m.id = l.match_id
+        LEFT JOIN match_events me ON me.match_id = l.match_id
+            AND me.player_id = l.player_id
+            AND me.event_type IN ('YELLOW_CARD', 'RED_CARD')
+        WHERE m.status = 'FINISHED'
+          AND m.season = p_season
+          AND (p_team_ids IS NULL OR l.team_id = ANY(p_team_ids))
+        GROUP BY l.player_id, l.team_id, l.match_id, m.competition_id, l.is_starter, l.subbed_in_minute, l.minutes_played
+    ),
+    player_totals AS (
+        SELECT
+            pm.player_id,
+            pm.team_id,
+            STRING_AGG(DISTINCT c.code, ', ') AS competitions,
+            -- Presenze e minuti come in refresh_player_season_stats (007): panchinari non entrati esclusi
+            COUNT(*) FILTER (WHERE pm.is_starter OR pm.subbed_in_minute IS NOT NULL) AS matches_played,
+            SUM(pm.yellows) AS yellow_cards,
+            SUM(pm.reds) AS red_cards,
+            -- minutes_played valorizzato solo per i sostituiti: titolare non sostituito = 90
+            SUM(CASE
+                WHEN pm.minutes_played IS NOT NULL THEN pm.minutes_played
+                WHEN pm.is_starter THEN 90
+                ELSE 0
+            END) AS minutes_played
+        FROM player_matches pm
+        LEFT JOIN competitions c ON c.id = pm.competition_id
+        GROUP BY pm.player_id, pm.team_id
+    )
+    INSERT INTO player_risk_features (
+        player_id, team_id, season, player_name, team_name, position, competitions,
+        matches_played, yellow_cards, red_cards, minutes_played, yellows_per_90,
+        position_multiplier, team_foul_to_card_pct, possession_factor, refreshed_at
+    )
+    SELECT
+        pt.player_id,
+        pt.team_id,
+        p_season,
+        p.name,
+        t.name,
+        p.position,
+        pt.competitions,
+        pt.matches_played,
+        pt.yellow_cards,
+        pt.red_cards,
+        pt.minutes_played,
+        CASE
+            WHEN pt.minutes_played >= 90 THEN ROUND(pt.yellow_cards::NUMERIC / (pt.minutes_played::NUMERIC / 90), 2)
+            ELSE NULL
+        END,
+        CASE WHEN p.position IN ('Midfield', 'Defence') THEN 1.2 ELSE 1.0 END,
+        COALESCE(tfs.foul_to_card_pct, 0),
+        -- Stessa formula di get_possession_factor (possesso medio 50% se mancano statistiche)
+        ROUND(GREATEST(0.85, LEAST(1.15, 1 + (50 - COALESCE(tps.avg_possession, 50)) * 0.01)), 2),
+        v_refreshed_at
+    FROM player_totals pt
+    JOIN players p ON p.id = pt.player_id
+    JOIN teams t ON t.id = pt.team_id
+    LEFT JOIN team_fouls_stats tfs ON tfs.team_id = pt.team_id AND tfs.season = p_season
+    LEFT JOIN team_possession_stats tps ON tps.team_id = pt.team_id AND tps.season = p_season
+    ON CONFLICT (player_id, team_id, season) DO UPDATE SET
+        player_name = EXCLUDED.player_name,
+        team_name = EXCLUDED.team_name,
+        position = EXCLUDED.position,
+        competitions = EXCLUDED.competitions,
+        matches_played = EXCLUDED.matches_played,
+        yellow_cards = EXCLUDED.yellow_cards,
+        red_cards = EXCLUDED.red_cards,
+        minutes_played = EXCLUDED.minutes_played,
+        yellows_per_90 = EXCLUDED.yellows_per_90,
+        position_multiplier = EXCLUDED.position_multiplier,
+        team_foul_to_card_pct = EXCLUDED.team_foul_to_card_pct,
+        possession_factor = EXCLUDED.possession_factor,
+        refreshed_at = EXCLUDED.refreshed_at;
+
+    GET DIAGNOSTICS v_updated = ROW_COUNT;
+
+    -- Rimuove i giocatori non più presenti (es. partite cancellate o rinviate) per le squadre ricalcolate
+    DELETE FROM player_risk_features prf
+    WHERE prf.season = p_season
+      AND prf.refreshed_at < v_refreshed_at
+      AND (p_team_ids IS NULL OR prf.team_id = ANY(p_team_ids));
+
+    RETURN v_updated;
+END;
+$$;
+
+COMMENT ON FUNCTION refresh_player_risk_features IS 'Ricalcola lo snapshot player_risk_features di una stagione per le squadre indicate (NULL = tutte)';
+
+-- 3. analyze_match_risk_v2 legge le rose dallo snapshot
+-- Ridefinisce solo match_risk_squads (009): lettura per chiave, senza aggregare lineups/eventi
+CREATE OR REPLACE FUNCTION match_risk_squads(
+    p_home_team_id UUID,
+    p_away_team_id UUID,
+    p_season TEXT
+)
+RETURNS TABLE (
+    player_id UUID,
+    player_name TEXT,
+    team_name TEXT,
+    "position" TEXT,
+    is_home BOOLEAN,
+    matches_played BIGINT,
+    yellow_cards BIGINT,
+    yellows_per_90 NUMERIC,
+    position_multiplier NUMERIC,
+    team_foul_to_card NUMERIC,
+    possession_multiplier NUMERIC
+)
+LANGUAGE sql
+STABLE
+AS $$
+    SELECT
+        prf.player_id,
+        prf.player_name,
+        prf.team_name,
+        prf.position,
+        prf.team_id = p_home_team_id,
+        prf.matches_played::BIGINT,
+        prf.yellow_cards::BIGINT,
+        prf.yellows_per_90,
+        prf.position_multiplier,
+        prf.team_foul_to_card_pct,
+        prf.possession_factor
+    FROM player_risk_features prf
+    WHERE prf.team_id IN (p_home_team_id, p_away_team_id)
+    AND prf.season = p_season;
+$$;
+
+COMMENT ON FUNCTION match_risk_squads IS 'Rose di casa/trasferta per analyze_match_risk_v2, dallo snapshot player_risk_features';
+
+-- 4. Popolamento iniziale (tutte le stagioni presenti) e verifica
+SELECT s.season, refresh_player_risk_features(s.season) AS righe_aggiornate
+FROM (SELECT DISTINCT season FROM matches) s;
+SELECT player_name, team_name, position, matches_played, yellow_cards, minutes_played,
+       yellows_per_90, position_multiplier, team_foul_to_card_pct, possession_factor
+FROM player_risk_features
+WHERE season = '2025-2026'
+ORDER BY yellow_cards DESC
+LIMIT 10;
@@ -0,0 +1,89 @@
+-- database/migrations/012_keyset_pagination.sql
+-- Paginazione a cursore (keyset) per i tool MCP che restituiscono liste
+-- Ogni pagina riparte dall'ultima riga vista (colonne di ordinamento + ID) invece di un OFFSET
+-- Eseguire in Supabase SQL Editor DOPO 001-011
+
+-- 1. Indici sulle colonne di ordinamento (l'ultima colonna rende l'ordine univoco)
+-- get_teams: ORDER BY name, id
+CREATE INDEX IF NOT EXISTS idx_teams_name_id ON teams(name, id);
+
+-- get_referees: solo arbitri con partite, ORDER BY avg_yellows_per_match DESC, id
+CREATE INDEX IF NOT EXISTS idx_referees_avg_yellows_id ON referees(avg_yellows_per_match DESC, id)
+WHERE total_matches > 0;
+
+-- get_team_players: squadra/stagione, ORDER BY yellow_cards DESC, player_id
+CREATE INDEX IF NOT EXISTS idx_player_risk_features_team_page
+ON player_risk_features(team_name, season, yellow_cards DESC, player_id);
+
+-- get_match_statistics: stagione, ORDER BY match_date DESC, id DESC
+CREATE INDEX IF NOT EXISTS idx_matches_season_date_id ON matches(season, match_date DESC, id DESC);
+
+-- 2. Pagina di statistiche partita
+-- L'ordinamento è sulla data della partita (tabella matches): PostgREST non può applicare
+-- il cursore su una colonna di una tabella embedded, quindi la pagina si calcola qui.
+-- Con p_team_name restituisce solo le righe della squadra (con l'avversaria), altrimenti tutte.
+-- Cursore: (p_before_date, p_before_id) = data partita e ID riga dell'ultimo elemento visto.
+CREATE OR REPLACE FUNCTION get_match_statistics_page(
+    p_season TEXT DEFAULT '2025-2026',
+    p_team_name TEXT DEFAULT NULL,
+    p_before_date TIMESTAMPTZ DEFAULT NULL,
+    p_before_id UUID DEFAULT NULL,
+    p_limit INTEGER DEFAULT 10
+)
+RETURNS TABLE (
+    id UUID,
+    match_id UUID,
+    match_date TIMESTAMPTZ,
+    team TEXT,
+    opponent TEXT,
+    is_home BOOLEAN,
+    ball_possession INTEGER,
+    fouls_committed INTEGER,
+    fouls_suffered INTEGER,
+    total_shots INTEGER,
+    shots_on_goal INTEGER,
+    shots_off_goal INTEGER,
+    corner_kicks INTEGER,
+    yellow_cards INTEGER,
+    red_cards INTEGER,
+    saves INTEGER,
+    offsides INTEGER
+)
+LANGUAGE sql
+STABLE
+AS $$
+    SELECT
+        ms.id,
+        m.id AS match_id,
+        m.match_date,
+        t.name::TEXT AS team,
+        opp.name::TEXT AS opponent,
+        ms.team_id = m.home_team_id AS is_home,
+        ms.ball_possession,
+        ms.fouls_committed,
+        ms.fouls_suffered,
+        ms.total_shots,
+        ms.shots_on_goal,
+        ms.shots_off_goal,
+        ms.corner_kicks,
+        ms.yellow_cards,
+        ms.red_cards,
+        ms.saves,
+        ms.offsides
+    FROM matches m
+    JOIN match_statistics ms ON ms.match_id = m.id
+    JOIN teams t ON t.id = ms.team_id
+    JOIN teams opp ON opp.id = CASE WHEN ms.team_id = m.home_team_id THEN m.away_team_id ELSE m.home_team_id END
+    WHERE m.season = p_season
+      AND (p_team_name IS NULL OR t.name ILIKE '%' || p_team_name || '%')
+      AND (p_before_date IS NULL OR (m.match_date, ms.id) < (p_before_date, p_before_id))
+    ORDER BY m.match_date DESC, ms.id DESC
+    LIMIT p_limit;
+$$;
+
+COMMENT ON FUNCTION get_match_statistics_page IS 'Statistiche partita per stagione (e squadra), paginate a cursore su (match_date, id) decrescenti';
+
+-- 3. Verifica
+SELECT * FROM get_match_statistics_page('2025-2026', 'Inter', NULL, NULL, 5);
+-- Pagina successiva: passare match_date e id dell'ultima riga
+-- SELECT * FROM get_match_statistics_page('2025-2026', 'Inter', '<match_date>', '<id>', 5);
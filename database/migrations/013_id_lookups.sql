@@ -0,0 +1,333 @@
+-- database/migrations/013_id_lookups.sql
+-- Varianti per ID delle funzioni che risolvevano i nomi con LIKE '%nome%' (scansione completa,
+-- riga arbitraria se più nomi corrispondono). I nomi ora si risolvono nel server MCP
+-- (name_resolver.py) e le query ricevono direttamente gli ID.
+-- Eseguire in Supabase SQL Editor DOPO 001-012
+
+-- 1. Statistiche giocatore per competizione
+CREATE OR REPLACE FUNCTION get_player_season_stats_by_id(
+    p_player_id UUID,
+    p_season TEXT DEFAULT NULL,
+    p_competition TEXT DEFAULT NULL
+)
+RETURNS TABLE (
+    player_name TEXT,
+    team_name TEXT,
+    competition_code VARCHAR(10),
+    competition_name VARCHAR(100),
+    season VARCHAR(10),
+    matches_played BIGINT,
+    yellow_cards BIGINT,
+    red_cards BIGINT,
+    minutes_played NUMERIC,
+    yellows_per_90 NUMERIC
+)
+LANGUAGE sql
+STABLE
+AS $$
+    SELECT
+        psc.player_name::TEXT,
+        psc.team_name::TEXT,
+        psc.competition_code,
+        psc.competition_name::VARCHAR(100),
+        psc.season,
+        psc.matches_played,
+        psc.yellow_cards,
+        psc.red_cards,
+        psc.minutes_played,
+        psc.yellows_per_90
+    FROM player_season_cards psc
+    WHERE psc.player_id = p_player_id
+    AND (p_season IS NULL OR psc.season = p_season)
+    AND (p_competition IS NULL OR psc.competition_code = p_competition)
+    ORDER BY psc.season DESC, psc.competition_code, psc.yellow_cards DESC;
+$$;
+
+COMMENT ON FUNCTION get_player_season_stats_by_id IS 'Come get_player_season_stats, per ID giocatore';
+
+-- 2. Statistiche giocatore totali (tutte le competizioni)
+CREATE OR REPLACE FUNCTION get_player_season_stats_total_by_id(
+    p_player_id UUID,
+    p_season TEXT DEFAULT NULL
+)
+RETURNS TABLE (
+    player_name TEXT,
+    team_name TEXT,
+    season VARCHAR(10),
+    matches_played BIGINT,
+    yellow_cards BIGINT,
+    red_cards BIGINT,
+    minutes_played NUMERIC,
+    yellows_per_90 NUMERIC,
+    competitions TEXT
+)
+LANGUAGE sql
+STABLE
+AS $$
+    SELECT
+        psc.player_name::TEXT,
+        psc.team_name::TEXT,
+        psc.season,
+        psc.matches_played,
+        psc.yellow_cards,
+        psc.red_cards,
+        psc.minutes_played,
+        psc.yellows_per_90,
+        psc.competitions::TEXT
+    FROM player_season_cards_total psc
+    WHERE psc.player_id = p_player_id
+    AND (p_season IS NULL OR psc.season = p_season)
+    ORDER BY psc.season DESC, psc.yellow_cards DESC;
+$$;
+
+COMMENT ON FUNCTION get_player_season_stats_total_by_id IS 'Come get_player_season_stats_total, per ID giocatore';
+
+-- 3. Storico arbitro-giocatore per due squadre (con player_id, usato da analyze_match_risk)
+CREATE OR REPLACE FUNCTION get_referee_player_cards_by_id(
+    p_referee_id UUID,
+    p_team1_id UUID,
+    p_team2_id UUID
+)
+RETURNS TABLE (
+    player_id UUID,
+    referee_name TEXT,
+    player_name TEXT,
+    team_name TEXT,
+    times_booked BIGINT,
+    matches_with_referee BIGINT,
+    booking_percentage NUMERIC,
+    last_booking DATE,
+    booking_details JSON
+)
+LANGUAGE sql
+STABLE
+AS $$
+    WITH referee_team_matches AS (
+        -- Partite dove l'arbitro ha arbitrato una delle due squadre
+        SELECT DISTINCT m.id AS match_id
+        FROM matches m
+        WHERE m.referee_id = p_referee_id
+        AND (m.home_team_id IN (p_team1_id, p_team2_id)
+             OR m.away_team_id IN (p_team1_id, p_team2_id))
+    ),
+    player_bookings AS (
+        -- Cartellini dei giocatori in quelle partite
+        SELECT
+            p.id AS player_id,
+            p.name AS player_name,
+            t.name AS team_name,
+            COUNT(CASE WHEN me.event_type = 'YELLOW_CARD' THEN 1 END) AS yellows,
+            COUNT(CASE WHEN me.event_type = 'RED_CARD' THEN 1 END) AS reds,
+            COUNT(DISTINCT m.id) AS total_matches,
+            MAX(m.match_date)::DATE AS last_booking,
+            JSON_AGG(
+                JSON_BUILD_OBJECT(
+                    'date', m.match_date,
+                    'match', CONCAT(ht.name, ' vs ', at.name),
+                    'card', me.event_type,
+                    'minute', me.minute
+                ) ORDER BY m.match_date DESC
+            ) FILTER (WHERE me.event_type IS NOT NULL) AS details
+        FROM referee_team_matches rtm
+        JOIN matches m ON rtm.match_id = m.id
+        JOIN lineups l ON l.match_id = m.id AND l.team_id IN (p_team1_id, p_team2_id)
+        JOIN players p ON l.player_id = p.id
+        JOIN teams t ON l.team_id = t.id
+        JOIN teams ht ON m.home_team_id = ht.id
+        JOIN teams at ON m.away_team_id = at.id
+        LEFT JOIN match_events me ON me.match_id = m.id
+            AND me.player_id = p.id
+            AND me.event_type IN ('YELLOW_CARD', 'RED_CARD')
+        GROUP BY p.id, p.name, t.name
+    )
+    SELECT
+        pb.player_id,
+        r.name::TEXT AS referee_name,
+        pb.player_name::TEXT,
+        pb.team_name::TEXT,
+        (pb.yellows + pb.reds) AS times_booked,
+        pb.total_matches AS matches_with_referee,
+        CASE
+            WHEN pb.total_matches > 0 THEN
+                ROUND(((pb.yellows + pb.reds)::NUMERIC / pb.total_matches::NUMERIC) * 100, 1)
+            ELSE 0
+        END AS booking_percentage,
+        pb.last_booking,
+        pb.details AS booking_details
+    FROM player_bookings pb
+    CROSS JOIN referees r
+    WHERE r.id = p_referee_id
+    AND (pb.yellows + pb.reds) > 0
+    ORDER BY (pb.yellows + pb.reds) DESC, pb.total_matches DESC;
+$$;
+
+COMMENT ON FUNCTION get_referee_player_cards_by_id IS 'Come get_referee_player_cards, per ID (arbitro e squadre), con player_id';
+
+-- 4. Cartellini di un giocatore negli scontri diretti
+CREATE OR REPLACE FUNCTION get_head_to_head_cards_by_id(
+    p_player_id UUID,
+    p_team1_id UUID,
+    p_team2_id UUID
+)
+RETURNS TABLE (
+    player_name TEXT,
+    team_name TEXT,
+    opponent TEXT,
+    total_h2h_matches BIGINT,
+    total_yellows BIGINT,
+    total_reds BIGINT,
+    card_percentage NUMERIC,
+    match_details JSON
+)
+LANGUAGE sql
+STABLE
+AS $$
+    WITH h2h_matches AS (
+        -- Scontri diretti tra le due squadre
+        SELECT m.id AS match_id, m.match_date, m.season,
+               ht.name AS home_team, at.name AS away_team,
+               r.name AS referee_name
+        FROM matches m
+        JOIN teams ht ON m.home_team_id = ht.id
+        JOIN teams at ON m.away_team_id = at.id
+        LEFT JOIN referees r ON m.referee_id = r.id
+        WHERE m.status = 'FINISHED'
+        AND (
+            (m.home_team_id = p_team1_id AND m.away_team_id = p_team2_id)
+            OR (m.home_team_id = p_team2_id AND m.away_team_id = p_team1_id)
+        )
+    ),
+    player_h2h AS (
+        -- Partecipazione del giocatore a questi scontri
+        SELECT
+            h2h.match_id,
+            h2h.match_date,
+            h2h.season,
+            h2h.home_team,
+            h2h.away_team,
+            h2h.referee_name,
+            p.name AS player_name,
+            t.name AS player_team,
+            CASE
+                WHEN t.id = p_team1_id THEN (SELECT name FROM teams WHERE id = p_team2_id)
+                ELSE (SELECT name FROM teams WHERE id = p_team1_id)
+            END AS opponent_name,
+            COUNT(CASE WHEN me.event_type = 'YELLOW_CARD' THEN 1 END) AS yellows,
+            COUNT(CASE WHEN me.event_type = 'RED_CARD' THEN 1 END) AS reds,
+            me.minute AS card_minute
+        FROM h2h_matches h2h
+        JOIN lineups l ON l.match_id = h2h.match_id AND l.player_id = p_player_id
+        JOIN players p ON p.id = p_player_id
+        JOIN teams t ON l.team_id = t.id
+        LEFT JOIN match_events me ON me.match_id = h2h.match_id
+            AND me.player_id = p_player_id
+            AND me.event_type IN ('YELLOW_CARD', 'RED_CARD')
+        GROUP BY h2h.match_id, h2h.match_date, h2h.season, h2h.home_team,
+                 h2h.away_team, h2h.referee_name, p.name, t.name, t.id, me.minute
+    )
+    SELECT
+        MAX(ph.player_name)::TEXT AS player_name,
+        MAX(ph.player_team)::TEXT AS team_name,
+        MAX(ph.opponent_name)::TEXT AS opponent,
+        COUNT(DISTINCT ph.match_id) AS total_h2h_matches,
+        SUM(ph.yellows) AS total_yellows,
+        SUM(ph.reds) AS total_reds,
+        CASE
+            WHEN COUNT(DISTINCT ph.match_id) > 0 THEN
+                ROUND((SUM(ph.yellows) + SUM(ph.reds))::NUMERIC / COUNT(DISTINCT ph.match_id)::NUMERIC * 100, 1)
+            ELSE 0
+        END AS card_percentage,
+        JSON_AGG(
+            JSON_BUILD_OBJECT(
+                'date', ph.match_date,
+                'season', ph.season,
+                'match', CONCAT(ph.home_team, ' vs ', ph.away_team),
+                'referee', ph.referee_name,
+                'yellow', ph.yellows > 0,
+                'red', ph.reds > 0,
+                'minute', ph.card_minute
+            ) ORDER BY ph.match_date DESC
+        ) AS match_details
+    FROM player_h2h ph
+    GROUP BY ph.player_name;
+$$;
+
+COMMENT ON FUNCTION get_head_to_head_cards_by_id IS 'Come get_head_to_head_cards, per ID (giocatore e squadre)';
+
+-- 5. Pagina statistiche partita filtrata per ID squadra (sostituisce la versione per nome della 012)
+DROP FUNCTION IF EXISTS get_match_statistics_page(TEXT, TEXT, TIMESTAMPTZ, UUID, INTEGER);
+
+CREATE OR REPLACE FUNCTION get_match_statistics_page(
+    p_season TEXT DEFAULT '2025-2026',
+    p_team_id UUID DEFAULT NULL,
+    p_before_date TIMESTAMPTZ DEFAULT NULL,
+    p_before_id UUID DEFAULT NULL,
+    p_limit INTEGER DEFAULT 10
+)
+RETURNS TABLE (
+    id UUID,
+    match_id UUID,
+    match_date TIMESTAMPTZ,
+    team TEXT,
+    opponent TEXT,
+    is_home BOOLEAN,
+    ball_possession INTEGER,
+    fouls_committed INTEGER,
+    fouls_suffered INTEGER,
+    total_shots INTEGER,
+    shots_on_goal INTEGER,
+    shots_off_goal INTEGER,
+    corner_kicks INTEGER,
+    yellow_cards INTEGER,
+    red_cards INTEGER,
+    saves INTEGER,
+    offsides INTEGER
+)
+LANGUAGE sql
+STABLE
+AS $$
+    SELECT
+        ms.id,
+        m.id AS match_id,
+        m.match_date,
+        t.name::TEXT AS team,
+        opp.name::TEXT AS opponent,
+        ms.team_id = m.home_team_id AS is_home,
+        ms.ball_possession,
+        ms.fouls_committed,
+        ms.fouls_suffered,
+        ms.total_shots,
+        ms.shots_on_goal,
+        ms.shots_off_goal,
+        ms.corner_kicks,
+        ms.yellow_cards,
+        ms.red_cards,
+        ms.saves,
+        ms.offsides
+    FROM matches m
+    JOIN match_statistics ms ON ms.match_id = m.id
+    JOIN teams t ON t.id = ms.team_id
+    JOIN teams opp ON opp.id = CASE WHEN ms.team_id = m.home_team_id THEN m.away_team_id ELSE m.home_team_id END
+    WHERE m.season = p_season
+      AND (p_team_id IS NULL OR ms.team_id = p_team_id)
+      AND (p_before_date IS NULL OR (m.match_date, ms.id) < (p_before_date, p_before_id))
+    ORDER BY m.match_date DESC, ms.id DESC
+    LIMIT p_limit;
+$$;
+
+COMMENT ON FUNCTION get_match_statistics_page IS 'Statistiche partita per stagione (e squadra), paginate a cursore su (match_date, id) decrescenti';
+
+-- 6. Indici per le letture per ID
+-- get_team_players: squadra per ID invece che per nome
+DROP INDEX IF EXISTS idx_player_risk_features_team_page;
+CREATE INDEX IF NOT EXISTS idx_player_risk_features_team_page
+ON player_risk_features(team_id, season, yellow_cards DESC, player_id);
+
+-- Statistiche squadra per ID
+CREATE INDEX IF NOT EXISTS idx_match_stats_team ON match_statistics(team_id);
+
+-- 7. Verifica (sostituire con ID reali)
+-- SELECT * FROM get_player_season_stats_by_id('<barella_id>', '2025-2026');
+-- SELECT * FROM get_referee_player_cards_by_id('<referee_id>', '<inter_id>', '<milan_id>');
+-- SELECT * FROM get_head_to_head_cards_by_id('<barella_id>', '<inter_id>', '<milan_id>');
+-- SELECT * FROM get_match_statistics_page('2025-2026', '<inter_id>', NULL, NULL, 5);
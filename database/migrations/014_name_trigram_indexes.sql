@@ -0,0 +1,377 @@
+-- database/migrations/014_name_trigram_indexes.sql
+-- Ricerca nomi lato DB servita da indici: colonna name_normalized (minuscolo, senza accenti)
+-- su teams, players e referees con indici trigrammi (pg_trgm). LIKE '%x%' su LOWER(name)
+-- non può usare nessun indice btree: con gli indici GIN trigrammi la ricerca resta
+-- sotto il millisecondo anche con decine di migliaia di giocatori.
+-- Le funzioni che accettano nomi li cercano ora su name_normalized.
+-- Eseguire in Supabase SQL Editor DOPO 001-013
+
+-- 1. Estensioni (su Supabase vanno nello schema extensions)
+CREATE EXTENSION IF NOT EXISTS pg_trgm WITH SCHEMA extensions;
+CREATE EXTENSION IF NOT EXISTS unaccent WITH SCHEMA extensions;
+
+-- 2. Normalizzazione nomi (stessa di name_resolver.fold nel server MCP)
+-- unaccent() non è IMMUTABLE (dipende dal dizionario di default): con il dizionario
+-- esplicito il wrapper può essere usato in colonne generate e indici.
+CREATE OR REPLACE FUNCTION normalize_name(p_name TEXT)
+RETURNS TEXT
+LANGUAGE sql
+IMMUTABLE
+PARALLEL SAFE
+STRICT
+AS $$
+    SELECT TRIM(REGEXP_REPLACE(
+        LOWER(extensions.unaccent('extensions.unaccent'::regdictionary, p_name)),
+        '[^a-z0-9]+', ' ', 'g'
+    ));
+$$;
+
+COMMENT ON FUNCTION normalize_name IS 'Nome normalizzato: minuscolo, senza accenti, punteggiatura sostituita da spazi';
+
+-- 3. Colonne generate
+ALTER TABLE teams ADD COLUMN IF NOT EXISTS name_normalized TEXT
+    GENERATED ALWAYS AS (normalize_name(name)) STORED;
+ALTER TABLE players ADD COLUMN IF NOT EXISTS name_normalized TEXT
+    GENERATED ALWAYS AS (normalize_name(name)) STORED;
+ALTER TABLE referees ADD COLUMN IF NOT EXISTS name_normalized TEXT
+    GENERATED ALWAYS AS (normalize_name(name)) STORED;
+
+-- 4. Indici trigrammi (servono LIKE '%x%' e la similarità)
+CREATE INDEX IF NOT EXISTS idx_teams_name_trgm
+ON teams USING GIN (name_normalized extensions.gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_players_name_trgm
+ON players USING GIN (name_normalized extensions.gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_referees_name_trgm
+ON referees USING GIN (name_normalized extensions.gin_trgm_ops);
+
+-- 5. Risoluzione nome -> ID (il più simile tra quelli che contengono il nome cercato)
+CREATE OR REPLACE FUNCTION find_team_id(p_name TEXT)
+RETURNS UUID
+LANGUAGE sql
+STABLE
+AS $$
+    SELECT t.id
+    FROM teams t
+    WHERE t.name_normalized LIKE '%' || normalize_name(p_name) || '%'
+    ORDER BY extensions.similarity(t.name_normalized, normalize_name(p_name)) DESC, t.name
+    LIMIT 1;
+$$;
+
+CREATE OR REPLACE FUNCTION find_player_id(p_name TEXT)
+RETURNS UUID
+LANGUAGE sql
+STABLE
+AS $$
+    SELECT p.id
+    FROM players p
+    WHERE p.name_normalized LIKE '%' || normalize_name(p_name) || '%'
+    ORDER BY extensions.similarity(p.name_normalized, normalize_name(p_name)) DESC, p.name
+    LIMIT 1;
+$$;
+
+CREATE OR REPLACE FUNCTION find_referee_id(p_name TEXT)
+RETURNS UUID
+LANGUAGE sql
+STABLE
+AS $$
+    SELECT r.id
+    FROM referees r
+    WHERE r.name_normalized LIKE '%' || normalize_name(p_name) || '%'
+    ORDER BY extensions.similarity(r.name_normalized, normalize_name(p_name)) DESC, r.name
+    LIMIT 1;
+$$;
+
+COMMENT ON FUNCTION find_team_id IS 'ID della squadra più simile tra quelle il cui nome contiene p_name (senza accenti)';
+COMMENT ON FUNCTION find_player_id IS 'ID del giocatore più simile tra quelli il cui nome contiene p_name (senza accenti)';
+COMMENT ON FUNCTION find_referee_id IS 'ID dell''arbitro più simile tra quelli il cui nome contiene p_name (senza accenti)';
+
+-- 6. Funzioni per nome riscritte sugli indici
+-- Statistiche giocatore: tutti i giocatori il cui nome contiene quello cercato (come prima)
+CREATE OR REPLACE FUNCTION get_player_season_stats(
+    p_player_name TEXT,
+    p_season TEXT DEFAULT NULL,
+    p_competition TEXT DEFAULT NULL
+)
+RETURNS TABLE (
+    player_name TEXT,
+    team_name TEXT,
+    competition_code VARCHAR(10),
+    competition_name VARCHAR(100),
+    season VARCHAR(10),
+    matches_played BIGINT,
+    yellow_cards BIGINT,
+    red_cards BIGINT,
+    minutes_played NUMERIC,
+    yellows_per_90 NUMERIC
+)
+LANGUAGE sql
+STABLE
+AS $$
+    SELECT
+        psc.player_name::TEXT,
+        psc.team_name::TEXT,
+        psc.competition_code,
+        psc.competition_name::VARCHAR(100),
+        psc.season,
+        psc.matches_played,
+        psc.yellow_cards,
+        psc.red_cards,
+        psc.minutes_played,
+        psc.yellows_per_90
+    FROM player_season_cards psc
+    WHERE psc.player_id IN (
+        SELECT p.id FROM players p
+        WHERE p.name_normalized LIKE '%' || normalize_name(p_player_name) || '%'
+    )
+    AND (p_season IS NULL OR psc.season = p_season)
+    AND (p_competition IS NULL OR psc.competition_code = p_competition)
+    ORDER BY psc.season DESC, psc.competition_code, psc.yellow_cards DESC;
+$$;
+
+CREATE OR REPLACE FUNCTION get_player_season_stats_total(
+    p_player_name TEXT,
+    p_season TEXT DEFAULT NULL
+)
+RETURNS TABLE (
+    player_name TEXT,
+    team_name TEXT,
+    season VARCHAR(10),
+    matches_played BIGINT,
+    yellow_cards BIGINT,
+    red_cards BIGINT,
+    minutes_played NUMERIC,
+    yellows_per_90 NUMERIC,
+    competitions TEXT
+)
+LANGUAGE sql
+STABLE
+AS $$
+    SELECT
+        psc.player_name::TEXT,
+        psc.team_name::TEXT,
+        psc.season,
+        psc.matches_played,
+        psc.yellow_cards,
+        psc.red_cards,
+        psc.minutes_played,
+        psc.yellows_per_90,
+        psc.competitions::TEXT
+    FROM player_season_cards_total psc
+    WHERE psc.player_id IN (
+        SELECT p.id FROM players p
+        WHERE p.name_normalized LIKE '%' || normalize_name(p_player_name) || '%'
+    )
+    AND (p_season IS NULL OR psc.season = p_season)
+    ORDER BY psc.season DESC, psc.yellow_cards DESC;
+$$;
+
+-- Storico arbitro-giocatore e scontri diretti: risolvono gli ID e delegano alle versioni per ID (013)
+CREATE OR REPLACE FUNCTION get_referee_player_cards(
+    p_referee_name TEXT,
+    p_team1_name TEXT,
+    p_team2_name TEXT
+)
+RETURNS TABLE (
+    referee_name TEXT,
+    player_name TEXT,
+    team_name TEXT,
+    times_booked BIGINT,
+    matches_with_referee BIGINT,
+    booking_percentage NUMERIC,
+    last_booking DATE,
+    booking_details JSON
+)
+LANGUAGE sql
+STABLE
+AS $$
+    SELECT
+        rpc.referee_name,
+        rpc.player_name,
+        rpc.team_name,
+        rpc.times_booked,
+        rpc.matches_with_referee,
+        rpc.booking_percentage,
+        rpc.last_booking,
+        rpc.booking_details
+    FROM get_referee_player_cards_by_id(
+        find_referee_id(p_referee_name),
+        find_team_id(p_team1_name),
+        find_team_id(p_team2_name)
+    ) rpc;
+$$;
+
+CREATE OR REPLACE FUNCTION get_head_to_head_cards(
+    p_player_name TEXT,
+    p_team1_name TEXT,
+    p_team2_name TEXT
+)
+RETURNS TABLE (
+    player_name TEXT,
+    team_name TEXT,
+    opponent TEXT,
+    total_h2h_matches BIGINT,
+    total_yellows BIGINT,
+    total_reds BIGINT,
+    card_percentage NUMERIC,
+    match_details JSON
+)
+LANGUAGE sql
+STABLE
+AS $$
+    SELECT *
+    FROM get_head_to_head_cards_by_id(
+        find_player_id(p_player_name),
+        find_team_id(p_team1_name),
+        find_team_id(p_team2_name)
+    );
+$$;
+
+-- Falli squadra: tutte le squadre il cui nome contiene quello cercato (come prima)
+CREATE OR REPLACE FUNCTION get_team_fouls_stats(
+    p_team_name TEXT DEFAULT NULL,
+    p_season TEXT DEFAULT '2025-2026'
+)
+RETURNS TABLE (
+    team_name TEXT,
+    matches_played BIGINT,
+    avg_fouls_per_match NUMERIC,
+    avg_fouls_suffered_per_match NUMERIC,
+    avg_yellows_per_match NUMERIC,
+    foul_to_card_pct NUMERIC
+)
+LANGUAGE sql
+STABLE
+AS $$
+    SELECT
+        tfs.team_name::TEXT,
+        tfs.matches_played,
+        tfs.avg_fouls_per_match,
+        tfs.avg_fouls_suffered_per_match,
+        tfs.avg_yellows_per_match,
+        tfs.foul_to_card_pct
+    FROM team_fouls_stats tfs
+    WHERE tfs.season = p_season
+    AND (p_team_name IS NULL OR tfs.team_id IN (
+        SELECT t.id FROM teams t
+        WHERE t.name_normalized LIKE '%' || normalize_name(p_team_name) || '%'
+    ))
+    ORDER BY tfs.avg_fouls_per_match DESC;
+$$;
+
+-- Profilo e moltiplicatore arbitro (003): per ID, lega con più partite
+CREATE OR REPLACE FUNCTION get_referee_profile(p_referee_name TEXT)
+RETURNS TABLE (
+    referee_name TEXT,
+    competition_code VARCHAR(10),
+    matches_in_league BIGINT,
+    ref_avg_yellows NUMERIC,
+    league_avg_yellows NUMERIC,
+    ref_league_delta NUMERIC,
+    referee_profile TEXT
+)
+LANGUAGE sql
+STABLE
+AS $$
+    SELECT
+        rlc.referee_name::TEXT,
+        rlc.competition_code,
+        rlc.matches_in_league,
+        rlc.ref_avg_yellows,
+        rlc.league_avg_yellows,
+        rlc.ref_league_delta,
+        rlc.referee_profile::TEXT
+    FROM referee_league_comparison rlc
+    WHERE rlc.referee_id = find_referee_id(p_referee_name)
+    ORDER BY rlc.matches_in_league DESC
+    LIMIT 1;
+$$;
+
+CREATE OR REPLACE FUNCTION get_referee_multiplier(p_referee_name TEXT)
+RETURNS NUMERIC
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_profile TEXT;
+    v_delta NUMERIC;
+BEGIN
+    SELECT referee_profile, ref_league_delta INTO v_profile, v_delta
+    FROM referee_league_comparison
+    WHERE referee_id = find_referee_id(p_referee_name)
+    ORDER BY matches_in_league DESC
+    LIMIT 1;
+
+    IF v_profile IS NULL THEN
+        RETURN 1.0;
+    END IF;
+
+    -- Ogni +0.5 gialli sopra media = +5% rischio, max ±15%
+    RETURN GREATEST(0.85, LEAST(1.15, 1.0 + (v_delta * 0.10)));
+END;
+$$;
+
+-- Fattore possesso (004): squadre per ID
+CREATE OR REPLACE FUNCTION get_possession_factor(
+    p_home_team_name TEXT,
+    p_away_team_name TEXT,
+    p_season TEXT DEFAULT '2025-2026'
+)
+RETURNS TABLE (
+    home_team TEXT,
+    home_avg_possession NUMERIC,
+    home_play_style TEXT,
+    home_possession_factor NUMERIC,
+    away_team TEXT,
+    away_avg_possession NUMERIC,
+    away_play_style TEXT,
+    away_possession_factor NUMERIC,
+    expected_possession_diff NUMERIC
+)
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_home_poss NUMERIC;
+    v_away_poss NUMERIC;
+    v_home_style TEXT;
+    v_away_style TEXT;
+    v_home_factor NUMERIC;
+    v_away_factor NUMERIC;
+BEGIN
+    SELECT tps.avg_possession, tps.play_style INTO v_home_poss, v_home_style
+    FROM team_possession_stats tps
+    WHERE tps.team_id = find_team_id(p_home_team_name)
+    AND tps.season = p_season;
+
+    SELECT tps.avg_possession, tps.play_style INTO v_away_poss, v_away_style
+    FROM team_possession_stats tps
+    WHERE tps.team_id = find_team_id(p_away_team_name)
+    AND tps.season = p_season;
+
+    -- Default se non trovato
+    v_home_poss := COALESCE(v_home_poss, 50);
+    v_away_poss := COALESCE(v_away_poss, 50);
+    v_home_style := COALESCE(v_home_style, 'BALANCED');
+    v_away_style := COALESCE(v_away_style, 'BALANCED');
+
+    -- 50% possesso = fattore 1.0, limitato tra 0.85 e 1.15
+    v_home_factor := GREATEST(0.85, LEAST(1.15, 1 + (50 - v_home_poss) * 0.01));
+    v_away_factor := GREATEST(0.85, LEAST(1.15, 1 + (50 - v_away_poss) * 0.01));
+
+    RETURN QUERY SELECT
+        p_home_team_name,
+        v_home_poss,
+        v_home_style,
+        ROUND(v_home_factor, 2),
+        p_away_team_name,
+        v_away_poss,
+        v_away_style,
+        ROUND(v_away_factor, 2),
+        ROUND(v_home_poss - v_away_poss, 1);
+END;
+$$;
+
+-- 7. Verifica
+SELECT name, name_normalized FROM players WHERE name_normalized LIKE '%modric%';
+SELECT find_team_id('Inter'), find_referee_id('Orsato');
+-- Il piano deve usare idx_players_name_trgm (Bitmap Index Scan), non un Seq Scan
+EXPLAIN ANALYZE SELECT id FROM players WHERE name_normalized LIKE '%barella%';
+SELECT * FROM get_possession_factor('Inter', 'Napoli', '2025-2026');
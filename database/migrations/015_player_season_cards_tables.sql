@@ -0,0 +1,319 @@
+-- database/migrations/015_player_season_cards_tables.sql
+-- player_season_cards e player_season_cards_total da viste a tabelle materializzate
+-- Le viste univano lineups × players × matches × teams × competitions × match_events e
+-- raggruppavano a ogni lettura; le tabelle vengono ricalcolate dalla sync solo per la
+-- partizione (stagione, competizione) sincronizzata, con upsert: chi legge non viene mai
+-- bloccato e vede i dati precedenti finché il ricalcolo non è concluso.
+-- Eseguire in Supabase SQL Editor DOPO 001-014
+
+-- 1. Rimuove le viste (CASCADE rimuove anche match_analysis_summary, ricreata al punto 5)
+-- Solo se sono ancora viste: la migration può essere rieseguita dopo la conversione in tabelle
+DO $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM pg_views WHERE viewname = 'player_season_cards') THEN
+        DROP VIEW player_season_cards CASCADE;
+    END IF;
+    IF EXISTS (SELECT 1 FROM pg_views WHERE viewname = 'player_season_cards_total') THEN
+        DROP VIEW player_season_cards_total CASCADE;
+    END IF;
+END;
+$$;
+
+-- 2. Tabelle (stesse colonne delle viste, più refreshed_at)
+-- Una riga per giocatore/squadra/competizione/stagione
+CREATE TABLE IF NOT EXISTS player_season_cards (
+    player_id UUID NOT NULL REFERENCES players(id) ON DELETE CASCADE,
+    player_name VARCHAR(100) NOT NULL,
+    position VARCHAR(30),
+    team_id UUID NOT NULL REFERENCES teams(id) ON DELETE CASCADE,
+    team_name VARCHAR(100) NOT NULL,
+    team_short VARCHAR(50),
+    competition_id UUID REFERENCES competitions(id) ON DELETE CASCADE,
+    competition_code VARCHAR(10),
+    competition_name VARCHAR(100),
+    season VARCHAR(10) NOT NULL,
+    matches_played BIGINT NOT NULL DEFAULT 0,
+    yellow_cards BIGINT NOT NULL DEFAULT 0,
+    red_cards BIGINT NOT NULL DEFAULT 0,
+    minutes_played NUMERIC NOT NULL DEFAULT 0,
+    yellows_per_90 NUMERIC,  -- NULL sotto i 90 minuti
+    refreshed_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+
+-- Una riga per giocatore/squadra/stagione (tutte le competizioni insieme)
+CREATE TABLE IF NOT EXISTS player_season_cards_total (
+    player_id UUID NOT NULL REFERENCES players(id) ON DELETE CASCADE,
+    player_name VARCHAR(100) NOT NULL,
+    position VARCHAR(30),
+    team_id UUID NOT NULL REFERENCES teams(id) ON DELETE CASCADE,
+    team_name VARCHAR(100) NOT NULL,
+    team_short VARCHAR(50),
+    season VARCHAR(10) NOT NULL,
+    matches_played BIGINT NOT NULL DEFAULT 0,
+    yellow_cards BIGINT NOT NULL DEFAULT 0,
+    red_cards BIGINT NOT NULL DEFAULT 0,
+    minutes_played NUMERIC NOT NULL DEFAULT 0,
+    yellows_per_90 NUMERIC,
+    competitions TEXT,  -- Codici separati da virgola (es. "CL, SA")
+    refreshed_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+
+-- Chiavi univoche (usate da ON CONFLICT); competition_id NULL = partite senza competizione
+CREATE UNIQUE INDEX IF NOT EXISTS idx_player_season_cards_key
+ON player_season_cards(player_id, team_id, competition_id, season) NULLS NOT DISTINCT;
+CREATE UNIQUE INDEX IF NOT EXISTS idx_player_season_cards_total_key
+ON player_season_cards_total(player_id, team_id, season);
+
+-- Partizione ricalcolata dalla sync, letture per squadra
+CREATE INDEX IF NOT EXISTS idx_player_season_cards_partition ON player_season_cards(season, competition_code);
+CREATE INDEX IF NOT EXISTS idx_player_season_cards_team ON player_season_cards(team_id, season);
+CREATE INDEX IF NOT EXISTS idx_player_season_cards_total_team ON player_season_cards_total(team_id, season);
+
+COMMENT ON TABLE player_season_cards IS 'Cartellini per giocatore/squadra/competizione/stagione. Ricalcolata da refresh_player_season_cards a fine sync.';
+COMMENT ON TABLE player_season_cards_total IS 'Cartellini per giocatore/squadra/stagione, tutte le competizioni. Ricalcolata da refresh_player_season_cards a fine sync.';
+
+-- 3. Funzione di ricalcolo di una partizione
+-- p_competition_code = NULL ricalcola tutta la stagione. I totali vengono ricalcolati (su tutte
+-- le competizioni) per i giocatori che compaiono nella partizione, prima o dopo il ricalcolo.
+-- Stesse formule delle viste, ma i cartellini sono contati per partita prima di sommare
+-- i minuti (due cartellini nella stessa partita non raddoppiano i minuti) e i minuti sono
+-- quelli di 007: titolare senza minutaggio = 90, panchinaro non entrato = 0.
+CREATE OR REPLACE FUNCTION refresh_player_season_cards(
+    p_season TEXT,
+    p_competition_code TEXT DEFAULT NULL
+)
+RETURNS INTEGER
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_updated INTEGER;
+    v_player_ids UUID[];
+    v_refreshed_at TIMESTAMPTZ := NOW();
+BEGIN
+    -- Giocatori della partizione: già in tabella (possono sparire) o nelle formazioni
+    SELECT ARRAY_AGG(DISTINCT x.player_id) INTO v_player_ids
+    FROM (
+        SELECT psc.player_id
+        FROM player_season_cards psc
+        WHERE psc.season = p_season
+          AND (p_competition_code IS NULL OR psc.competition_code = p_competition_code)
+        UNION
+        SELECT l.player_id
+        FROM lineups l
+        JOIN matches m ON m.id = l.match_id
+        LEFT JOIN competitions c ON c.id = m.competition_id
+        WHERE m.status = 'FINISHED'
+          AND m.season = p_season
+          AND (p_competition_code IS NULL OR c.code = p_competition_code)
+    ) x;
+
+    IF v_player_ids IS NULL THEN
+        RETURN 0;
+    END IF;
+
+    -- Per competizione
+    WITH player_matches AS (
+        -- Una riga per giocatore/partita
+        SELECT
+            l.player_id,
+            l.team_id,
+            m.competition_id,
+            l.is_starter,
+            l.minutes_played,
+            COUNT(me.id) FILTER (WHERE me.event_type = 'YELLOW_CARD') AS yellows,
+            COUNT(me.id) FILTER (WHERE me.event_type = 'RED_CARD') AS reds
+        FROM lineups l
+        JOIN matches m ON m.id = l.match_id
+        LEFT JOIN competitions c ON c.id = m.competition_id
+        LEFT JOIN match_events me ON me.match_id = l.match_id
+            AND me.player_id = l.player_id
+            AND me.event_type IN ('YELLOW_CARD', 'RED_CARD')
+        WHERE m.status = 'FINISHED'
+          AND m.season = p_season
+          AND (p_competition_code IS NULL OR c.code = p_competition_code)
+        GROUP BY l.player_id, l.team_id, l.match_id, m.competition_id, l.is_starter, l.minutes_played
+    ),
+    player_totals AS (
+        SELECT
+            pm.player_id,
+            pm.team_id,
+            pm.competition_id,
+            COUNT(*) AS matches_played,
+            SUM(pm.yellows) AS yellow_cards,
+            SUM(pm.reds) AS red_cards,
+            -- Minuti per partita come in refresh_player_season_stats (007): titolare non sostituito = 90
+            SUM(CASE
+                WHEN pm.minutes_played IS NOT NULL THEN pm.minutes_played
+                WHEN pm.is_starter THEN 90
+                ELSE 0
+            END) AS minutes_played
+        FROM player_matches pm
+        GROUP BY pm.player_id, pm.team_id, pm.competition_id
+    )
+    INSERT INTO player_season_cards (
+        player_id, player_name, position, team_id, team_name, team_short,
+        competition_id, competition_code, competition_name, season,
+        matches_played, yellow_cards, red_cards, minutes_played, yellows_per_90, refreshed_at
+    )
+    SELECT
+        pt.player_id,
+        p.name,
+        p.position,
+        pt.team_id,
+        t.name,
+        t.short_name,
+        pt.competition_id,
+        c.code,
+        c.name,
+        p_season,
+        pt.matches_played,
+        pt.yellow_cards,
+        pt.red_cards,
+        pt.minutes_played,
+        CASE
+            WHEN pt.minutes_played >= 90 THEN ROUND(pt.yellow_cards::NUMERIC / (pt.minutes_played::NUMERIC / 90), 2)
+            ELSE NULL
+        END,
+        v_refreshed_at
+    FROM player_totals pt
+    JOIN players p ON p.id = pt.player_id
+    JOIN teams t ON t.id = pt.team_id
+    LEFT JOIN competitions c ON c.id = pt.competition_id
+    ON CONFLICT (player_id, team_id, competition_id, season) DO UPDATE SET
+        player_name = EXCLUDED.player_name,
+        position = EXCLUDED.position,
+        team_name = EXCLUDED.team_name,
+        team_short = EXCLUDED.team_short,
+        competition_code = EXCLUDED.competition_code,
+        competition_name = EXCLUDED.competition_name,
+        matches_played = EXCLUDED.matches_played,
+        yellow_cards = EXCLUDED.yellow_cards,
+        red_cards = EXCLUDED.red_cards,
+        minutes_played = EXCLUDED.minutes_played,
+        yellows_per_90 = EXCLUDED.yellows_per_90,
+        refreshed_at = EXCLUDED.refreshed_at;
+
+    GET DIAGNOSTICS v_updated = ROW_COUNT;
+
+    -- Rimuove le righe della partizione non più presenti (es. partite cancellate o rinviate)
+    DELETE FROM player_season_cards psc
+    WHERE psc.season = p_season
+      AND (p_competition_code IS NULL OR psc.competition_code = p_competition_code)
+      AND psc.refreshed_at < v_refreshed_at;
+
+    -- Totali dei giocatori della partizione (tutte le competizioni della stagione)
+    WITH player_matches AS (
+        SELECT
+            l.player_id,
+            l.team_id,
+            m.competition_id,
+            l.is_starter,
+            l.minutes_played,
+            COUNT(me.id) FILTER (WHERE me.event_type = 'YELLOW_CARD') AS yellows,
+            COUNT(me.id) FILTER (WHERE me.event_type = 'RED_CARD') AS reds
+        FROM lineups l
+        JOIN matches m ON m.id = l.match_id
+        LEFT JOIN match_events me ON me.match_id = l.match_id
+            AND me.player_id = l.player_id
+            AND me.event_type IN ('YELLOW_CARD', 'RED_CARD')
+        WHERE m.status = 'FINISHED'
+          AND m.season = p_season
+          AND l.player_id = ANY(v_player_ids)
+        GROUP BY l.player_id, l.team_id, l.match_id, m.competition_id, l.is_starter, l.minutes_played
+    ),
+    player_totals AS (
+        SELECT
+            pm.player_id,
+            pm.team_id,
+            STRING_AGG(DISTINCT c.code, ', ') AS competitions,
+            COUNT(*) AS matches_played,
+            SUM(pm.yellows) AS yellow_cards,
+            SUM(pm.reds) AS red_cards,
+            -- Minuti per partita come in refresh_player_season_stats (007): titolare non sostituito = 90
+            SUM(CASE
+                WHEN pm.minutes_played IS NOT NULL THEN pm.minutes_played
+                WHEN pm.is_starter THEN 90
+                ELSE 0
+            END) AS minutes_played
+        FROM player_matches pm
+        LEFT JOIN competitions c ON c.id = pm.competition_id
+        GROUP BY pm.player_id, pm.team_id
+    )
+    INSERT INTO player_season_cards_total (
+        player_id, player_name, position, team_id, team_name, team_short, season,
+        matches_played, yellow_cards, red_cards, minutes_played, yellows_per_90, competitions, refreshed_at
+    )
+    SELECT
+        pt.player_id,
+        p.name,
+        p.position,
+        pt.team_id,
+        t.name,
+        t.short_name,
+        p_season,
+        pt.matches_played,
+        pt.yellow_cards,
+        pt.red_cards,
+        pt.minutes_played,
+        CASE
+            WHEN pt.minutes_played >= 90 THEN ROUND(pt.yellow_cards::NUMERIC / (pt.minutes_played::NUMERIC / 90), 2)
+            ELSE NULL
+        END,
+        pt.competitions,
+        v_refreshed_at
+    FROM player_totals pt
+    JOIN players p ON p.id = pt.player_id
+    JOIN teams t ON t.id = pt.team_id
+    ON CONFLICT (player_id, team_id, season) DO UPDATE SET
+        player_name = EXCLUDED.player_name,
+        position = EXCLUDED.position,
+        team_name = EXCLUDED.team_name,
+        team_short = EXCLUDED.team_short,
+        matches_played = EXCLUDED.matches_played,
+        yellow_cards = EXCLUDED.yellow_cards,
+        red_cards = EXCLUDED.red_cards,
+        minutes_played = EXCLUDED.minutes_played,
+        yellows_per_90 = EXCLUDED.yellows_per_90,
+        competitions = EXCLUDED.competitions,
+        refreshed_at = EXCLUDED.refreshed_at;
+
+    DELETE FROM player_season_cards_total psct
+    WHERE psct.season = p_season
+      AND psct.player_id = ANY(v_player_ids)
+      AND psct.refreshed_at < v_refreshed_at;
+
+    RETURN v_updated;
+END;
+$$;
+
+COMMENT ON FUNCTION refresh_player_season_cards IS 'Ricalcola player_season_cards di una stagione/competizione (NULL = tutte) e i totali dei suoi giocatori';
+
+-- 4. Popolamento iniziale (tutte le stagioni presenti)
+SELECT s.season, refresh_player_season_cards(s.season)
+FROM (SELECT DISTINCT season FROM matches) s;
+
+-- 5. match_analysis_summary (rimossa dal CASCADE del punto 1, stessa definizione di analysis_views.sql)
+CREATE OR REPLACE VIEW match_analysis_summary AS
+SELECT
+    p.id AS player_id,
+    p.name AS player_name,
+    p.position,
+    t.id AS team_id,
+    t.name AS team_name,
+    -- Statistiche stagione corrente
+    COALESCE(psc.yellow_cards, 0) AS season_yellows,
+    COALESCE(psc.red_cards, 0) AS season_reds,
+    COALESCE(psc.matches_played, 0) AS season_matches,
+    psc.yellows_per_90 AS season_yellows_per_90
+FROM players p
+JOIN teams t ON p.current_team_id = t.id
+LEFT JOIN player_season_cards psc ON psc.player_id = p.id AND psc.season = '2025-2026'
+ORDER BY psc.yellows_per_90 DESC NULLS LAST;
+
+-- 6. Verifica
+SELECT season, competition_code, COUNT(*) AS players, SUM(yellow_cards) AS yellows
+FROM player_season_cards
+GROUP BY season, competition_code
+ORDER BY season DESC, competition_code;
+-- Ricalcolo di una sola partizione (come fa la sync)
+-- SELECT refresh_player_season_cards('2025-2026', 'SA');
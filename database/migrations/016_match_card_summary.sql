@@ -0,0 +1,404 @@
+-- database/migrations/016_match_card_summary.sql
+-- Conteggi per partita (cartellini, falli, possesso) salvati in match_card_summary
+-- referee_league_comparison contava i gialli con una sottoquery correlata per ogni partita
+-- (due volte: media lega e media arbitro) a ogni lettura. Ora arbitri, baseline lega e
+-- statistiche squadra aggregano una riga per partita, aggiornata dalla sync dopo i dettagli.
+-- Solo refactoring: ogni vista legge le stesse colonne sorgente di prima (gialli arbitro/lega
+-- da match_events come la 003; cartellini, falli e possesso squadra e statistiche arbitri da
+-- match_statistics come analysis_views.sql, 004 e 006), quindi i valori non cambiano.
+-- Eseguire in Supabase SQL Editor DOPO 001-015
+
+-- 1. Tabella riepilogo per partita
+-- event_yellows: gialli da match_events (arbitri e lega, come la 003)
+-- Colonne casa/trasferta: match_statistics così com'è (NULL senza Statistics Add-On),
+-- *_has_stats = esiste la riga match_statistics della squadra
+CREATE TABLE IF NOT EXISTS match_card_summary (
+    match_id UUID PRIMARY KEY REFERENCES matches(id) ON DELETE CASCADE,
+    event_yellows INTEGER NOT NULL DEFAULT 0,
+    home_has_stats BOOLEAN NOT NULL DEFAULT FALSE,
+    away_has_stats BOOLEAN NOT NULL DEFAULT FALSE,
+    home_yellows INTEGER,
+    away_yellows INTEGER,
+    home_reds INTEGER,
+    away_reds INTEGER,
+    home_fouls INTEGER,
+    away_fouls INTEGER,
+    home_fouls_suffered INTEGER,
+    away_fouls_suffered INTEGER,
+    home_possession INTEGER,
+    away_possession INTEGER,
+    refreshed_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+
+COMMENT ON TABLE match_card_summary IS 'Gialli da match_events e cartellini, falli e possesso da match_statistics per partita (casa/trasferta). Aggiornata da refresh_match_card_summary quando la sync salva i dettagli.';
+
+-- Partite concluse di una stagione (tutte le viste seguenti partono da qui)
+CREATE INDEX IF NOT EXISTS idx_matches_season_status ON matches(season, status);
+
+-- 2. Funzione di aggiornamento
+-- p_match_ids = NULL ricalcola tutte le partite
+CREATE OR REPLACE FUNCTION refresh_match_card_summary(p_match_ids UUID[] DEFAULT NULL)
+RETURNS INTEGER
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_updated INTEGER;
+BEGIN
+    WITH target AS (
+        SELECT m.id, m.home_team_id, m.away_team_id
+        FROM matches m
+        WHERE p_match_ids IS NULL OR m.id = ANY(p_match_ids)
+    ),
+    cards AS (
+        -- Tutti i gialli della partita, come la sottoquery della 003
+        SELECT me.match_id, COUNT(*) AS event_yellows
+        FROM match_events me
+        JOIN target t ON t.id = me.match_id
+        WHERE me.event_type = 'YELLOW_CARD'
+        GROUP BY me.match_id
+    ),
+    stats AS (
+        -- Una riga match_statistics per squadra (UNIQUE match_id, team_id)
+        SELECT
+            ms.match_id,
+            BOOL_OR(ms.team_id = t.home_team_id) AS home_has_stats,
+            BOOL_OR(ms.team_id = t.away_team_id) AS away_has_stats,
+            MAX(ms.yellow_cards) FILTER (WHERE ms.team_id = t.home_team_id) AS home_yellows,
+            MAX(ms.yellow_cards) FILTER (WHERE ms.team_id = t.away_team_id) AS away_yellows,
+            MAX(ms.red_cards) FILTER (WHERE ms.team_id = t.home_team_id) AS home_reds,
+            MAX(ms.red_cards) FILTER (WHERE ms.team_id = t.away_team_id) AS away_reds,
+            MAX(ms.fouls_committed) FILTER (WHERE ms.team_id = t.home_team_id) AS home_fouls,
+            MAX(ms.fouls_committed) FILTER (WHERE ms.team_id = t.away_team_id) AS away_fouls,
+            MAX(ms.fouls_suffered) FILTER (WHERE ms.team_id = t.home_team_id) AS home_fouls_suffered,
+            MAX(ms.fouls_suffered) FILTER (WHERE ms.team_id = t.away_team_id) AS away_fouls_suffered,
+            MAX(ms.ball_possession) FILTER (WHERE ms.team_id = t.home_team_id) AS home_possession,
+            MAX(ms.ball_possession) FILTER (WHERE ms.team_id = t.away_team_id) AS away_possession
+        FROM match_statistics ms
+        JOIN target t ON t.id = ms.match_id
+        GROUP BY ms.match_id
+    )
+    INSERT INTO match_card_summary (
+        match_id, event_yellows, home_has_stats, away_has_stats,
+        home_yellows, away_yellows, home_reds, away_reds,
+        home_fouls, away_fouls, home_fouls_suffered, away_fouls_suffered,
+        home_possession, away_possession, refreshed_at
+    )
+    SELECT
+        t.id,
+        COALESCE(c.event_yellows, 0),
+        COALESCE(s.home_has_stats, FALSE),
+        COALESCE(s.away_has_stats, FALSE),
+        s.home_yellows,
+        s.away_yellows,
+        s.home_reds,
+        s.away_reds,
+        s.home_fouls,
+        s.away_fouls,
+        s.home_fouls_suffered,
+        s.away_fouls_suffered,
+        s.home_possession,
+        s.away_possession,
+        NOW()
+    FROM target t
+    LEFT JOIN cards c ON c.match_id = t.id
+    LEFT JOIN stats s ON s.match_id = t.id
+    ON CONFLICT (match_id) DO UPDATE SET
+        event_yellows = EXCLUDED.event_yellows,
+        home_has_stats = EXCLUDED.home_has_stats,
+        away_has_stats = EXCLUDED.away_has_stats,
+        home_yellows = EXCLUDED.home_yellows,
+        away_yellows = EXCLUDED.away_yellows,
+        home_reds = EXCLUDED.home_reds,
+        away_reds = EXCLUDED.away_reds,
+        home_fouls = EXCLUDED.home_fouls,
+        away_fouls = EXCLUDED.away_fouls,
+        home_fouls_suffered = EXCLUDED.home_fouls_suffered,
+        away_fouls_suffered = EXCLUDED.away_fouls_suffered,
+        home_possession = EXCLUDED.home_possession,
+        away_possession = EXCLUDED.away_possession,
+        refreshed_at = EXCLUDED.refreshed_at;
+
+    GET DIAGNOSTICS v_updated = ROW_COUNT;
+    RETURN v_updated;
+END;
+$$;
+
+COMMENT ON FUNCTION refresh_match_card_summary IS 'Ricalcola match_card_summary per le partite indicate (NULL = tutte): gialli da match_events, colonne squadra da match_statistics';
+
+-- Popolamento iniziale
+SELECT refresh_match_card_summary() AS partite_riepilogate;
+
+-- 3. Una riga per partita/squadra (casa e trasferta), base delle viste squadra
+CREATE OR REPLACE VIEW match_team_summary AS
+SELECT
+    mcs.match_id,
+    m.season,
+    m.competition_id,
+    m.status,
+    side.team_id,
+    side.opponent_id,
+    side.has_stats,
+    side.yellows,
+    side.reds,
+    side.fouls,
+    side.fouls_suffered,
+    side.possession
+FROM match_card_summary mcs
+JOIN matches m ON m.id = mcs.match_id
+CROSS JOIN LATERAL (VALUES
+    (m.home_team_id, m.away_team_id, mcs.home_has_stats, mcs.home_yellows, mcs.home_reds,
+     mcs.home_fouls, mcs.home_fouls_suffered, mcs.home_possession),
+    (m.away_team_id, m.home_team_id, mcs.away_has_stats, mcs.away_yellows, mcs.away_reds,
+     mcs.away_fouls, mcs.away_fouls_suffered, mcs.away_possession)
+) AS side(team_id, opponent_id, has_stats, yellows, reds, fouls, fouls_suffered, possession);
+
+COMMENT ON VIEW match_team_summary IS 'Colonne match_statistics di match_card_summary con una riga per squadra (has_stats = riga match_statistics presente)';
+
+-- 4. Confronto arbitri vs media lega (stesse colonne della 003, senza sottoquery correlate)
+-- Le partite concluse senza dettagli contano 0 gialli, come con la sottoquery
+DROP VIEW IF EXISTS referee_league_comparison;
+
+CREATE VIEW referee_league_comparison AS
+WITH season_matches AS (
+    SELECT
+        m.id,
+        m.referee_id,
+        c.code AS competition_code,
+        COALESCE(mcs.event_yellows, 0) AS yellows
+    FROM matches m
+    JOIN competitions c ON m.competition_id = c.id
+    LEFT JOIN match_card_summary mcs ON mcs.match_id = m.id
+    WHERE m.status = 'FINISHED'
+    AND m.season = '2025-2026'
+),
+league_averages AS (
+    -- Media gialli per partita per ogni competizione
+    SELECT competition_code, AVG(yellows) AS league_avg_yellows
+    FROM season_matches
+    GROUP BY competition_code
+),
+referee_by_league AS (
+    -- Media gialli per ogni arbitro in ogni competizione
+    SELECT
+        r.id AS referee_id,
+        r.name AS referee_name,
+        sm.competition_code,
+        COUNT(*) AS matches_in_league,
+        AVG(sm.yellows) AS ref_avg_yellows
+    FROM season_matches sm
+    JOIN referees r ON r.id = sm.referee_id
+    GROUP BY r.id, r.name, sm.competition_code
+)
+SELECT
+    rbl.referee_id,
+    rbl.referee_name,
+    rbl.competition_code,
+    rbl.matches_in_league,
+    ROUND(rbl.ref_avg_yellows::NUMERIC, 2) AS ref_avg_yellows,
+    ROUND(la.league_avg_yellows::NUMERIC, 2) AS league_avg_yellows,
+    ROUND((rbl.ref_avg_yellows - la.league_avg_yellows)::NUMERIC, 2) AS ref_league_delta,
+    -- Classificazione outlier
+    CASE
+        WHEN rbl.ref_avg_yellows - la.league_avg_yellows > 1.0 THEN 'STRICT_OUTLIER'
+        WHEN rbl.ref_avg_yellows - la.league_avg_yellows < -1.0 THEN 'LENIENT_OUTLIER'
+        WHEN rbl.ref_avg_yellows - la.league_avg_yellows > 0.5 THEN 'ABOVE_AVERAGE'
+        WHEN rbl.ref_avg_yellows - la.league_avg_yellows < -0.5 THEN 'BELOW_AVERAGE'
+        ELSE 'AVERAGE'
+    END AS referee_profile
+FROM referee_by_league rbl
+JOIN league_averages la ON rbl.competition_code = la.competition_code
+WHERE rbl.matches_in_league >= 3  -- Minimo 3 partite per essere significativo
+ORDER BY ref_league_delta DESC;
+
+COMMENT ON VIEW referee_league_comparison IS 'Confronto arbitri vs media lega con classificazione outlier (da match_card_summary)';
+
+-- 5. Baseline lega: ai valori di riferimento si aggiungono quelli osservati nel DB
+-- (colonne in coda: normalization_factor resta quello della 002)
+CREATE OR REPLACE VIEW league_card_baselines AS
+SELECT
+    c.code AS competition_code,
+    c.name AS competition_name,
+    CASE c.code
+        WHEN 'PD' THEN 5.33   -- La Liga (più severa)
+        WHEN 'SA' THEN 4.10   -- Serie A
+        WHEN 'PL' THEN 4.85   -- Premier League
+        WHEN 'BL1' THEN 3.90  -- Bundesliga (più permissiva)
+        WHEN 'FL1' THEN 3.65  -- Ligue 1 (più permissiva)
+        WHEN 'CL' THEN 4.20   -- Champions League
+        WHEN 'BSA' THEN 4.50  -- Brasileirão
+        ELSE 4.00
+    END AS baseline_yellows_per_match,
+    -- Fattore di normalizzazione rispetto alla media (4.00)
+    -- >1 = lega più severa, <1 = lega più permissiva
+    CASE c.code
+        WHEN 'PD' THEN 1.30   -- La Liga +30%
+        WHEN 'SA' THEN 1.00   -- Serie A (baseline)
+        WHEN 'PL' THEN 1.18   -- Premier League +18%
+        WHEN 'BL1' THEN 0.95  -- Bundesliga -5%
+        WHEN 'FL1' THEN 0.89  -- Ligue 1 -11%
+        WHEN 'CL' THEN 1.02   -- Champions League +2%
+        WHEN 'BSA' THEN 1.10  -- Brasileirão +10%
+        ELSE 1.00
+    END AS normalization_factor,
+    -- Osservati: partite concluse, tutte le stagioni (gialli da match_events come la 003)
+    obs.matches AS observed_matches,
+    ROUND(obs.avg_yellows, 2) AS observed_yellows_per_match
+FROM competitions c
+LEFT JOIN LATERAL (
+    SELECT COUNT(*) AS matches, AVG(mcs.event_yellows)::NUMERIC AS avg_yellows
+    FROM matches m
+    JOIN match_card_summary mcs ON mcs.match_id = m.id
+    WHERE m.competition_id = c.id
+    AND m.status = 'FINISHED'
+) obs ON TRUE;
+
+COMMENT ON VIEW league_card_baselines IS 'Baseline cartellini gialli per competizione, fattore di normalizzazione e media osservata';
+
+-- 6. Statistiche squadra (stesse colonne e stesse sorgenti match_statistics di analysis_views.sql e 004)
+-- team_play_styles dipende da team_possession_stats: rimossa dal CASCADE e ricreata
+DROP VIEW IF EXISTS team_fouls_stats CASCADE;
+DROP VIEW IF EXISTS team_possession_stats CASCADE;
+
+CREATE VIEW team_fouls_stats AS
+SELECT
+    t.id AS team_id,
+    t.name AS team_name,
+    t.short_name AS team_short,
+    mts.season,
+    COUNT(*) AS matches_played,
+    -- Falli totali
+    SUM(mts.fouls)::BIGINT AS total_fouls_committed,
+    SUM(mts.fouls_suffered)::BIGINT AS total_fouls_suffered,
+    -- Cartellini totali squadra
+    SUM(mts.yellows)::BIGINT AS total_yellows,
+    SUM(mts.reds)::BIGINT AS total_reds,
+    -- Medie per partita
+    ROUND(AVG(mts.fouls)::NUMERIC, 1) AS avg_fouls_per_match,
+    ROUND(AVG(mts.fouls_suffered)::NUMERIC, 1) AS avg_fouls_suffered_per_match,
+    ROUND(AVG(mts.yellows)::NUMERIC, 2) AS avg_yellows_per_match,
+    -- Rapporto falli -> cartellino (squadra)
+    CASE
+        WHEN SUM(mts.fouls) > 0 THEN
+            ROUND((SUM(mts.yellows)::NUMERIC / SUM(mts.fouls)::NUMERIC) * 100, 1)
+        ELSE 0
+    END AS foul_to_card_pct
+FROM match_team_summary mts
+JOIN teams t ON t.id = mts.team_id
+WHERE mts.status = 'FINISHED'
+AND mts.has_stats  -- Solo partite con riga match_statistics della squadra
+GROUP BY t.id, t.name, t.short_name, mts.season
+ORDER BY mts.season DESC, avg_fouls_per_match DESC;
+
+COMMENT ON VIEW team_fouls_stats IS 'Statistiche falli aggregate per squadra/stagione. Usata per calcolare fattore squadra fallosa.';
+
+CREATE VIEW team_possession_stats AS
+SELECT
+    t.id AS team_id,
+    t.name AS team_name,
+    mts.season,
+    COUNT(*) AS matches_played,
+    ROUND(AVG(mts.possession)::NUMERIC, 1) AS avg_possession,
+    -- Classificazione stile di gioco
+    CASE
+        WHEN AVG(mts.possession) >= 55 THEN 'POSSESSION_HEAVY'
+        WHEN AVG(mts.possession) >= 50 THEN 'BALANCED'
+        WHEN AVG(mts.possession) >= 45 THEN 'COUNTER_ATTACK'
+        ELSE 'DEFENSIVE'
+    END AS play_style,
+    ROUND(AVG(mts.fouls)::NUMERIC, 1) AS avg_fouls_committed
+FROM match_team_summary mts
+JOIN teams t ON t.id = mts.team_id
+WHERE mts.status = 'FINISHED'
+AND mts.possession IS NOT NULL
+GROUP BY t.id, t.name, mts.season
+HAVING COUNT(*) >= 3;  -- Minimo 3 partite per essere significativo
+
+COMMENT ON VIEW team_possession_stats IS 'Statistiche possesso e stile di gioco per squadra/stagione';
+
+CREATE VIEW team_play_styles AS
+SELECT
+    team_name,
+    season,
+    avg_possession,
+    play_style,
+    avg_fouls_committed,
+    matches_played
+FROM team_possession_stats
+ORDER BY season DESC, avg_possession DESC;
+
+COMMENT ON VIEW team_play_styles IS 'Riepilogo stili di gioco squadre';
+
+-- 7. Statistiche arbitri (006) dal riepilogo per partita (cartellini e falli da match_statistics come la 006)
+CREATE OR REPLACE FUNCTION refresh_referee_stats(p_referee_ids UUID[] DEFAULT NULL)
+RETURNS INTEGER
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_updated INTEGER;
+BEGIN
+    WITH referee_totals AS (
+        SELECT
+            m.referee_id,
+            COUNT(*) AS total_matches,
+            COALESCE(SUM(COALESCE(mcs.home_yellows, 0) + COALESCE(mcs.away_yellows, 0)), 0) AS total_yellows,
+            COALESCE(SUM(COALESCE(mcs.home_reds, 0) + COALESCE(mcs.away_reds, 0)), 0) AS total_reds,
+            COALESCE(SUM(COALESCE(mcs.home_fouls, 0) + COALESCE(mcs.away_fouls, 0)), 0) AS total_fouls
+        FROM matches m
+        LEFT JOIN match_card_summary mcs ON mcs.match_id = m.id
+        WHERE m.status = 'FINISHED'
+          AND m.referee_id IS NOT NULL
+          AND (p_referee_ids IS NULL OR m.referee_id = ANY(p_referee_ids))
+        GROUP BY m.referee_id
+    )
+    UPDATE referees r
+    SET
+        total_matches = rt.total_matches,
+        total_yellows = rt.total_yellows,
+        total_reds = rt.total_reds,
+        avg_yellows_per_match = ROUND(rt.total_yellows::NUMERIC / rt.total_matches, 2),
+        avg_fouls_per_match = ROUND(rt.total_fouls::NUMERIC / rt.total_matches, 2),
+        updated_at = NOW()
+    FROM referee_totals rt
+    WHERE r.id = rt.referee_id;
+
+    GET DIAGNOSTICS v_updated = ROW_COUNT;
+    RETURN v_updated;
+END;
+$$;
+
+COMMENT ON FUNCTION refresh_referee_stats IS 'Ricalcola total_matches, cartellini e medie degli arbitri indicati (NULL = tutti) da match_card_summary';
+
+-- 8. Verifica
+-- Il piano non deve contenere SubPlan per partita
+EXPLAIN ANALYZE SELECT * FROM referee_league_comparison WHERE competition_code = 'SA';
+SELECT competition_code, baseline_yellows_per_match, observed_yellows_per_match, observed_matches
+FROM league_card_baselines ORDER BY competition_code;
+SELECT * FROM team_fouls_stats WHERE season = '2025-2026' LIMIT 10;
+
+-- Stesse sorgenti di prima: nessuna riga attesa (team_fouls_stats vs match_statistics,
+-- arbitri vs somma match_statistics della 006)
+SELECT tfs.team_name, tfs.season, tfs.total_yellows, old.total_yellows AS yellows_match_statistics
+FROM team_fouls_stats tfs
+JOIN (
+    SELECT ms.team_id, m.season, COUNT(DISTINCT m.id) AS matches_played,
+           SUM(ms.yellow_cards) AS total_yellows, SUM(ms.fouls_suffered) AS total_fouls_suffered
+    FROM match_statistics ms
+    JOIN matches m ON m.id = ms.match_id
+    WHERE m.status = 'FINISHED'
+    GROUP BY ms.team_id, m.season
+) old ON old.team_id = tfs.team_id AND old.season = tfs.season
+WHERE tfs.matches_played <> old.matches_played
+   OR tfs.total_yellows IS DISTINCT FROM old.total_yellows
+   OR tfs.total_fouls_suffered IS DISTINCT FROM old.total_fouls_suffered;
+
+SELECT refresh_referee_stats() AS arbitri_aggiornati;
+SELECT r.name, r.total_yellows, old.total_yellows AS yellows_match_statistics
+FROM referees r
+JOIN (
+    SELECT m.referee_id, SUM(COALESCE(ms.yellow_cards, 0)) AS total_yellows
+    FROM matches m
+    JOIN match_statistics ms ON ms.match_id = m.id
+    WHERE m.status = 'FINISHED' AND m.referee_id IS NOT NULL
+    GROUP BY m.referee_id
+) old ON old.referee_id = r.id
+WHERE r.total_yellows <> old.total_yellows;
@@ -0,0 +1,365 @@
+-- database/migrations/017_referee_season_baselines.sql
+-- Medie gialli per arbitro/competizione/stagione e per competizione/stagione in tabella
+-- referee_league_comparison era fissa su '2025-2026' e aggregava tutte le partite della
+-- stagione a ogni lettura: nessuna analisi storica e una migration a ogni cambio stagione.
+-- Ora le medie sono precalcolate per stagione (aggiornate dalla sync per la sola partizione
+-- del run) e le funzioni ricevono la stagione: ogni stagione è una lettura per indice.
+-- Eseguire in Supabase SQL Editor DOPO 001-016
+
+-- 1. Tabelle
+-- Una riga per arbitro/competizione/stagione
+CREATE TABLE IF NOT EXISTS referee_season_baselines (
+    referee_id UUID NOT NULL REFERENCES referees(id) ON DELETE CASCADE,
+    competition_id UUID NOT NULL REFERENCES competitions(id) ON DELETE CASCADE,
+    season VARCHAR(10) NOT NULL,
+    competition_code VARCHAR(10) NOT NULL,
+    matches INTEGER NOT NULL DEFAULT 0,
+    total_yellows INTEGER NOT NULL DEFAULT 0,
+    avg_yellows NUMERIC NOT NULL DEFAULT 0,
+    refreshed_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (referee_id, competition_id, season)
+);
+
+-- Una riga per competizione/stagione (tutte le partite concluse, anche senza arbitro)
+CREATE TABLE IF NOT EXISTS league_season_baselines (
+    competition_id UUID NOT NULL REFERENCES competitions(id) ON DELETE CASCADE,
+    season VARCHAR(10) NOT NULL,
+    competition_code VARCHAR(10) NOT NULL,
+    matches INTEGER NOT NULL DEFAULT 0,
+    total_yellows INTEGER NOT NULL DEFAULT 0,
+    avg_yellows NUMERIC NOT NULL DEFAULT 0,
+    refreshed_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (competition_id, season)
+);
+
+-- Partizione ricalcolata dalla sync e confronto di tutti gli arbitri di una stagione
+CREATE INDEX IF NOT EXISTS idx_referee_season_baselines_partition
+ON referee_season_baselines(season, competition_code);
+CREATE INDEX IF NOT EXISTS idx_referee_season_baselines_referee
+ON referee_season_baselines(referee_id, season);
+
+COMMENT ON TABLE referee_season_baselines IS 'Media gialli per arbitro/competizione/stagione. Ricalcolata da refresh_referee_season_baselines a fine sync.';
+COMMENT ON TABLE league_season_baselines IS 'Media gialli per competizione/stagione. Ricalcolata da refresh_referee_season_baselines a fine sync.';
+
+-- 2. Funzione di ricalcolo di una partizione
+-- p_competition_code = NULL ricalcola tutta la stagione. Gialli da match_card_summary (016):
+-- le partite concluse senza dettagli contano 0, come nella vista originale (003)
+CREATE OR REPLACE FUNCTION refresh_referee_season_baselines(
+    p_season TEXT,
+    p_competition_code TEXT DEFAULT NULL
+)
+RETURNS INTEGER
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_updated INTEGER;
+    v_refreshed_at TIMESTAMPTZ := NOW();
+BEGIN
+    -- Per competizione
+    WITH season_matches AS (
+        SELECT
+            m.competition_id,
+            c.code AS competition_code,
+            COALESCE(mcs.event_yellows, 0) AS yellows
+        FROM matches m
+        JOIN competitions c ON c.id = m.competition_id
+        LEFT JOIN match_card_summary mcs ON mcs.match_id = m.id
+        WHERE m.status = 'FINISHED'
+          AND m.season = p_season
+          AND (p_competition_code IS NULL OR c.code = p_competition_code)
+    )
+    INSERT INTO league_season_baselines (
+        competition_id, season, competition_code, matches, total_yellows, avg_yellows, refreshed_at
+    )
+    SELECT
+        sm.competition_id,
+        p_season,
+        sm.competition_code,
+        COUNT(*),
+        SUM(sm.yellows),
+        AVG(sm.yellows),
+        v_refreshed_at
+    FROM season_matches sm
+    GROUP BY sm.competition_id, sm.competition_code
+    ON CONFLICT (competition_id, season) DO UPDATE SET
+        competition_code = EXCLUDED.competition_code,
+        matches = EXCLUDED.matches,
+        total_yellows = EXCLUDED.total_yellows,
+        avg_yellows = EXCLUDED.avg_yellows,
+        refreshed_at = EXCLUDED.refreshed_at;
+
+    -- Per arbitro e competizione
+    WITH referee_matches AS (
+        SELECT
+            m.referee_id,
+            m.competition_id,
+            c.code AS competition_code,
+            COALESCE(mcs.event_yellows, 0) AS yellows
+        FROM matches m
+        JOIN competitions c ON c.id = m.competition_id
+        LEFT JOIN match_card_summary mcs ON mcs.match_id = m.id
+        WHERE m.status = 'FINISHED'
+          AND m.referee_id IS NOT NULL
+          AND m.season = p_season
+          AND (p_competition_code IS NULL OR c.code = p_competition_code)
+    )
+    INSERT INTO referee_season_baselines (
+        referee_id, competition_id, season, competition_code, matches, total_yellows, avg_yellows, refreshed_at
+    )
+    SELECT
+        rm.referee_id,
+        rm.competition_id,
+        p_season,
+        rm.competition_code,
+        COUNT(*),
+        SUM(rm.yellows),
+        AVG(rm.yellows),
+        v_refreshed_at
+    FROM referee_matches rm
+    GROUP BY rm.referee_id, rm.competition_id, rm.competition_code
+    ON CONFLICT (referee_id, competition_id, season) DO UPDATE SET
+        competition_code = EXCLUDED.competition_code,
+        matches = EXCLUDED.matches,
+        total_yellows = EXCLUDED.total_yellows,
+        avg_yellows = EXCLUDED.avg_yellows,
+        refreshed_at = EXCLUDED.refreshed_at;
+
+    GET DIAGNOSTICS v_updated = ROW_COUNT;
+
+    -- Righe della partizione non più presenti (es. arbitro corretto su una partita)
+    DELETE FROM referee_season_baselines
+    WHERE season = p_season
+      AND (p_competition_code IS NULL OR competition_code = p_competition_code)
+      AND refreshed_at < v_refreshed_at;
+
+    DELETE FROM league_season_baselines
+    WHERE season = p_season
+      AND (p_competition_code IS NULL OR competition_code = p_competition_code)
+      AND refreshed_at < v_refreshed_at;
+
+    RETURN v_updated;
+END;
+$$;
+
+COMMENT ON FUNCTION refresh_referee_season_baselines IS 'Ricalcola referee_season_baselines e league_season_baselines di una stagione/competizione (NULL = tutte)';
+
+-- 3. Funzioni per stagione
+-- Stagione delle medie di una competizione: quella passata dal chiamante (NULL = stagione
+-- più recente in matches) se ha partite concluse, altrimenti la precedente. A inizio
+-- stagione, prima delle prime partite, le medie non restano vuote.
+CREATE OR REPLACE FUNCTION baseline_season(p_season TEXT, p_competition_code TEXT)
+RETURNS TEXT
+LANGUAGE sql
+STABLE
+AS $$
+    SELECT CASE
+        WHEN EXISTS (
+            SELECT 1
+            FROM league_season_baselines lsb
+            WHERE lsb.competition_code = p_competition_code
+              AND lsb.season = r.season
+              AND lsb.matches > 0
+        ) THEN r.season
+        -- '2025-2026' -> '2024-2025'
+        ELSE (split_part(r.season, '-', 1)::INTEGER - 1)::TEXT || '-' || split_part(r.season, '-', 1)
+    END
+    FROM (SELECT COALESCE(p_season, (SELECT MAX(m.season) FROM matches m)) AS season) r;
+$$;
+
+COMMENT ON FUNCTION baseline_season IS 'Stagione delle medie di una competizione: la richiesta (NULL = più recente) se ha partite concluse, altrimenti la precedente';
+
+CREATE OR REPLACE FUNCTION get_referee_league_comparison(
+    p_season TEXT DEFAULT NULL,
+    p_competition_code TEXT DEFAULT NULL,
+    p_referee_ids UUID[] DEFAULT NULL
+)
+RETURNS TABLE (
+    referee_id UUID,
+    referee_name TEXT,
+    competition_code VARCHAR(10),
+    season VARCHAR(10),
+    matches_in_league BIGINT,
+    ref_avg_yellows NUMERIC,
+    league_avg_yellows NUMERIC,
+    ref_league_delta NUMERIC,
+    referee_profile TEXT
+)
+LANGUAGE sql
+STABLE
+AS $$
+    SELECT
+        rsb.referee_id,
+        r.name::TEXT,
+        rsb.competition_code,
+        rsb.season,
+        rsb.matches::BIGINT,
+        ROUND(rsb.avg_yellows, 2),
+        ROUND(lsb.avg_yellows, 2),
+        ROUND(rsb.avg_yellows - lsb.avg_yellows, 2),
+        -- Classificazione outlier (soglie della 003)
+        CASE
+            WHEN rsb.avg_yellows - lsb.avg_yellows > 1.0 THEN 'STRICT_OUTLIER'
+            WHEN rsb.avg_yellows - lsb.avg_yellows < -1.0 THEN 'LENIENT_OUTLIER'
+            WHEN rsb.avg_yellows - lsb.avg_yellows > 0.5 THEN 'ABOVE_AVERAGE'
+            WHEN rsb.avg_yellows - lsb.avg_yellows < -0.5 THEN 'BELOW_AVERAGE'
+            ELSE 'AVERAGE'
+        END
+    FROM referee_season_baselines rsb
+    JOIN league_season_baselines lsb
+        ON lsb.competition_id = rsb.competition_id AND lsb.season = rsb.season
+    JOIN referees r ON r.id = rsb.referee_id
+    WHERE rsb.season = baseline_season(p_season, rsb.competition_code)
+      AND (p_competition_code IS NULL OR rsb.competition_code = p_competition_code)
+      AND (p_referee_ids IS NULL OR rsb.referee_id = ANY(p_referee_ids))
+      AND rsb.matches >= 3  -- Minimo 3 partite per essere significativo
+    ORDER BY ROUND(rsb.avg_yellows - lsb.avg_yellows, 2) DESC;
+$$;
+
+COMMENT ON FUNCTION get_referee_league_comparison IS 'Confronto arbitri vs media lega di una stagione (NULL = più recente; senza partite concluse la precedente, vedi baseline_season), filtri opzionali per competizione e arbitri';
+
+CREATE OR REPLACE FUNCTION get_league_card_baselines(p_season TEXT DEFAULT NULL)
+RETURNS TABLE (
+    competition_code VARCHAR(10),
+    competition_name VARCHAR(100),
+    season VARCHAR(10),
+    baseline_yellows_per_match NUMERIC,
+    normalization_factor NUMERIC,
+    observed_matches INTEGER,
+    observed_yellows_per_match NUMERIC
+)
+LANGUAGE sql
+STABLE
+AS $$
+    SELECT
+        lcb.competition_code,
+        lcb.competition_name,
+        s.season::VARCHAR(10),
+        lcb.baseline_yellows_per_match,
+        lcb.normalization_factor,
+        COALESCE(lsb.matches, 0),
+        ROUND(lsb.avg_yellows, 2)
+    FROM league_card_baselines lcb
+    CROSS JOIN LATERAL (SELECT baseline_season(p_season, lcb.competition_code) AS season) s
+    LEFT JOIN league_season_baselines lsb
+        ON lsb.competition_code = lcb.competition_code AND lsb.season = s.season
+    ORDER BY lcb.competition_code;
+$$;
+
+COMMENT ON FUNCTION get_league_card_baselines IS 'Baseline e fattore di normalizzazione per competizione con la media gialli osservata nella stagione (vedi baseline_season)';
+
+-- 4. referee_league_comparison: stesse colonne, stagione più recente invece di '2025-2026'
+DROP VIEW IF EXISTS referee_league_comparison;
+
+CREATE VIEW referee_league_comparison AS
+SELECT
+    referee_id,
+    referee_name,
+    competition_code,
+    matches_in_league,
+    ref_avg_yellows,
+    league_avg_yellows,
+    ref_league_delta,
+    referee_profile
+FROM get_referee_league_comparison();
+
+COMMENT ON VIEW referee_league_comparison IS 'Confronto arbitri vs media lega nella stagione più recente, o nella precedente se non ha ancora partite concluse (per altre stagioni: get_referee_league_comparison)';
+
+-- 5. Profilo e moltiplicatore arbitro (014) con stagione opzionale (NULL = più recente)
+DROP FUNCTION IF EXISTS get_referee_profile(TEXT);
+DROP FUNCTION IF EXISTS get_referee_multiplier(TEXT);
+
+CREATE OR REPLACE FUNCTION get_referee_profile(p_referee_name TEXT, p_season TEXT DEFAULT NULL)
+RETURNS TABLE (
+    referee_name TEXT,
+    competition_code VARCHAR(10),
+    matches_in_league BIGINT,
+    ref_avg_yellows NUMERIC,
+    league_avg_yellows NUMERIC,
+    ref_league_delta NUMERIC,
+    referee_profile TEXT
+)
+LANGUAGE sql
+STABLE
+AS $$
+    SELECT
+        rlc.referee_name,
+        rlc.competition_code,
+        rlc.matches_in_league,
+        rlc.ref_avg_yellows,
+        rlc.league_avg_yellows,
+        rlc.ref_league_delta,
+        rlc.referee_profile
+    FROM get_referee_league_comparison(p_season, NULL, ARRAY[find_referee_id(p_referee_name)]) rlc
+    ORDER BY rlc.matches_in_league DESC
+    LIMIT 1;
+$$;
+
+CREATE OR REPLACE FUNCTION get_referee_multiplier(p_referee_name TEXT, p_season TEXT DEFAULT NULL)
+RETURNS NUMERIC
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_profile TEXT;
+    v_delta NUMERIC;
+BEGIN
+    SELECT rlc.referee_profile, rlc.ref_league_delta INTO v_profile, v_delta
+    FROM get_referee_league_comparison(p_season, NULL, ARRAY[find_referee_id(p_referee_name)]) rlc
+    ORDER BY rlc.matches_in_league DESC
+    LIMIT 1;
+
+    IF v_profile IS NULL THEN
+        RETURN 1.0;
+    END IF;
+
+    -- Ogni +0.5 gialli sopra media = +5% rischio, max ±15%
+    RETURN GREATEST(0.85, LEAST(1.15, 1.0 + (v_delta * 0.10)));
+END;
+$$;
+
+COMMENT ON FUNCTION get_referee_profile IS 'Profilo arbitro nella lega con più partite della stagione (NULL = più recente, vedi baseline_season)';
+COMMENT ON FUNCTION get_referee_multiplier IS 'Moltiplicatore arbitro 0.85-1.15 dalla stagione indicata (NULL = più recente, vedi baseline_season)';
+
+-- 6. analyze_match_risk_v2: profilo arbitro della stagione richiesta (p_season, o la
+-- precedente se non ha ancora partite concluse)
+-- Ridefinisce solo match_risk_referee_profile (009)
+CREATE OR REPLACE FUNCTION match_risk_referee_profile(p_referee_id UUID, p_season TEXT)
+RETURNS TABLE (
+    referee_profile TEXT,
+    ref_avg_yellows NUMERIC,
+    league_avg_yellows NUMERIC,
+    ref_league_delta NUMERIC
+)
+LANGUAGE sql
+STABLE
+AS $$
+    SELECT
+        rlc.referee_profile,
+        rlc.ref_avg_yellows,
+        rlc.league_avg_yellows,
+        rlc.ref_league_delta
+    FROM get_referee_league_comparison(p_season, NULL, ARRAY[p_referee_id]) rlc
+    ORDER BY rlc.matches_in_league DESC
+    LIMIT 1;
+$$;
+
+COMMENT ON FUNCTION match_risk_referee_profile IS 'Profilo arbitro per analyze_match_risk_v2 nella stagione indicata (lega con più partite)';
+
+-- 7. Popolamento iniziale (tutte le stagioni presenti) e verifica
+SELECT s.season, refresh_referee_season_baselines(s.season)
+FROM (SELECT DISTINCT season FROM matches) s;
+
+-- Snapshot rischio di tutte le stagioni: analyze_match_risk(season=...) legge le rose da qui
+-- (ricalcolato anche per i falli squadra di match_card_summary, 016)
+SELECT s.season, refresh_player_risk_features(s.season) AS righe_aggiornate
+FROM (SELECT DISTINCT season FROM matches) s;
+
+SELECT season, competition_code, matches, ROUND(avg_yellows, 2) AS avg_yellows
+FROM league_season_baselines
+ORDER BY season DESC, competition_code;
+SELECT * FROM get_referee_league_comparison('2024-2025', 'SA') LIMIT 10;
+SELECT * FROM get_league_card_baselines('2024-2025');
+SELECT * FROM get_referee_profile('Orsato', '2024-2025');
+-- Stagione senza partite concluse: medie della precedente
+SELECT competition_code, baseline_season('2026-2027', competition_code) FROM league_card_baselines;
+-- Ricalcolo di una sola partizione (come fa la sync)
+-- SELECT refresh_referee_season_baselines('2025-2026', 'SA');
@@ -0,0 +1,43 @@
+-- database/migrations/018_replace_match_events.sql
+-- Sostituzione degli eventi di un blocco di partite in una sola transazione
+-- Gli eventi non hanno una chiave naturale: la sync li cancellava e reinseriva con chiamate
+-- PostgREST separate, e un inserimento fallito lasciava le partite senza cartellini.
+-- Eseguire in Supabase SQL Editor DOPO 001-017
+
+-- 1. Funzione: cancella gli eventi delle partite indicate e inserisce quelli passati
+-- p_events: array JSON di righe match_events (match_id, team_id, player_id, player_in_id,
+-- event_type, minute, detail). Un errore annulla anche la cancellazione.
+CREATE OR REPLACE FUNCTION replace_match_events(p_match_ids UUID[], p_events JSONB)
+RETURNS INTEGER
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_inserted INTEGER;
+BEGIN
+    DELETE FROM match_events
+    WHERE match_id = ANY(p_match_ids);
+
+    INSERT INTO match_events (
+        match_id, team_id, player_id, player_in_id, event_type, minute, extra_time_minute, detail
+    )
+    SELECT
+        e.match_id,
+        e.team_id,
+        e.player_id,
+        e.player_in_id,
+        e.event_type,
+        e.minute,
+        e.extra_time_minute,
+        e.detail
+    FROM jsonb_populate_recordset(NULL::match_events, COALESCE(p_events, '[]'::JSONB)) e
+    WHERE e.match_id = ANY(p_match_ids);
+
+    GET DIAGNOSTICS v_inserted = ROW_COUNT;
+    RETURN v_inserted;
+END;
+$$;
+
+COMMENT ON FUNCTION replace_match_events IS 'Sostituisce in una transazione gli eventi delle partite indicate con quelli passati (array JSON)';
+
+-- 2. Verifica (nessuna modifica: partita inesistente)
+SELECT replace_match_events(ARRAY[uuid_generate_v4()], '[]'::JSONB) AS eventi_inseriti;
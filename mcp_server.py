@@ -7,12 +7,33 @@ Avvio: python mcp_server.py
 
 import os
 import json
+import time
+import base64
+import binascii
+import threading
+import functools
+import httpx
 import requests
+import numpy as np
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from dotenv import load_dotenv
 from mcp.server.fastmcp import FastMCP
 from supabase import create_client, Client
 
+from name_resolver import NameIndex, TEAM_ALIASES
+from output_format import DEFAULT_FORMAT, render, select_columns
+from scoring import (
+    H2H_THRESHOLD,
+    HOME_MULTIPLIER,
+    AWAY_MULTIPLIER,
+    score_players,
+    seasonal_scores,
+    ranking,
+    player_breakdown,
+)
+
 # Carica variabili d'ambiente
 load_dotenv()
 
@@ -22,33 +43,323 @@ SUPABASE_KEY = os.getenv("SUPABASE_KEY")
 # Inizializza MCP server
 mcp = FastMCP("YellowOracle")
 
+# Query di analyze_match_risk eseguite in parallelo (pool limitato, condiviso tra chiamate)
+ANALYSIS_EXECUTOR = ThreadPoolExecutor(max_workers=12, thread_name_prefix="analysis")
+FACTOR_TIMEOUT = 5  # Secondi: oltre, il fattore opzionale viene ignorato
+SQUAD_QUERY_TIMEOUT = 15  # Secondi: dati stagionali delle rose (necessari)
+
+# Cache dati di riferimento (squadre, derby, baseline, profili): cambiano solo con una sync
+REFERENCE_CACHE_SIZE = 512
+REFERENCE_CACHE_TTL = 1800  # Secondi
+DATA_VERSION_CHECK_INTERVAL = 5  # Secondi tra due letture della versione dati (sync_runs)
+NAME_KINDS = ("team", "player", "referee")  # Tipi di nome risolti da name_resolver.py
+
+# Colonne di get_team_players senza fields (player_id serve al cursore; squadra e stagione non ripetute su ogni riga)
+TEAM_PLAYER_COLUMNS = "player_id, player_name, position, competitions, matches_played, yellow_cards, red_cards, minutes_played, yellows_per_90"
+
+DB_PAGE_SIZE = 1000  # Righe massime restituite da PostgREST per chiamata
+DEFAULT_PAGE_SIZE = 100  # Righe per pagina dei tool paginati (cursor / next_cursor)
+MATCHDAY_LEADERBOARD_SIZE = 10
+CURRENT_SEASON = "2025-2026"  # Stagione di default dei tool (parametro season)
+
+# Client condivisi dal processo (creati alla prima richiesta, connessioni keep-alive)
+_supabase_client = None
+_supabase_generation = 0  # Incrementato a ogni reset: segnala ai tool che il client è stato ricreato
+_supabase_lock = threading.Lock()
+_football_session = None
+_football_lock = threading.Lock()
+
+
 def get_supabase() -> Client:
-    """Crea connessione a Supabase."""
-    return create_client(SUPABASE_URL, SUPABASE_KEY)
+    """
+    Restituisce il client Supabase condiviso, creandolo alla prima chiamata.
+    Il client HTTP sottostante mantiene le connessioni aperte tra un tool e l'altro.
+    """
+    global _supabase_client
+    if _supabase_client is None:
+        with _supabase_lock:
+            if _supabase_client is None:
+                _supabase_client = create_client(SUPABASE_URL, SUPABASE_KEY)
+    return _supabase_client
 
 
-@mcp.tool()
-def get_matches_by_date(competition: str = "SA", date: str = None, days_ahead: int = 0) -> str:
+def reset_supabase():
+    """Scarta il client condiviso: la prossima get_supabase() apre una nuova connessione."""
+    global _supabase_client, _supabase_generation
+    with _supabase_lock:
+        _supabase_client = None
+        _supabase_generation += 1
+
+
+def get_football_session() -> requests.Session:
+    """Sessione HTTP condivisa per football-data.org (riusa connessioni TLS)."""
+    global _football_session
+    if _football_session is None:
+        with _football_lock:
+            if _football_session is None:
+                _football_session = requests.Session()
+    return _football_session
+
+
+def error_response(e: Exception, prefix: str = "Errore") -> str:
+    """Messaggio di errore per i tool; su errori di connessione resetta il client Supabase."""
+    if isinstance(e, (httpx.TransportError, ConnectionError)):
+        reset_supabase()
+    return f"{prefix}: {str(e)}"
+
+
+def reconnecting(tool):
     """
-    Recupera le partite di una competizione per una data specifica.
-    Utile per analizzare tutte le partite di una giornata.
+    Se durante il tool il client Supabase è stato resettato per un errore di
+    connessione (vedi error_response), riprova una volta con un client nuovo.
+    """
+    @functools.wraps(tool)
+    def wrapper(*args, **kwargs):
+        generation = _supabase_generation
+        result = tool(*args, **kwargs)
+        if generation != _supabase_generation and isinstance(result, str) and result.startswith("Errore"):
+            result = tool(*args, **kwargs)
+        return result
+    return wrapper
+
+
+def fetch_all_rows(query_factory) -> list:
+    """
+    Legge tutte le righe di una select paginando con range() (PostgREST restituisce
+    al massimo DB_PAGE_SIZE righe per chiamata). query_factory() crea la query da zero.
+    """
+    rows = []
+    offset = 0
+    while True:
+        page = query_factory().range(offset, offset + DB_PAGE_SIZE - 1).execute().data or []
+        rows.extend(page)
+        if len(page) < DB_PAGE_SIZE:
+            return rows
+        offset += DB_PAGE_SIZE
+
+
+def encode_cursor(values: list) -> str:
+    """Cursore opaco: valori delle colonne di ordinamento dell'ultima riga restituita."""
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+def decode_cursor(cursor: str, size: int) -> list:
+    """Valori del cursore (size = numero di colonne di ordinamento del tool)."""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, binascii.Error):
+        values = None
+    if not isinstance(values, list) or len(values) != size:
+        raise ValueError("Cursore non valido: usa il next_cursor restituito dalla pagina precedente")
+    return values
+
+
+def postgrest_value(value) -> str:
+    """Valore tra virgolette per i filtri or() di PostgREST (virgole, punti e parentesi ammessi)."""
+    text = str(value).replace("\\", "\\\\").replace('"', '\\"')
+    return f'"{text}"'
 
-    Args:
-        competition: Codice competizione (SA, PL, BL1, PD, FL1, CL, EL). Default: SA (Serie A)
-        date: Data in formato "YYYY-MM-DD". Se None, usa oggi + days_ahead
-        days_ahead: Giorni da oggi (usato se date è None). Default: 0 (oggi)
+
+def keyset_page(query, keys: list, cursor: str = None, page_size: int = DEFAULT_PAGE_SIZE):
+    """
+    Una pagina di query ordinata per keys [(colonna, desc), ...], a partire dal cursore.
+    L'ultima colonna deve rendere l'ordine univoco (es. id) e avere un indice con lo stesso ordine.
 
     Returns:
-        Lista partite con: squadre, orario, arbitro (se designato), stadio
+        (righe, next_cursor): next_cursor è None sull'ultima pagina
+    """
+    page_size = max(1, min(page_size, DB_PAGE_SIZE - 1))
+
+    if cursor:
+        # (a, b) dopo (x, y): a oltre x, oppure a = x e b oltre y
+        values = decode_cursor(cursor, len(keys))
+        conditions = []
+        for i, (column, desc) in enumerate(keys):
+            terms = [f"{c}.eq.{postgrest_value(v)}" for (c, _), v in zip(keys[:i], values)]
+            terms.append(f"{column}.{'lt' if desc else 'gt'}.{postgrest_value(values[i])}")
+            conditions.append(f"and({','.join(terms)})" if len(terms) > 1 else terms[0])
+        query = query.or_(",".join(conditions))
+
+    for column, desc in keys:
+        query = query.order(column, desc=desc)
+
+    rows = query.limit(page_size + 1).execute().data or []
+    if len(rows) <= page_size:
+        return rows, None
+    rows = rows[:page_size]
+    return rows, encode_cursor([rows[-1][column] for column, _ in keys])
+
+
+def data_version(supabase: Client):
+    """Versione dati: ultimo aggiornamento di un run di sync (fine fase o fine run)."""
+    result = supabase.table("sync_runs").select("updated_at").order(
+        "updated_at", desc=True
+    ).limit(1).execute()
+    return result.data[0]["updated_at"] if result.data else None
+
+
+class ReferenceCache:
+    """
+    Cache LRU con TTL per i lookup che cambiano solo quando gira una sync.
+    Viene svuotata appena cambia la versione dati (sync_runs.updated_at),
+    così dopo una sync i risultati non sono mai vecchi.
+    """
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (scadenza, valore)
+        self._lock = threading.Lock()
+        self._version = None
+        self._generation = 0  # Incrementato a ogni svuotamento
+        self._version_checked_at = 0.0
+
+    def _check_version(self, supabase: Client):
+        with self._lock:
+            now = time.monotonic()
+            if now - self._version_checked_at < DATA_VERSION_CHECK_INTERVAL:
+                return
+            self._version_checked_at = now
+        try:
+            version = data_version(supabase)
+        except Exception:
+            return  # Versione non leggibile: valgono solo le TTL
+        with self._lock:
+            if version != self._version:
+                self._entries.clear()
+                self._version = version
+                self._generation += 1
+
+    def get(self, supabase: Client, key: tuple, loader):
+        """Valore in cache per key, altrimenti loader() (le eccezioni non vengono messe in cache)."""
+        self._check_version(supabase)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] > time.monotonic():
+                self._entries.move_to_end(key)
+                return entry[1]
+            generation = self._generation
+
+        value = loader()
+
+        with self._lock:
+            # Non salvare valori letti prima di uno svuotamento
+            if generation == self._generation:
+                self._store(key, value)
+        return value
+
+    def get_many(self, supabase: Client, kind: str, ids, loader) -> dict:
+        """
+        Come get() per più chiavi dello stesso tipo: loader(ids_mancanti) -> {id: valore}
+        viene chiamato una sola volta per tutte le chiavi non in cache (id assente = None).
+        """
+        self._check_version(supabase)
+        result, missing = {}, []
+        with self._lock:
+            now = time.monotonic()
+            for id_ in dict.fromkeys(ids):
+                entry = self._entries.get((kind, id_))
+                if entry and entry[0] > now:
+                    self._entries.move_to_end((kind, id_))
+                    result[id_] = entry[1]
+                else:
+                    missing.append(id_)
+            generation = self._generation
+
+        if missing:
+            loaded = loader(missing)
+            with self._lock:
+                for id_ in missing:
+                    result[id_] = loaded.get(id_)
+                    if generation == self._generation:
+                        self._store((kind, id_), result[id_])
+        return result
+
+    def _store(self, key: tuple, value):
+        """Salva un valore (chiamare con il lock acquisito), eliminando i meno usati oltre max_size."""
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._generation += 1
+
+
+REFERENCE_CACHE = ReferenceCache(REFERENCE_CACHE_SIZE, REFERENCE_CACHE_TTL)
+
+
+# Indici dei nomi (name_resolver.py): cache a parte, così l'LRU dei lookup non li scarta.
+# Un lock per tipo: richieste concorrenti aspettano lo stesso indice invece di ricostruirlo.
+NAME_INDEX_CACHE = ReferenceCache(len(NAME_KINDS), REFERENCE_CACHE_TTL)
+_name_index_locks = {kind: threading.Lock() for kind in NAME_KINDS}
+
+
+def load_name_index(supabase: Client, kind: str) -> NameIndex:
+    """Tutti i nomi di un tipo (team, player, referee) dal DB, indicizzati."""
+    if kind == "team":
+        rows = fetch_all_rows(lambda: supabase.table("teams").select("id, name, short_name, tla").order("id"))
+        return NameIndex(rows, extra_keys=("short_name", "tla"), aliases=TEAM_ALIASES)
+    if kind == "referee":
+        rows = fetch_all_rows(lambda: supabase.table("referees").select("id, name, nationality").order("id"))
+        return NameIndex(rows)
+    rows = fetch_all_rows(lambda: supabase.table("players").select("id, name, position, teams(name)").order("id"))
+    return NameIndex([
+        {"id": r["id"], "name": r["name"], "position": r.get("position"), "team": (r.get("teams") or {}).get("name")}
+        for r in rows
+    ])
+
+
+def name_index(supabase: Client, kind: str) -> NameIndex:
+    """Indice dei nomi di un tipo, ricostruito dopo ogni sync (versione dati) o a TTL scaduta."""
+    with _name_index_locks[kind]:
+        return NAME_INDEX_CACHE.get(supabase, ("names", kind), lambda: load_name_index(supabase, kind))
+
+
+def resolve_team_id(supabase: Client, team_name: str):
+    """ID della squadra che corrisponde meglio a team_name (nome, short_name, TLA o alias)."""
+    return name_index(supabase, "team").resolve(team_name)
+
+
+def resolve_referee_id(supabase: Client, referee_name: str):
+    """ID dell'arbitro che corrisponde meglio a referee_name."""
+    return name_index(supabase, "referee").resolve(referee_name)
+
+
+def resolve_player_id(supabase: Client, player_name: str):
+    """ID del giocatore che corrisponde meglio a player_name."""
+    return name_index(supabase, "player").resolve(player_name)
+
+
+VALID_COMPETITIONS = {"SA", "PL", "BL1", "PD", "FL1", "CL", "EL"}
+
+COMPETITION_NAMES = {
+    "SA": "Serie A",
+    "PL": "Premier League",
+    "BL1": "Bundesliga",
+    "PD": "La Liga",
+    "FL1": "Ligue 1",
+    "CL": "UEFA Champions League",
+    "EL": "UEFA Europa League"
+}
+
+
+def fetch_competition_matches(competition: str, date: str = None, days_ahead: int = 0):
+    """
+    Partite di una competizione in una data (payload grezzo di football-data.org).
+
+    Returns:
+        (data, partite, errore): errore è il messaggio da restituire al client, None se ok
     """
     FOOTBALL_API_KEY = os.getenv("FOOTBALL_API_KEY")
     if not FOOTBALL_API_KEY:
-        return "Errore: FOOTBALL_API_KEY non configurata"
+        return None, [], "Errore: FOOTBALL_API_KEY non configurata"
 
     # Validazione competizione
-    VALID_COMPETITIONS = {"SA", "PL", "BL1", "PD", "FL1", "CL", "EL"}
     if competition not in VALID_COMPETITIONS:
-        return f"Errore: Competizione '{competition}' non valida. Usa: {', '.join(sorted(VALID_COMPETITIONS))}"
+        return None, [], f"Errore: Competizione '{competition}' non valida. Usa: {', '.join(sorted(VALID_COMPETITIONS))}"
 
     # Calcola e valida la data
     if date:
@@ -56,54 +367,67 @@ def get_matches_by_date(competition: str = "SA", date: str = None, days_ahead: i
             datetime.strptime(date, "%Y-%m-%d")
             target_date = date
         except ValueError:
-            return "Errore: Formato data non valido. Usa YYYY-MM-DD (es: 2026-02-01)"
+            return None, [], "Errore: Formato data non valido. Usa YYYY-MM-DD (es: 2026-02-01)"
     else:
         target_date = (datetime.now() + timedelta(days=days_ahead)).strftime("%Y-%m-%d")
 
-    # Mapping competizioni
-    comp_names = {
-        "SA": "Serie A",
-        "PL": "Premier League",
-        "BL1": "Bundesliga",
-        "PD": "La Liga",
-        "FL1": "Ligue 1",
-        "CL": "UEFA Champions League",
-        "EL": "UEFA Europa League"
-    }
-
     url = f"https://api.football-data.org/v4/competitions/{competition}/matches"
     params = {"dateFrom": target_date, "dateTo": target_date}
     headers = {"X-Auth-Token": FOOTBALL_API_KEY}
 
-    try:
-        response = requests.get(url, params=params, headers=headers)
-        if response.status_code != 200:
-            return f"Errore API: {response.status_code} - {response.text[:200]}"
+    response = get_football_session().get(url, params=params, headers=headers)
+    if response.status_code != 200:
+        return target_date, [], f"Errore API: {response.status_code} - {response.text[:200]}"
 
-        data = response.json()
-        matches = data.get("matches", [])
+    return target_date, response.json().get("matches", []), None
+
+
+def main_referee(match: dict):
+    """Arbitro principale di una partita API (dict con id e name) o None se non designato."""
+    for ref in match.get("referees", []):
+        if ref.get("type") == "REFEREE":
+            return ref
+    return None
+
+
+@mcp.tool()
+def get_matches_by_date(competition: str = "SA", date: str = None, days_ahead: int = 0, format: str = DEFAULT_FORMAT, fields: str = None) -> str:
+    """
+    Recupera le partite di una competizione per una data specifica.
+    Utile per analizzare tutte le partite di una giornata.
+
+    Args:
+        competition: Codice competizione (SA, PL, BL1, PD, FL1, CL, EL). Default: SA (Serie A)
+        date: Data in formato "YYYY-MM-DD". Se None, usa oggi + days_ahead
+        days_ahead: Giorni da oggi (usato se date è None). Default: 0 (oggi)
+        format: "compact" (JSON minimale, default), "json" (indentato) o "table" (colonne + righe)
+        fields: Campi da restituire separati da virgola, "a.b" per i campi annidati. None = tutti
+
+    Returns:
+        Lista partite con: squadre, orario, arbitro (se designato), stadio
+    """
+    try:
+        target_date, matches, error = fetch_competition_matches(competition, date, days_ahead)
+        if error:
+            return error
 
         if not matches:
-            return json.dumps({
-                "competition": comp_names.get(competition, competition),
+            return render({
+                "competition": COMPETITION_NAMES.get(competition, competition),
                 "date": target_date,
                 "matches": [],
                 "message": "Nessuna partita in questa data"
-            }, indent=2)
+            }, format, fields)
 
         result = {
-            "competition": comp_names.get(competition, competition),
+            "competition": COMPETITION_NAMES.get(competition, competition),
             "date": target_date,
             "matches": []
         }
 
         for match in matches:
             # Estrai arbitro principale
-            referee_name = None
-            for ref in match.get("referees", []):
-                if ref.get("type") == "REFEREE":
-                    referee_name = ref.get("name")
-                    break
+            referee_name = (main_referee(match) or {}).get("name")
 
             # Formatta orario
             utc_date = match.get("utcDate", "")
@@ -119,22 +443,25 @@ def get_matches_by_date(competition: str = "SA", date: str = None, days_ahead: i
                 "status": match.get("status")
             })
 
-        return json.dumps(result, indent=2, ensure_ascii=False)
+        return render(result, format, fields)
 
     except Exception as e:
-        return f"Errore: {str(e)}"
+        return error_response(e)
 
 
 @mcp.tool()
-def get_player_season_stats(player_name: str, season: str = None, competition: str = None) -> str:
+@reconnecting
+def get_player_season_stats(player_name: str, season: str = None, competition: str = None, format: str = DEFAULT_FORMAT, fields: str = None) -> str:
     """
     Ottiene le statistiche cartellini di un giocatore per stagione e competizione.
     I dati sono separati per competizione (es: Serie A vs Champions League).
 
     Args:
-        player_name: Nome del giocatore (ricerca parziale supportata)
+        player_name: Nome del giocatore (senza accenti, anche parziale o con errori di battitura)
         season: Stagione specifica (es: "2025-2026") o None per tutte
         competition: Codice competizione (PD, SA, BL1, PL, FL1, CL, EL) o None per tutte
+        format: "compact" (JSON minimale, default), "json" (indentato) o "table" (colonne + righe)
+        fields: Campi da restituire separati da virgola, "a.b" per i campi annidati. None = tutti
 
     Returns:
         Statistiche cartellini per competizione: gialli, rossi, partite, media per 90 min
@@ -142,28 +469,35 @@ def get_player_season_stats(player_name: str, season: str = None, competition: s
     supabase = get_supabase()
 
     try:
+        player_id = resolve_player_id(supabase, player_name)
+        if not player_id:
+            return f"Nessun giocatore trovato per '{player_name}'"
+
         result = supabase.rpc(
-            "get_player_season_stats",
-            {"p_player_name": player_name, "p_season": season, "p_competition": competition}
+            "get_player_season_stats_by_id",
+            {"p_player_id": player_id, "p_season": season, "p_competition": competition}
         ).execute()
 
         if result.data:
-            return json.dumps(result.data, indent=2, default=str)
+            return render(result.data, format, fields)
         else:
             return f"Nessun dato trovato per il giocatore '{player_name}'"
     except Exception as e:
-        return f"Errore: {str(e)}"
+        return error_response(e)
 
 
 @mcp.tool()
-def get_player_season_stats_total(player_name: str, season: str = None) -> str:
+@reconnecting
+def get_player_season_stats_total(player_name: str, season: str = None, format: str = DEFAULT_FORMAT, fields: str = None) -> str:
     """
     Ottiene le statistiche cartellini TOTALI di un giocatore (tutte le competizioni aggregate).
     Utile per avere una visione complessiva del comportamento del giocatore.
 
     Args:
-        player_name: Nome del giocatore (ricerca parziale supportata)
+        player_name: Nome del giocatore (senza accenti, anche parziale o con errori di battitura)
         season: Stagione specifica (es: "2025-2026") o None per tutte
+        format: "compact" (JSON minimale, default), "json" (indentato) o "table" (colonne + righe)
+        fields: Campi da restituire separati da virgola, "a.b" per i campi annidati. None = tutti
 
     Returns:
         Statistiche totali: gialli, rossi, partite, media per 90 min, lista competizioni
@@ -171,21 +505,26 @@ def get_player_season_stats_total(player_name: str, season: str = None) -> str:
     supabase = get_supabase()
 
     try:
+        player_id = resolve_player_id(supabase, player_name)
+        if not player_id:
+            return f"Nessun giocatore trovato per '{player_name}'"
+
         result = supabase.rpc(
-            "get_player_season_stats_total",
-            {"p_player_name": player_name, "p_season": season}
+            "get_player_season_stats_total_by_id",
+            {"p_player_id": player_id, "p_season": season}
         ).execute()
 
         if result.data:
-            return json.dumps(result.data, indent=2, default=str)
+            return render(result.data, format, fields)
         else:
             return f"Nessun dato trovato per il giocatore '{player_name}'"
     except Exception as e:
-        return f"Errore: {str(e)}"
+        return error_response(e)
 
 
 @mcp.tool()
-def get_referee_player_cards(referee_name: str, team1_name: str, team2_name: str) -> str:
+@reconnecting
+def get_referee_player_cards(referee_name: str, team1_name: str, team2_name: str, format: str = DEFAULT_FORMAT, fields: str = None) -> str:
     """
     Ottiene lo storico delle ammonizioni di un arbitro verso i giocatori di due squadre specifiche.
     Utile per analizzare come un arbitro si comporta con i giocatori di determinate squadre.
@@ -194,6 +533,8 @@ def get_referee_player_cards(referee_name: str, team1_name: str, team2_name: str
         referee_name: Nome dell'arbitro
         team1_name: Nome della prima squadra
         team2_name: Nome della seconda squadra
+        format: "compact" (JSON minimale, default), "json" (indentato) o "table" (colonne + righe)
+        fields: Campi da restituire separati da virgola, "a.b" per i campi annidati. None = tutti
 
     Returns:
         Lista giocatori con: volte ammoniti, partite con l'arbitro, percentuale ammonizione
@@ -201,25 +542,34 @@ def get_referee_player_cards(referee_name: str, team1_name: str, team2_name: str
     supabase = get_supabase()
 
     try:
+        referee_id = resolve_referee_id(supabase, referee_name)
+        if not referee_id:
+            return f"Nessun arbitro trovato per '{referee_name}'"
+        team1_id = resolve_team_id(supabase, team1_name)
+        team2_id = resolve_team_id(supabase, team2_name)
+        if not (team1_id and team2_id):
+            return f"Squadra non trovata: {team1_name if not team1_id else team2_name}"
+
         result = supabase.rpc(
-            "get_referee_player_cards",
+            "get_referee_player_cards_by_id",
             {
-                "p_referee_name": referee_name,
-                "p_team1_name": team1_name,
-                "p_team2_name": team2_name
+                "p_referee_id": referee_id,
+                "p_team1_id": team1_id,
+                "p_team2_id": team2_id
             }
         ).execute()
 
         if result.data:
-            return json.dumps(result.data, indent=2, default=str)
+            return render(result.data, format, fields)
         else:
             return f"Nessuno storico trovato per {referee_name} con {team1_name} e {team2_name}"
     except Exception as e:
-        return f"Errore: {str(e)}"
+        return error_response(e)
 
 
 @mcp.tool()
-def get_head_to_head_cards(player_name: str, team1_name: str, team2_name: str) -> str:
+@reconnecting
+def get_head_to_head_cards(player_name: str, team1_name: str, team2_name: str, format: str = DEFAULT_FORMAT, fields: str = None) -> str:
     """
     Ottiene lo storico cartellini di un giocatore negli scontri diretti tra due squadre.
     Utile per vedere se un giocatore tende a prendere cartellini in partite specifiche.
@@ -228,6 +578,8 @@ def get_head_to_head_cards(player_name: str, team1_name: str, team2_name: str) -
         player_name: Nome del giocatore
         team1_name: Nome della prima squadra
         team2_name: Nome della seconda squadra
+        format: "compact" (JSON minimale, default), "json" (indentato) o "table" (colonne + righe)
+        fields: Campi da restituire separati da virgola, "a.b" per i campi annidati. None = tutti
 
     Returns:
         Storico: partite giocate, gialli totali, rossi, dettaglio per partita
@@ -235,168 +587,282 @@ def get_head_to_head_cards(player_name: str, team1_name: str, team2_name: str) -
     supabase = get_supabase()
 
     try:
+        player_id = resolve_player_id(supabase, player_name)
+        if not player_id:
+            return f"Nessun giocatore trovato per '{player_name}'"
+        team1_id = resolve_team_id(supabase, team1_name)
+        team2_id = resolve_team_id(supabase, team2_name)
+        if not (team1_id and team2_id):
+            return f"Squadra non trovata: {team1_name if not team1_id else team2_name}"
+
         result = supabase.rpc(
-            "get_head_to_head_cards",
+            "get_head_to_head_cards_by_id",
             {
-                "p_player_name": player_name,
-                "p_team1_name": team1_name,
-                "p_team2_name": team2_name
+                "p_player_id": player_id,
+                "p_team1_id": team1_id,
+                "p_team2_id": team2_id
             }
         ).execute()
 
         if result.data:
-            return json.dumps(result.data, indent=2, default=str)
+            return render(result.data, format, fields)
         else:
             return f"Nessuno storico trovato per {player_name} in {team1_name} vs {team2_name}"
     except Exception as e:
-        return f"Errore: {str(e)}"
+        return error_response(e)
 
 
 @mcp.tool()
-def get_teams() -> str:
+@reconnecting
+def search_names(query: str, kind: str = "all", limit: int = 5, format: str = DEFAULT_FORMAT, fields: str = None) -> str:
     """
-    Ottiene la lista delle squadre nel database.
+    Cerca squadre, giocatori e arbitri per nome, ignorando accenti e maiuscole.
+    Accetta nomi parziali, iniziali di parola, abbreviazioni (TLA, short_name, alias come "Juve")
+    e piccoli errori di battitura. Utile quando un nome è ambiguo (es. "Inter" / "Internacional").
+
+    Args:
+        query: Nome o parte del nome (es: "modric", "inter", "Barela")
+        kind: "team", "player", "referee" o "all" (default: tutti)
+        limit: Candidati per tipo (default: 5)
+        format: "compact" (JSON minimale, default), "json" (indentato) o "table" (colonne + righe)
+        fields: Campi da restituire separati da virgola, "a.b" per i campi annidati. None = tutti
 
     Returns:
-        Lista squadre con nome e abbreviazione
+        Per tipo (teams, players, referees), candidati con id, nome e punteggio (0-1), dal più simile
     """
+    kinds = NAME_KINDS if kind == "all" else (kind,)
+    if kind != "all" and kind not in NAME_KINDS:
+        return f"Tipo '{kind}' non valido. Usa: all, {', '.join(NAME_KINDS)}"
+
     supabase = get_supabase()
 
     try:
-        result = supabase.table("teams").select("name, short_name, tla").order("name").execute()
-        return json.dumps(result.data, indent=2)
+        return render({f"{k}s": name_index(supabase, k).search(query, limit) for k in kinds}, format, fields)
     except Exception as e:
-        return f"Errore: {str(e)}"
+        return error_response(e)
 
 
 @mcp.tool()
-def get_referees() -> str:
+@reconnecting
+def get_teams(cursor: str = None, page_size: int = DEFAULT_PAGE_SIZE, format: str = DEFAULT_FORMAT, fields: str = None) -> str:
     """
-    Ottiene la lista degli arbitri nel database con le loro statistiche.
+    Ottiene la lista delle squadre nel database, in ordine alfabetico e a pagine.
+
+    Args:
+        cursor: next_cursor della pagina precedente (None = prima pagina)
+        page_size: Righe per pagina (default: 100, max 999)
+        format: "compact" (JSON minimale, default), "json" (indentato) o "table" (colonne + righe)
+        fields: Campi da restituire separati da virgola, "a.b" per i campi annidati. None = tutti
+
+    Returns:
+        {"items": squadre con nome e abbreviazione, "next_cursor": cursore della pagina successiva o null}
+    """
+    supabase = get_supabase()
+    keys = [("name", False), ("id", False)]
+
+    try:
+        query = supabase.table("teams").select(select_columns(fields, "id, name, short_name, tla", ["name", "id"]))
+        rows, next_cursor = keyset_page(query, keys, cursor, page_size)
+        return render({"items": rows, "next_cursor": next_cursor}, format, fields, items_key="items")
+    except Exception as e:
+        return error_response(e)
+
+
+@mcp.tool()
+@reconnecting
+def get_referees(cursor: str = None, page_size: int = DEFAULT_PAGE_SIZE, format: str = DEFAULT_FORMAT, fields: str = None) -> str:
+    """
+    Ottiene la lista degli arbitri nel database con le loro statistiche,
+    dal più severo (media gialli per partita) e a pagine.
+
+    Args:
+        cursor: next_cursor della pagina precedente (None = prima pagina)
+        page_size: Righe per pagina (default: 100, max 999)
+        format: "compact" (JSON minimale, default), "json" (indentato) o "table" (colonne + righe)
+        fields: Campi da restituire separati da virgola, "a.b" per i campi annidati. None = tutti
 
     Returns:
-        Lista arbitri con: partite totali, gialli totali, media gialli per partita
+        {"items": arbitri con partite totali, gialli totali, media gialli per partita, "next_cursor": ...}
     """
     supabase = get_supabase()
+    keys = [("avg_yellows_per_match", True), ("id", False)]
 
     try:
-        result = supabase.table("referees").select(
-            "name, nationality, total_matches, total_yellows, total_reds, avg_yellows_per_match"
-        ).gt("total_matches", 0).order("avg_yellows_per_match", desc=True).execute()
-        return json.dumps(result.data, indent=2)
+        query = supabase.table("referees").select(select_columns(
+            fields,
+            "id, name, nationality, total_matches, total_yellows, total_reds, avg_yellows_per_match",
+            ["avg_yellows_per_match", "id"]
+        )).gt("total_matches", 0)
+        rows, next_cursor = keyset_page(query, keys, cursor, page_size)
+        return render({"items": rows, "next_cursor": next_cursor}, format, fields, items_key="items")
     except Exception as e:
-        return f"Errore: {str(e)}"
+        return error_response(e)
 
 
 @mcp.tool()
-def get_team_players(team_name: str, season: str = "2025-2026") -> str:
+@reconnecting
+def get_team_players(team_name: str, season: str = CURRENT_SEASON, cursor: str = None, page_size: int = DEFAULT_PAGE_SIZE, format: str = DEFAULT_FORMAT, fields: str = None) -> str:
     """
-    Ottiene i giocatori di una squadra con le loro statistiche cartellini nella stagione.
+    Ottiene i giocatori di una squadra con le loro statistiche cartellini nella stagione,
+    dal più ammonito e a pagine.
 
     Args:
         team_name: Nome della squadra
         season: Stagione (default: 2025-2026)
+        cursor: next_cursor della pagina precedente (None = prima pagina)
+        page_size: Righe per pagina (default: 100, max 999)
+        format: "compact" (JSON minimale, default), "json" (indentato) o "table" (colonne + righe)
+        fields: Campi da restituire separati da virgola, "a.b" per i campi annidati. None = tutti
 
     Returns:
-        Lista giocatori con statistiche cartellini
+        {"items": giocatori con statistiche cartellini, "next_cursor": cursore della pagina successiva o null}
     """
     supabase = get_supabase()
+    keys = [("yellow_cards", True), ("player_id", False)]
 
     try:
-        result = supabase.table("player_season_cards").select("*").eq(
-            "team_name", team_name
-        ).eq("season", season).order("yellow_cards", desc=True).execute()
+        team_id = resolve_team_id(supabase, team_name)
+        if not team_id:
+            return f"Squadra non trovata: {team_name}"
 
-        if result.data:
-            return json.dumps(result.data, indent=2, default=str)
+        query = supabase.table("player_risk_features").select(
+            select_columns(fields, TEAM_PLAYER_COLUMNS, ["yellow_cards", "player_id"])
+        ).eq("team_id", team_id).eq("season", season)
+        rows, next_cursor = keyset_page(query, keys, cursor, page_size)
+
+        if rows or cursor:
+            return render({"items": rows, "next_cursor": next_cursor}, format, fields, items_key="items")
         else:
             return f"Nessun dato trovato per {team_name} nella stagione {season}"
     except Exception as e:
-        return f"Errore: {str(e)}"
+        return error_response(e)
 
 
 @mcp.tool()
-def get_match_statistics(team_name: str = None, season: str = "2025-2026", limit: int = 10) -> str:
+@reconnecting
+def get_match_statistics(team_name: str = None, season: str = CURRENT_SEASON, cursor: str = None, page_size: int = 10, format: str = DEFAULT_FORMAT, fields: str = None) -> str:
     """
     Ottiene le statistiche delle partite (falli, possesso, tiri) per una squadra.
-    Dati dal Statistics Add-On di football-data.org.
+    Dati dal Statistics Add-On di football-data.org, dalla partita più recente e a pagine.
 
     Args:
         team_name: Nome della squadra (opzionale, se None mostra tutte)
         season: Stagione (default: 2025-2026)
-        limit: Numero massimo di partite da restituire (default: 10)
+        cursor: next_cursor della pagina precedente (None = prima pagina)
+        page_size: Partite per pagina (default: 10, max 999)
+        format: "compact" (JSON minimale, default), "json" (indentato) o "table" (colonne + righe)
+        fields: Campi da restituire separati da virgola, "a.b" per i campi annidati. None = tutti
 
     Returns:
-        Statistiche partita: falli, possesso palla, tiri, corner, etc.
+        Statistiche partita: falli, possesso palla, tiri, corner, etc. + next_cursor
+        (con team_name anche le medie della pagina)
     """
     supabase = get_supabase()
 
     try:
-        query = supabase.table("match_statistics").select(
-            "*, matches!inner(match_date, season, home_team_id, away_team_id, "
-            "home_team:teams!matches_home_team_id_fkey(name), "
-            "away_team:teams!matches_away_team_id_fkey(name))"
-        ).eq("matches.season", season).order("matches(match_date)", desc=True).limit(limit)
-
-        # Se specificata una squadra, filtra
+        team_id = None
         if team_name:
-            # Dobbiamo fare due query separate per home e away
-            home_result = supabase.table("match_statistics").select(
-                "team_id, ball_possession, fouls_committed, fouls_suffered, "
-                "total_shots, shots_on_goal, shots_off_goal, corner_kicks, "
-                "yellow_cards, red_cards, saves, offsides, "
-                "matches!inner(match_date, season, "
-                "home_team:teams!matches_home_team_id_fkey(name), "
-                "away_team:teams!matches_away_team_id_fkey(name))"
-            ).eq("matches.season", season).ilike(
-                "matches.home_team.name", f"%{team_name}%"
-            ).order("matches(match_date)", desc=True).limit(limit).execute()
-
-            away_result = supabase.table("match_statistics").select(
-                "team_id, ball_possession, fouls_committed, fouls_suffered, "
-                "total_shots, shots_on_goal, shots_off_goal, corner_kicks, "
-                "yellow_cards, red_cards, saves, offsides, "
-                "matches!inner(match_date, season, "
-                "home_team:teams!matches_home_team_id_fkey(name), "
-                "away_team:teams!matches_away_team_id_fkey(name))"
-            ).eq("matches.season", season).ilike(
-                "matches.away_team.name", f"%{team_name}%"
-            ).order("matches(match_date)", desc=True).limit(limit).execute()
-
-            # Combina risultati
-            all_data = (home_result.data or []) + (away_result.data or [])
-
-            if all_data:
-                # Calcola medie
-                total_matches = len(all_data)
-                avg_fouls = sum(d.get("fouls_committed", 0) or 0 for d in all_data) / total_matches if total_matches > 0 else 0
-                avg_yellows = sum(d.get("yellow_cards", 0) or 0 for d in all_data) / total_matches if total_matches > 0 else 0
-
-                return json.dumps({
-                    "team": team_name,
-                    "season": season,
-                    "matches_analyzed": total_matches,
-                    "averages": {
-                        "fouls_per_match": round(avg_fouls, 1),
-                        "yellows_per_match": round(avg_yellows, 1)
-                    },
-                    "recent_matches": all_data[:limit]
-                }, indent=2, default=str)
-            else:
+            team_id = resolve_team_id(supabase, team_name)
+            if not team_id:
+                return f"Squadra non trovata: {team_name}"
+
+        # Cursore su (data partita, id riga): la pagina è calcolata da get_match_statistics_page (migration 013)
+        before_date, before_id = decode_cursor(cursor, 2) if cursor else (None, None)
+        page_size = max(1, min(page_size, DB_PAGE_SIZE - 1))
+        rows = supabase.rpc(
+            "get_match_statistics_page",
+            {
+                "p_season": season,
+                "p_team_id": team_id,
+                "p_before_date": before_date,
+                "p_before_id": before_id,
+                "p_limit": page_size + 1
+            }
+        ).execute().data or []
+
+        next_cursor = None
+        if len(rows) > page_size:
+            rows = rows[:page_size]
+            next_cursor = encode_cursor([rows[-1]["match_date"], rows[-1]["id"]])
+
+        if not rows and not cursor:
+            if team_name:
                 return f"Nessuna statistica trovata per {team_name} nella stagione {season}"
-        else:
-            result = query.execute()
-            if result.data:
-                return json.dumps(result.data, indent=2, default=str)
-            else:
-                return f"Nessuna statistica trovata per la stagione {season}"
+            return f"Nessuna statistica trovata per la stagione {season}"
+
+        if not team_name:
+            return render({"items": rows, "next_cursor": next_cursor}, format, fields, items_key="items")
+
+        # Medie della squadra sulle partite della pagina
+        total_matches = len(rows)
+        avg_fouls = sum(d.get("fouls_committed", 0) or 0 for d in rows) / total_matches if total_matches > 0 else 0
+        avg_yellows = sum(d.get("yellow_cards", 0) or 0 for d in rows) / total_matches if total_matches > 0 else 0
+
+        return render({
+            "team": team_name,
+            "season": season,
+            "matches_analyzed": total_matches,
+            "averages": {
+                "fouls_per_match": round(avg_fouls, 1),
+                "yellows_per_match": round(avg_yellows, 1)
+            },
+            "items": rows,
+            "next_cursor": next_cursor
+        }, format, fields, items_key="items")
 
     except Exception as e:
-        return f"Errore: {str(e)}"
+        return error_response(e)
+
+
+def missing_season_message(season: str) -> str:
+    """Messaggio per una stagione senza snapshot player_risk_features (nessuna rosa da analizzare)."""
+    return (f"Nessun dato stagionale per {season}: la stagione non è sincronizzata "
+            f"(snapshot player_risk_features vuoto per queste squadre)")
+
+
+def analyze_match_risk_rpc(supabase: Client, home_team: str, away_team: str, referee: str = None, season: str = CURRENT_SEASON):
+    """
+    Analisi calcolata interamente nel DB da analyze_match_risk_v2 (migrazione 009).
+    Restituisce None se squadre o arbitro non si risolvono: in quel caso si usa il calcolo Python.
+    """
+    home_team_id = resolve_team_id(supabase, home_team)
+    away_team_id = resolve_team_id(supabase, away_team)
+    if not (home_team_id and away_team_id):
+        return None
+
+    referee_id = None
+    if referee:
+        referee_id = resolve_referee_id(supabase, referee)
+        if not referee_id:
+            return None
+
+    analysis = supabase.rpc(
+        "analyze_match_risk_v2",
+        {
+            "p_home_team_id": home_team_id,
+            "p_away_team_id": away_team_id,
+            "p_referee_id": referee_id,
+            "p_season": season
+        }
+    ).execute().data
+    if not analysis:
+        return None
+
+    # Stesse intestazioni del calcolo Python (nomi come richiesti dall'utente)
+    analysis["match"] = f"{home_team} vs {away_team}"
+    analysis["referee"] = referee or "Non designato"
+    team_stats = analysis.get("team_stats") or {}
+    analysis["team_stats"] = {
+        team.lower(): team_stats[key]
+        for team, key in [(home_team, "home"), (away_team, "away")]
+        if key in team_stats
+    }
+    return analysis
 
 
 @mcp.tool()
-def analyze_match_risk(home_team: str, away_team: str, referee: str = None) -> str:
+@reconnecting
+def analyze_match_risk(home_team: str, away_team: str, referee: str = None, season: str = CURRENT_SEASON, use_rpc: bool = False, format: str = DEFAULT_FORMAT, fields: str = None) -> str:
     """
     Analizza il rischio cartellino per una partita specifica.
     Combina 4 fattori con pesi: stagionale (35%), arbitro (30%), H2H (15%), falli (20%).
@@ -413,12 +879,37 @@ def analyze_match_risk(home_team: str, away_team: str, referee: str = None) -> s
         home_team: Squadra di casa
         away_team: Squadra in trasferta
         referee: Nome arbitro (opzionale)
+        season: Stagione di rose, falli, possesso e profilo arbitro (default: 2025-2026)
+        use_rpc: Se True calcola tutto nel DB con una sola chiamata (analyze_match_risk_v2)
+        format: "compact" (JSON minimale, default), "json" (indentato) o "table" (colonne + righe)
+        fields: Campi da restituire separati da virgola, "a.b" per i campi annidati. None = tutti
+            (es. "overall_top5.name,overall_top5.combined_score,multipliers")
 
     Returns:
         Analisi completa con top 5 giocatori a rischio per squadra e breakdown score
     """
     supabase = get_supabase()
 
+    if use_rpc:
+        try:
+            analysis = analyze_match_risk_rpc(supabase, home_team, away_team, referee, season)
+            if analysis and not (analysis.get("home_team_top5") or analysis.get("away_team_top5")):
+                return missing_season_message(season)
+            if analysis:
+                return render(analysis, format, fields)
+        except Exception as e:
+            return error_response(e, "Errore nell'analisi")
+
+    # Nomi -> ID una volta sola (indice in memoria): tutte le query seguenti sono per ID
+    try:
+        home_team_id = resolve_team_id(supabase, home_team)
+        away_team_id = resolve_team_id(supabase, away_team)
+        referee_id = resolve_referee_id(supabase, referee) if referee else None
+    except Exception as e:
+        return error_response(e, "Errore nell'analisi")
+    if not (home_team_id and away_team_id):
+        return f"Squadra non trovata: {home_team if not home_team_id else away_team}"
+
     analysis = {
         "match": f"{home_team} vs {away_team}",
         "referee": referee or "Non designato",
@@ -440,340 +931,561 @@ def analyze_match_risk(home_team: str, away_team: str, referee: str = None) -> s
         "overall_top5": []
     }
 
-    # Pesi per il calcolo dello score (con arbitro)
-    WEIGHT_SEASONAL = 0.35
-    WEIGHT_REFEREE = 0.30
-    WEIGHT_H2H = 0.15
-    WEIGHT_FOULS = 0.20
-    # Pesi senza arbitro
-    WEIGHT_SEASONAL_NO_REF = 0.45
-    WEIGHT_H2H_NO_REF = 0.25
-    WEIGHT_FOULS_NO_REF = 0.30
-
-    DEFAULT_REFEREE_SCORE = 25
-    H2H_THRESHOLD = 25
-
-    # Moltiplicatori home/away (studio CIES)
-    HOME_MULTIPLIER = 0.94
-    AWAY_MULTIPLIER = 1.06
+    # === QUERY INDIPENDENTI IN PARALLELO ===
+    # Ogni fattore è una query separata: girano insieme nel pool e ognuno ha un timeout.
+    # Se un fattore fallisce o scade si prosegue senza (come se la query non avesse dati).
+    # I dati di riferimento (tutto tranne rose, storico arbitro e H2H) passano da REFERENCE_CACHE.
+
+    def cached(key: tuple, loader):
+        return REFERENCE_CACHE.get(supabase, key, loader)
+
+    def fetch_derby():
+        derby_data = cached(("derby", home_team_id, away_team_id), lambda: supabase.rpc(
+            "is_derby_match",
+            {"p_home_team_id": home_team_id, "p_away_team_id": away_team_id}
+        ).execute().data)
+        return derby_data[0] if derby_data else None
+
+    def fetch_possession():
+        # Stesse chiavi di cache di analyze_matchday (una riga per squadra)
+        return REFERENCE_CACHE.get_many(supabase, f"possession:{season}", [home_team_id, away_team_id], lambda ids: {
+            r["team_id"]: r for r in supabase.table("team_possession_stats").select(
+                "team_id, avg_possession, play_style"
+            ).in_("team_id", ids).eq("season", season).execute().data or []
+        })
+
+    def fetch_referee_profile():
+        # Stesse chiavi di cache di analyze_matchday (profilo nella lega con più partite)
+        return REFERENCE_CACHE.get_many(
+            supabase, f"referee_profile:{season}", [referee_id], lambda ids: load_referee_profiles(supabase, ids, season)
+        )[referee_id]
+
+    def load_league_baseline():
+        # Competizione con più partite della squadra di casa nella stagione (come analyze_match_risk_v2)
+        team_matches = fetch_all_rows(lambda: supabase.table("matches").select("competitions(code)").or_(
+            f"home_team_id.eq.{home_team_id},away_team_id.eq.{home_team_id}"
+        ).eq("season", season).order("id"))
+        counts = Counter((m.get("competitions") or {}).get("code") for m in team_matches)
+        counts.pop(None, None)
+        if not counts:
+            return None
+        comp_code = counts.most_common(1)[0][0]
+        baseline = supabase.table("league_card_baselines").select(
+            "normalization_factor"
+        ).eq("competition_code", comp_code).limit(1).execute()
+        if not baseline.data:
+            return None
+        return comp_code, float(baseline.data[0].get("normalization_factor") or 1.0)
+
+    def fetch_league_baseline():
+        return cached(("league", home_team_id, season), load_league_baseline)
+
+    def fetch_squad(team_id: str):
+        # Rosa intera dallo snapshot player_risk_features (lettura per chiave team_id/season)
+        return fetch_all_rows(lambda: supabase.table("player_risk_features").select("*").eq(
+            "team_id", team_id
+        ).eq("season", season).order("yellow_cards", desc=True).order("player_id"))
+
+    def fetch_team_fouls(team_id: str):
+        return cached(("team_fouls", team_id, season), lambda: supabase.table("team_fouls_stats").select(
+            "avg_fouls_per_match, avg_yellows_per_match, foul_to_card_pct"
+        ).eq("team_id", team_id).eq("season", season).limit(1).execute().data)
+
+    def fetch_referee_stats():
+        return cached(("referee_stats", referee_id), lambda: supabase.table("referees").select(
+            "name, total_matches, total_yellows, avg_yellows_per_match"
+        ).eq("id", referee_id).limit(1).execute().data)
+
+    def fetch_referee_cards():
+        return supabase.rpc(
+            "get_referee_player_cards_by_id",
+            {
+                "p_referee_id": referee_id,
+                "p_team1_id": home_team_id,
+                "p_team2_id": away_team_id
+            }
+        ).execute().data
+
+    tasks = {
+        "derby": fetch_derby,
+        "possession": fetch_possession,
+        "league": fetch_league_baseline,
+        "home_squad": lambda: fetch_squad(home_team_id),
+        "away_squad": lambda: fetch_squad(away_team_id),
+        "home_fouls": lambda: fetch_team_fouls(home_team_id),
+        "away_fouls": lambda: fetch_team_fouls(away_team_id),
+    }
+    if referee_id:
+        tasks.update({
+            "referee_profile": fetch_referee_profile,
+            "referee_stats": fetch_referee_stats,
+            "referee_cards": fetch_referee_cards,
+        })
+
+    futures = {name: ANALYSIS_EXECUTOR.submit(task) for name, task in tasks.items()}
+    deadline = time.monotonic() + FACTOR_TIMEOUT
+
+    def factor(name: str, default=None):
+        """Risultato di un fattore opzionale; default se fallito, scaduto o non richiesto."""
+        if name not in futures:
+            return default
+        try:
+            return futures[name].result(timeout=max(0, deadline - time.monotonic()))
+        except Exception:
+            return default
 
     try:
         # === NUOVI FATTORI: DERBY DETECTION ===
         derby_multiplier = 1.0
-        try:
-            # Trova team IDs
-            home_team_data = supabase.table("teams").select("id").ilike("name", f"%{home_team}%").limit(1).execute()
-            away_team_data = supabase.table("teams").select("id").ilike("name", f"%{away_team}%").limit(1).execute()
-
-            if home_team_data.data and away_team_data.data:
-                home_team_id = home_team_data.data[0]["id"]
-                away_team_id = away_team_data.data[0]["id"]
-
-                derby_result = supabase.rpc(
-                    "is_derby_match",
-                    {"p_home_team_id": home_team_id, "p_away_team_id": away_team_id}
-                ).execute()
-
-                if derby_result.data and len(derby_result.data) > 0:
-                    derby_info = derby_result.data[0]
-                    if derby_info.get("is_derby"):
-                        intensity = derby_info.get("intensity", 1)
-                        # Intensità 1=+10%, 2=+18%, 3=+26%
-                        derby_multiplier = 1.0 + (0.08 * intensity + 0.02)
-                        analysis["derby"] = {
-                            "is_derby": True,
-                            "name": derby_info.get("rivalry_name"),
-                            "type": derby_info.get("rivalry_type"),
-                            "intensity": intensity
-                        }
-                        analysis["multipliers"]["derby"] = round(derby_multiplier, 2)
-        except Exception:
-            pass  # Derby detection failed, continue without
+        derby_info = factor("derby")
+        if derby_info and derby_info.get("is_derby"):
+            intensity = derby_info.get("intensity", 1)
+            # Intensità 1=+10%, 2=+18%, 3=+26%
+            derby_multiplier = 1.0 + (0.08 * intensity + 0.02)
+            analysis["derby"] = {
+                "is_derby": True,
+                "name": derby_info.get("rivalry_name"),
+                "type": derby_info.get("rivalry_type"),
+                "intensity": intensity
+            }
+            analysis["multipliers"]["derby"] = round(derby_multiplier, 2)
 
         # === NUOVI FATTORI: POSSESSION ===
         home_possession_factor = 1.0
         away_possession_factor = 1.0
-        try:
-            poss_result = supabase.rpc(
-                "get_possession_factor",
-                {"p_home_team_name": home_team, "p_away_team_name": away_team, "p_season": "2025-2026"}
-            ).execute()
-
-            if poss_result.data and len(poss_result.data) > 0:
-                poss = poss_result.data[0]
-                home_possession_factor = float(poss.get("home_possession_factor") or 1.0)
-                away_possession_factor = float(poss.get("away_possession_factor") or 1.0)
-                analysis["possession"] = {
-                    "home_avg": poss.get("home_avg_possession"),
-                    "home_style": poss.get("home_play_style"),
-                    "home_factor": home_possession_factor,
-                    "away_avg": poss.get("away_avg_possession"),
-                    "away_style": poss.get("away_play_style"),
-                    "away_factor": away_possession_factor,
-                    "diff": poss.get("expected_possession_diff")
-                }
-                analysis["multipliers"]["possession"] = {
-                    "home": home_possession_factor,
-                    "away": away_possession_factor
-                }
-        except Exception:
-            pass  # Possession query failed, continue without
+        poss_data = factor("possession")
+        if poss_data is not None:
+            # Squadra senza statistiche: 50% e BALANCED (come get_possession_factor)
+            home_poss = poss_data.get(home_team_id) or {}
+            away_poss = poss_data.get(away_team_id) or {}
+            home_avg = float(home_poss.get("avg_possession") or 50)
+            away_avg = float(away_poss.get("avg_possession") or 50)
+            home_possession_factor = possession_factor(home_avg)
+            away_possession_factor = possession_factor(away_avg)
+            analysis["possession"] = {
+                "home_avg": home_avg,
+                "home_style": home_poss.get("play_style") or "BALANCED",
+                "home_factor": home_possession_factor,
+                "away_avg": away_avg,
+                "away_style": away_poss.get("play_style") or "BALANCED",
+                "away_factor": away_possession_factor,
+                "diff": round(home_avg - away_avg, 1)
+            }
+            analysis["multipliers"]["possession"] = {
+                "home": home_possession_factor,
+                "away": away_possession_factor
+            }
 
         # === NUOVI FATTORI: REFEREE PROFILE/OUTLIER ===
         referee_adjustment = 1.0
-        if referee:
-            try:
-                ref_profile = supabase.rpc(
-                    "get_referee_profile",
-                    {"p_referee_name": referee}
-                ).execute()
-
-                if ref_profile.data and len(ref_profile.data) > 0:
-                    profile = ref_profile.data[0]
-                    delta = float(profile.get("ref_league_delta") or 0)
-                    # Ogni +0.5 gialli sopra media = +5% rischio, max ±15%
-                    referee_adjustment = max(0.85, min(1.15, 1.0 + (delta * 0.10)))
-                    analysis["referee_profile"] = {
-                        "classification": profile.get("referee_profile"),
-                        "delta": delta,
-                        "ref_avg": float(profile.get("ref_avg_yellows") or 0),
-                        "league_avg": float(profile.get("league_avg_yellows") or 0)
-                    }
-                    analysis["multipliers"]["referee_adjustment"] = round(referee_adjustment, 2)
-            except Exception:
-                pass  # Referee profile query failed, continue without
+        profile = factor("referee_profile")
+        if profile:
+            delta = float(profile.get("ref_league_delta") or 0)
+            # Ogni +0.5 gialli sopra media = +5% rischio, max ±15%
+            referee_adjustment = max(0.85, min(1.15, 1.0 + (delta * 0.10)))
+            analysis["referee_profile"] = {
+                "classification": profile.get("referee_profile"),
+                "delta": delta,
+                "ref_avg": float(profile.get("ref_avg_yellows") or 0),
+                "league_avg": float(profile.get("league_avg_yellows") or 0)
+            }
+            analysis["multipliers"]["referee_adjustment"] = round(referee_adjustment, 2)
 
         # === NUOVI FATTORI: LEAGUE BASELINE ===
-        league_multiplier = 1.0
-        try:
-            # Determina la competizione dalla squadra
-            team_comp = supabase.table("teams").select(
-                "competitions:teams_competitions(competition_id, competitions(code))"
-            ).ilike("name", f"%{home_team}%").limit(1).execute()
-
-            if team_comp.data and team_comp.data[0].get("competitions"):
-                # Prendi la prima competizione associata
-                comps = team_comp.data[0]["competitions"]
-                if comps and len(comps) > 0:
-                    comp_code = comps[0].get("competitions", {}).get("code")
-                    if comp_code:
-                        baseline = supabase.table("league_card_baselines").select(
-                            "normalization_factor"
-                        ).eq("competition_code", comp_code).limit(1).execute()
-
-                        if baseline.data and len(baseline.data) > 0:
-                            league_multiplier = float(baseline.data[0].get("normalization_factor") or 1.0)
-                            analysis["multipliers"]["league"] = league_multiplier
-                            analysis["competition"] = comp_code
-        except Exception:
-            pass  # League baseline query failed, continue without
-
-        # --- DATI STAGIONALI GIOCATORI ---
-        home_result = supabase.table("player_season_cards").select("*").ilike(
-            "team_name", f"%{home_team}%"
-        ).eq("season", "2025-2026").order("yellow_cards", desc=True).limit(15).execute()
-
-        away_result = supabase.table("player_season_cards").select("*").ilike(
-            "team_name", f"%{away_team}%"
-        ).eq("season", "2025-2026").order("yellow_cards", desc=True).limit(15).execute()
+        league = factor("league")
+        if league:
+            comp_code, league_multiplier = league
+            analysis["multipliers"]["league"] = league_multiplier
+            analysis["competition"] = comp_code
+
+        # --- DATI STAGIONALI GIOCATORI (indispensabili: un errore interrompe l'analisi) ---
+        home_squad = futures["home_squad"].result(timeout=SQUAD_QUERY_TIMEOUT)
+        away_squad = futures["away_squad"].result(timeout=SQUAD_QUERY_TIMEOUT)
+        if not (home_squad or away_squad):
+            return missing_season_message(season)
 
         # --- STATISTICHE FALLI SQUADRA ---
         team_fouls = {}
-        for team in [home_team, away_team]:
-            try:
-                fouls_result = supabase.rpc(
-                    "get_team_fouls_stats",
-                    {"p_team_name": team, "p_season": "2025-2026"}
-                ).execute()
-                if fouls_result.data and len(fouls_result.data) > 0:
-                    tf = fouls_result.data[0]
-                    team_fouls[team.lower()] = {
-                        "avg_fouls_per_match": float(tf.get("avg_fouls_per_match") or 0),
-                        "avg_yellows_per_match": float(tf.get("avg_yellows_per_match") or 0),
-                        "foul_to_card_pct": float(tf.get("foul_to_card_pct") or 0)
-                    }
-            except Exception:
-                pass
+        for team, key in [(home_team, "home_fouls"), (away_team, "away_fouls")]:
+            fouls_data = factor(key)
+            if fouls_data:
+                tf = fouls_data[0]
+                team_fouls[team.lower()] = {
+                    "avg_fouls_per_match": float(tf.get("avg_fouls_per_match") or 0),
+                    "avg_yellows_per_match": float(tf.get("avg_yellows_per_match") or 0),
+                    "foul_to_card_pct": float(tf.get("foul_to_card_pct") or 0)
+                }
 
         analysis["team_stats"] = team_fouls
 
         # --- DATI ARBITRO (se disponibile) ---
         referee_data = {}
         if referee:
-            ref_stats = supabase.table("referees").select(
-                "name, total_matches, total_yellows, avg_yellows_per_match"
-            ).ilike("name", f"%{referee}%").limit(1).execute()
-
-            if ref_stats.data and len(ref_stats.data) > 0:
-                analysis["referee_stats"] = ref_stats.data[0]
-
-            ref_result = supabase.rpc(
-                "get_referee_player_cards",
-                {
-                    "p_referee_name": referee,
-                    "p_team1_name": home_team,
-                    "p_team2_name": away_team
+            ref_stats = factor("referee_stats")
+            if ref_stats:
+                analysis["referee_stats"] = ref_stats[0]
+
+            for r in factor("referee_cards") or []:
+                referee_data[r["player_id"]] = {
+                    "times_booked": r.get("times_booked", 0),
+                    "matches_with_referee": r.get("matches_with_referee", 0),
+                    "booking_percentage": float(r.get("booking_percentage", 0))
                 }
-            ).execute()
-
-            if ref_result.data:
-                for r in ref_result.data:
-                    player_name = r.get("player_name", "").lower()
-                    referee_data[player_name] = {
-                        "times_booked": r.get("times_booked", 0),
-                        "matches_with_referee": r.get("matches_with_referee", 0),
-                        "booking_percentage": float(r.get("booking_percentage", 0))
-                    }
 
-        # --- CALCOLO SCORE PER OGNI GIOCATORE ---
-        all_players = []
-
-        for team_data, team_name, is_home in [
-            (home_result.data or [], home_team, True),
-            (away_result.data or [], away_team, False)
-        ]:
-            team_fouls_data = team_fouls.get(team_name.lower(), {})
-            team_foul_to_card = team_fouls_data.get("foul_to_card_pct", 0)
-
-            # Moltiplicatori per questa squadra
-            home_away_mult = HOME_MULTIPLIER if is_home else AWAY_MULTIPLIER
-            possession_mult = home_possession_factor if is_home else away_possession_factor
-
-            for p in team_data:
-                player_name = p.get("player_name", "")
-                player_name_lower = player_name.lower()
-
-                # 1. SEASONAL SCORE (35%)
-                yellows_per_90 = float(p.get("yellows_per_90") or 0)
-                seasonal_score = min(yellows_per_90 * 100, 100)
-
-                # 2. REFEREE SCORE (30%)
-                referee_score = 0
-                referee_info = None
-                if referee and player_name_lower in referee_data:
-                    ref_info = referee_data[player_name_lower]
-                    referee_score = ref_info["booking_percentage"]
-                    referee_info = f"{ref_info['times_booked']} in {ref_info['matches_with_referee']} partite"
-                elif referee:
-                    referee_score = DEFAULT_REFEREE_SCORE
-
-                # 3. H2H SCORE (15%)
-                h2h_score = 0
-                h2h_info = None
-                if seasonal_score > H2H_THRESHOLD:
-                    try:
-                        h2h_result = supabase.rpc(
-                            "get_head_to_head_cards",
-                            {
-                                "p_player_name": player_name,
-                                "p_team1_name": home_team,
-                                "p_team2_name": away_team
-                            }
-                        ).execute()
-
-                        if h2h_result.data and len(h2h_result.data) > 0:
-                            h2h = h2h_result.data[0]
-                            h2h_matches = h2h.get("total_h2h_matches", 0)
-                            h2h_yellows = h2h.get("total_yellows", 0)
-                            if h2h_matches > 0:
-                                h2h_score = (h2h_yellows / h2h_matches) * 100
-                                h2h_info = f"{h2h_yellows} in {h2h_matches} H2H"
-                    except Exception:
-                        pass
-
-                # 4. FOULS SCORE (20%)
-                position = p.get("position", "")
-                position_multiplier = 1.0
-                if position in ["Midfield", "Defence"]:
-                    position_multiplier = 1.2
-
-                fouls_score = (
-                    (team_foul_to_card * 0.5) +
-                    (min(yellows_per_90 * 50, 50))
-                ) * position_multiplier
-                fouls_score = min(fouls_score, 100)
-
-                # SCORE BASE COMBINATO
-                if referee:
-                    base_score = (
-                        seasonal_score * WEIGHT_SEASONAL +
-                        referee_score * WEIGHT_REFEREE +
-                        h2h_score * WEIGHT_H2H +
-                        fouls_score * WEIGHT_FOULS
-                    )
-                else:
-                    base_score = (
-                        seasonal_score * WEIGHT_SEASONAL_NO_REF +
-                        h2h_score * WEIGHT_H2H_NO_REF +
-                        fouls_score * WEIGHT_FOULS_NO_REF
-                    )
-
-                # APPLICA MOLTIPLICATORI CONTESTUALI
-                combined_score = base_score
-                combined_score *= derby_multiplier      # Derby: ×1.10-1.26
-                combined_score *= home_away_mult        # Home/Away: ×0.94/×1.06
-                combined_score *= referee_adjustment    # Referee outlier: ×0.85-1.15
-                combined_score *= possession_mult       # Possession: ×0.85-1.15
-                # League normalization già incorporata nei dati stagionali
-
-                # Cap a 100
-                combined_score = min(combined_score, 100)
-
-                player_data = {
-                    "name": player_name,
-                    "team": p.get("team_name"),
-                    "position": position,
-                    "combined_score": round(combined_score, 1),
-                    "base_score": round(base_score, 1),
-                    "breakdown": {
-                        "seasonal": {
-                            "score": round(seasonal_score, 1),
-                            "yellows": p.get("yellow_cards", 0),
-                            "matches": p.get("matches_played", 0),
-                            "per_90": round(yellows_per_90, 2)
-                        },
-                        "referee": {
-                            "score": round(referee_score, 1),
-                            "detail": referee_info
-                        } if referee else None,
-                        "h2h": {
-                            "score": round(h2h_score, 1),
-                            "detail": h2h_info
-                        },
-                        "fouls": {
-                            "score": round(fouls_score, 1),
-                            "team_foul_to_card_pct": round(team_foul_to_card, 1),
-                            "position_multiplier": position_multiplier
-                        },
-                        "multipliers": {
-                            "derby": derby_multiplier,
-                            "home_away": home_away_mult,
-                            "referee_adj": referee_adjustment,
-                            "possession": possession_mult
-                        }
+        # --- STORICO H2H (una sola chiamata per tutti i giocatori sopra soglia) ---
+        h2h_data = {}
+        squad_rows = (home_squad or []) + (away_squad or [])
+        seasonal = seasonal_scores([float(p.get("yellows_per_90") or 0) for p in squad_rows])
+        h2h_candidates = [
+            p["player_id"] for p, score in zip(squad_rows, seasonal)
+            if p.get("player_id") and score > H2H_THRESHOLD
+        ]
+        if h2h_candidates:
+            try:
+                h2h_result = supabase.rpc(
+                    "get_head_to_head_cards_bulk",
+                    {
+                        "p_player_ids": list(set(h2h_candidates)),
+                        "p_team1_id": home_team_id,
+                        "p_team2_id": away_team_id
                     }
-                }
-                all_players.append(player_data)
-
-        # Ordina per score combinato
-        all_players.sort(key=lambda x: x["combined_score"], reverse=True)
-
-        # Separa per squadra e prendi top 5
-        home_players = [p for p in all_players if home_team.lower() in p["team"].lower()]
-        away_players = [p for p in all_players if away_team.lower() in p["team"].lower()]
-
-        analysis["home_team_top5"] = home_players[:5]
-        analysis["away_team_top5"] = away_players[:5]
-        analysis["overall_top5"] = all_players[:5]
+                ).execute()
+                h2h_data = {h2h["player_id"]: h2h for h2h in h2h_result.data or []}
+            except Exception:
+                pass  # H2H query failed, continue without
+
+        # --- CALCOLO SCORE PER TUTTI I GIOCATORI (vettoriale, vedi scoring.py) ---
+        is_home = np.array([True] * len(home_squad or []) + [False] * len(away_squad or []), dtype=bool)
+        # Falli squadra e possesso già nello snapshot, riga per riga
+        team_foul_to_card = np.array([float(p.get("team_foul_to_card_pct") or 0) for p in squad_rows], dtype=float)
+        possession_mult = np.array([float(p.get("possession_factor") or 1.0) for p in squad_rows], dtype=float)
+        referee_cards = [referee_data.get(p.get("player_id")) for p in squad_rows]
+        h2h_rows = [h2h_data.get(p.get("player_id")) for p in squad_rows]
+
+        scores = score_players(
+            squad_rows,
+            referee_cards,
+            h2h_rows,
+            has_referee=bool(referee),
+            team_foul_to_card=team_foul_to_card,
+            derby_multiplier=derby_multiplier,
+            home_away_mult=np.where(is_home, HOME_MULTIPLIER, AWAY_MULTIPLIER),
+            referee_adjustment=referee_adjustment,
+            possession_mult=possession_mult
+        )
+
+        # Ordina per score combinato e prendi top 5 (breakdown solo per le righe mostrate)
+        order = ranking(scores)
+        home_top = [i for i in order if is_home[i]][:5]
+        away_top = [i for i in order if not is_home[i]][:5]
+        overall_top = list(order[:5])
+
+        players = {
+            i: player_breakdown(squad_rows[i], scores, i, referee_cards[i], h2h_rows[i])
+            for i in set(home_top + away_top + overall_top)
+        }
+        analysis["home_team_top5"] = [players[i] for i in home_top]
+        analysis["away_team_top5"] = [players[i] for i in away_top]
+        analysis["overall_top5"] = [players[i] for i in overall_top]
 
         if not referee:
             analysis["referee_note"] = "Arbitro non designato - analisi basata su dati stagionali, H2H e falli"
 
-        return json.dumps(analysis, indent=2, default=str, ensure_ascii=False)
+        return render(analysis, format, fields)
 
     except Exception as e:
-        return f"Errore nell'analisi: {str(e)}"
+        return error_response(e, "Errore nell'analisi")
+
+
+
+def possession_factor(avg_possession) -> float:
+    """Fattore possesso (stessa formula di get_possession_factor): meno possesso = più falli."""
+    poss = float(avg_possession if avg_possession is not None else 50)
+    return round(max(0.85, min(1.15, 1 + (50 - poss) * 0.01)), 2)
+
+
+def load_referee_profiles(supabase: Client, referee_ids: list, season: str) -> dict:
+    """
+    Profilo per arbitro nella lega con più partite della stagione, da get_referee_league_comparison
+    (medie precalcolate in referee_season_baselines, migration 017). Se la stagione non ha
+    ancora partite concluse la funzione usa le medie della precedente.
+    """
+    rows = supabase.rpc("get_referee_league_comparison", {
+        "p_season": season,
+        "p_referee_ids": referee_ids
+    }).execute().data or []
+    profiles = {}
+    for r in sorted(rows, key=lambda r: r.get("matches_in_league") or 0, reverse=True):
+        profiles.setdefault(r["referee_id"], r)  # Lega con più partite
+    return profiles
+
+
+def load_matchday_reference(supabase: Client, team_ids: list, referee_ids: list, pairs: list, season: str) -> dict:
+    """
+    Dati di riferimento di tutte le partite della giornata, una query per tipo
+    (solo per gli ID non già in REFERENCE_CACHE). Un tipo che fallisce resta vuoto.
+    Falli squadra e possesso per giocatore arrivano già dallo snapshot player_risk_features.
+    """
+    def optional(load):
+        try:
+            return load()
+        except Exception:
+            return {}
+
+    def load_possession(ids):
+        rows = supabase.table("team_possession_stats").select(
+            "team_id, avg_possession, play_style"
+        ).in_("team_id", ids).eq("season", season).execute().data or []
+        return {r["team_id"]: r for r in rows}
+
+    def load_derbies(keys):
+        ids = list({team_id for pair in keys for team_id in pair})
+        rows = supabase.table("rivalries").select(
+            "team1_id, team2_id, rivalry_name, rivalry_type, intensity"
+        ).in_("team1_id", ids).in_("team2_id", ids).execute().data or []
+        return {tuple(sorted((r["team1_id"], r["team2_id"]))): r for r in rows}
+
+    cache = REFERENCE_CACHE
+    return {
+        "possession": optional(lambda: cache.get_many(supabase, f"possession:{season}", team_ids, load_possession)),
+        "profiles": optional(lambda: cache.get_many(
+            supabase, f"referee_profile:{season}", referee_ids, lambda ids: load_referee_profiles(supabase, ids, season)
+        )) if referee_ids else {},
+        "derbies": optional(lambda: cache.get_many(supabase, "derby_pair", pairs, load_derbies)),
+    }
 
 
+@mcp.tool()
+@reconnecting
+def analyze_matchday(competition: str = "SA", date: str = None, days_ahead: int = 0, top_n: int = 3, season: str = CURRENT_SEASON, format: str = DEFAULT_FORMAT, fields: str = None) -> str:
+    """
+    Analizza tutte le partite di una giornata in un colpo solo.
+    Stessi fattori, pesi e moltiplicatori di analyze_match_risk, ma squadre, arbitri,
+    rose, storico arbitro e H2H vengono letti con una query per tipo per tutte le partite.
+
+    Args:
+        competition: Codice competizione (SA, PL, BL1, PD, FL1, CL, EL). Default: SA (Serie A)
+        date: Data in formato "YYYY-MM-DD". Se None, usa oggi + days_ahead
+        days_ahead: Giorni da oggi (usato se date è None). Default: 0 (oggi)
+        top_n: Giocatori a rischio mostrati per partita. Default: 3
+        season: Stagione di rose, possesso e profili arbitro (default: 2025-2026)
+        format: "compact" (JSON minimale, default), "json" (indentato) o "table" (colonne + righe)
+        fields: Campi da restituire separati da virgola, "a.b" per i campi annidati. None = tutti
+
+    Returns:
+        Riepilogo compatto per partita + classifica dei giocatori più a rischio della giornata
+    """
+    try:
+        target_date, fixtures, error = fetch_competition_matches(competition, date, days_ahead)
+        if error:
+            return error
+
+        result = {
+            "competition": COMPETITION_NAMES.get(competition, competition),
+            "date": target_date,
+            "matches": [],
+            "leaderboard": []
+        }
+        if not fixtures:
+            result["message"] = "Nessuna partita in questa data"
+            return render(result, format, fields)
+
+        supabase = get_supabase()
+
+        # --- SQUADRE E ARBITRI (per ID football-data.org, una query ciascuno) ---
+        team_external_ids = [
+            team["id"] for f in fixtures
+            for team in (f.get("homeTeam") or {}, f.get("awayTeam") or {}) if team.get("id")
+        ]
+        teams = REFERENCE_CACHE.get_many(supabase, "team_external_id", team_external_ids, lambda ids: {
+            t["external_id"]: t for t in supabase.table("teams").select(
+                "id, external_id, name"
+            ).in_("external_id", ids).execute().data or []
+        })
+
+        referee_external_ids = [ref["id"] for ref in map(main_referee, fixtures) if ref and ref.get("id")]
+        referees = REFERENCE_CACHE.get_many(supabase, "referee_external_id", referee_external_ids, lambda ids: {
+            r["external_id"]: r for r in supabase.table("referees").select(
+                "id, external_id, name, total_matches, total_yellows, avg_yellows_per_match"
+            ).in_("external_id", ids).execute().data or []
+        }) if referee_external_ids else {}
+
+        games = []
+        for f in fixtures:
+            ref = main_referee(f) or {}
+            utc_date = f.get("utcDate", "")
+            games.append({
+                "home": teams.get((f.get("homeTeam") or {}).get("id")),
+                "away": teams.get((f.get("awayTeam") or {}).get("id")),
+                "home_name": (f.get("homeTeam") or {}).get("name"),
+                "away_name": (f.get("awayTeam") or {}).get("name"),
+                "kickoff": utc_date[11:16] if len(utc_date) > 16 else "TBD",
+                "referee_name": ref.get("name"),
+                "referee": referees.get(ref.get("id")),
+            })
+
+        resolved = [g for g in games if g["home"] and g["away"]]
+        team_ids = list({t["id"] for g in resolved for t in (g["home"], g["away"])})
+        referee_ids = list({g["referee"]["id"] for g in resolved if g["referee"]})
+        pairs = [tuple(sorted((g["home"]["id"], g["away"]["id"]))) for g in resolved]
+
+        # --- DATI PER GIOCATORE (non in cache): rose e storico arbitro in parallelo ---
+        squads_future = ANALYSIS_EXECUTOR.submit(fetch_all_rows, lambda: supabase.table("player_risk_features").select(
+            "*"
+        ).in_("team_id", team_ids).eq("season", season).order("yellow_cards", desc=True).order("player_id"))
+
+        referee_cards_future = None
+        with_referee = [g for g in resolved if g["referee"]]
+        if with_referee:
+            referee_cards_future = ANALYSIS_EXECUTOR.submit(lambda: supabase.rpc(
+                "get_referee_player_cards_bulk",
+                {
+                    "p_referee_ids": [g["referee"]["id"] for g in with_referee],
+                    "p_home_team_ids": [g["home"]["id"] for g in with_referee],
+                    "p_away_team_ids": [g["away"]["id"] for g in with_referee]
+                }
+            ).execute().data)
+
+        reference = load_matchday_reference(supabase, team_ids, referee_ids, pairs, season) if team_ids else {
+            "possession": {}, "profiles": {}, "derbies": {}
+        }
+
+        # Rose intere dallo snapshot: lo scoring vettoriale valuta tutti i giocatori
+        squads = {}
+        for row in squads_future.result(timeout=SQUAD_QUERY_TIMEOUT) if team_ids else []:
+            squads.setdefault(row["team_id"], []).append(row)
+        if team_ids and not squads:
+            return missing_season_message(season)
+
+        referee_cards = {}
+        if referee_cards_future:
+            try:
+                for r in referee_cards_future.result(timeout=FACTOR_TIMEOUT) or []:
+                    referee_cards[(r["referee_id"], r["player_id"])] = r
+            except Exception:
+                pass  # Storico arbitro non disponibile, si prosegue senza
+
+        # --- CONTESTO PER PARTITA, UNA RIGA PER OGNI GIOCATORE DELLA GIORNATA ---
+        rows = []
+        context = {key: [] for key in [
+            "game", "has_referee", "referee_card", "foul_to_card", "derby", "home_away", "referee_adj", "possession"
+        ]}
+        summaries = []
+        for g in games:
+            summary = {
+                "match": f"{g['home_name']} vs {g['away_name']}",
+                "kickoff": g["kickoff"],
+                "referee": g["referee_name"] or "Non designato",
+            }
+            result["matches"].append(summary)
+            summaries.append(summary)
+            if not (g["home"] and g["away"]):
+                summary["note"] = "Squadre non trovate nel database"
+                continue
+
+            home_id, away_id = g["home"]["id"], g["away"]["id"]
+            referee_id = g["referee"]["id"] if g["referee"] else None
+
+            derby_multiplier = 1.0
+            derby = reference["derbies"].get(tuple(sorted((home_id, away_id))))
+            if derby:
+                derby_multiplier = 1.0 + (0.08 * (derby.get("intensity") or 1) + 0.02)
+                summary["derby"] = derby.get("rivalry_name")
+
+            referee_adjustment = 1.0
+            profile = reference["profiles"].get(referee_id) if referee_id else None
+            if profile:
+                delta = float(profile.get("ref_league_delta") or 0)
+                referee_adjustment = max(0.85, min(1.15, 1.0 + (delta * 0.10)))
+
+            possession = {
+                team_id: possession_factor((reference["possession"].get(team_id) or {}).get("avg_possession"))
+                for team_id in (home_id, away_id)
+            }
+
+            summary["multipliers"] = {
+                "derby": round(derby_multiplier, 2),
+                "referee_adjustment": round(referee_adjustment, 2),
+                "possession": {"home": possession[home_id], "away": possession[away_id]}
+            }
+            summary["top_players"] = []
+
+            for team_id, is_home in [(home_id, True), (away_id, False)]:
+                for p in squads.get(team_id, []):
+                    rows.append(p)
+                    context["game"].append(len(summaries) - 1)
+                    context["has_referee"].append(bool(g["referee_name"]))
+                    context["referee_card"].append(referee_cards.get((referee_id, p.get("player_id"))))
+                    context["foul_to_card"].append(float(p.get("team_foul_to_card_pct") or 0))
+                    context["derby"].append(derby_multiplier)
+                    context["home_away"].append(HOME_MULTIPLIER if is_home else AWAY_MULTIPLIER)
+                    context["referee_adj"].append(referee_adjustment)
+                    context["possession"].append(float(p.get("possession_factor") or 1.0))
+
+        # --- STORICO H2H (una chiamata per tutti i giocatori sopra soglia di tutte le partite) ---
+        def fixture_key(i):
+            g = games[context["game"][i]]
+            return rows[i].get("player_id"), g["home"]["id"], g["away"]["id"]
+
+        h2h_data = {}
+        seasonal = seasonal_scores([float(p.get("yellows_per_90") or 0) for p in rows])
+        candidates = list({
+            fixture_key(i) for i in range(len(rows))
+            if rows[i].get("player_id") and seasonal[i] > H2H_THRESHOLD
+        })
+        if candidates:
+            try:
+                h2h_result = supabase.rpc(
+                    "get_head_to_head_cards_multi",
+                    {
+                        "p_player_ids": [c[0] for c in candidates],
+                        "p_team1_ids": [c[1] for c in candidates],
+                        "p_team2_ids": [c[2] for c in candidates]
+                    }
+                ).execute()
+                h2h_data = {(h["player_id"], h["team1_id"], h["team2_id"]): h for h in h2h_result.data or []}
+            except Exception:
+                pass  # H2H query failed, continue without
+
+        # --- SCORE DI TUTTE LE PARTITE IN UN SOLO PASSAGGIO (vettoriale, vedi scoring.py) ---
+        scores = score_players(
+            rows,
+            context["referee_card"],
+            [h2h_data.get(fixture_key(i)) for i in range(len(rows))],
+            has_referee=context["has_referee"],
+            team_foul_to_card=context["foul_to_card"],
+            derby_multiplier=context["derby"],
+            home_away_mult=context["home_away"],
+            referee_adjustment=context["referee_adj"],
+            possession_mult=context["possession"]
+        )
+
+        leaderboard = []
+        # player_risk_features ha una riga per giocatore/squadra/stagione: lo stesso giocatore
+        # compare due volte in una partita solo se in stagione ha giocato per entrambe le squadre
+        seen = set()
+        for i in ranking(scores):
+            p = rows[i]
+            summary = summaries[context["game"][i]]
+            score = round(float(scores["combined"][i]), 1)
+            if (p.get("player_id"), summary["match"]) in seen:
+                continue
+            seen.add((p.get("player_id"), summary["match"]))
+            if len(summary["top_players"]) < top_n:
+                summary["top_players"].append(
+                    {"name": p.get("player_name"), "team": p.get("team_name"), "position": p.get("position"), "score": score}
+                )
+            if len(leaderboard) < MATCHDAY_LEADERBOARD_SIZE:
+                leaderboard.append(
+                    {"name": p.get("player_name"), "team": p.get("team_name"), "match": summary["match"], "score": score}
+                )
+
+        result["leaderboard"] = leaderboard
+
+        return render(result, format, fields)
+
+    except Exception as e:
+        return error_response(e, "Errore nell'analisi")
+
 if __name__ == "__main__":
     mcp.run()
@@ -0,0 +1,138 @@
+"""
+YellowOracle - Risoluzione nomi di squadre, giocatori e arbitri
+
+Indice in memoria costruito una volta dai nomi nel DB (mcp_server.py lo tiene in cache
+finché non cambia la versione dati). I nomi vengono normalizzati (minuscolo, senza accenti
+né punteggiatura) e indicizzati per trigrammi; per le squadre anche short_name, TLA e alias.
+La ricerca restituisce candidati ordinati per punteggio (0-1) con il loro ID:
+"inter" trova FC Internazionale Milano prima di Internacional, "modric" trova Luka Modrić.
+"""
+
+import difflib
+import re
+import unicodedata
+from collections import Counter
+
+# Lettere che la scomposizione Unicode (NFKD) non riduce a una lettera base
+SPECIAL_LETTERS = str.maketrans({
+    "ø": "o", "ß": "ss", "æ": "ae", "œ": "oe", "đ": "d", "ð": "d", "ł": "l", "ı": "i", "þ": "th"
+})
+
+# Alias comuni -> parte del nome ufficiale (normalizzato) della squadra
+TEAM_ALIASES = {
+    "inter": "internazionale",
+    "juve": "juventus",
+    "barca": "barcelona",
+    "psg": "paris saint germain",
+    "man utd": "manchester united",
+    "man united": "manchester united",
+    "man city": "manchester city",
+    "spurs": "tottenham",
+    "atletico": "atletico de madrid",
+    "bayern": "bayern munchen",
+    "gladbach": "monchengladbach",
+    "wolves": "wolverhampton",
+}
+
+MIN_SCORE = 0.3  # Sotto questa soglia un nome non è un candidato
+RESOLVE_MIN_SCORE = 0.5  # Punteggio minimo per risolvere un nome in un ID senza chiedere
+MAX_CANDIDATES = 200  # Nomi valutati per ricerca (quelli con più trigrammi in comune)
+
+_NON_ALNUM = re.compile(r"[^a-z0-9]+")
+
+
+def fold(text: str) -> str:
+    """Nome normalizzato: minuscolo, senza accenti, punteggiatura sostituita da spazi."""
+    text = unicodedata.normalize("NFKD", (text or "").lower().translate(SPECIAL_LETTERS))
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return _NON_ALNUM.sub(" ", text).strip()
+
+
+def trigrams(text: str) -> set:
+    """Trigrammi di ogni parola, con spazi ai bordi (così contano anche gli inizi di parola)."""
+    grams = set()
+    for word in text.split():
+        padded = f"  {word} "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+def match_score(query: str, key: str) -> float:
+    """Somiglianza 0-1 tra una ricerca e un nome, entrambi già normalizzati."""
+    if query == key:
+        return 1.0
+    if key.startswith(query):
+        return 0.85 + 0.1 * len(query) / len(key)
+
+    words = key.split()
+    query_words = query.split()
+    # Ogni parola cercata è l'inizio di una parola del nome ("modric", "l modric")
+    if all(any(w.startswith(q) for w in words) for q in query_words):
+        return 0.7 + 0.1 * len(query) / len(key)
+
+    # Trigrammi in comune (ordine delle parole e parole mancanti)
+    query_grams, key_grams = trigrams(query), trigrams(key)
+    similarity = len(query_grams & key_grams) / len(query_grams | key_grams) if query_grams else 0.0
+
+    # Errori di battitura: parola per parola
+    typo = 0.0
+    for q in query_words:
+        typo = max(typo, max((difflib.SequenceMatcher(None, q, w).ratio() for w in words), default=0.0))
+    return max(similarity * 0.8, typo * 0.7 if len(query_words) == 1 else typo * 0.5)
+
+
+class NameIndex:
+    """
+    Indice di ricerca su un elenco di righe {"id", "name", ...}.
+    Le colonne in extra_keys (es. short_name, tla) sono nomi alternativi della stessa riga;
+    aliases mappa un alias a una parte del nome ufficiale.
+    """
+
+    def __init__(self, rows: list, extra_keys: tuple = (), aliases: dict = None):
+        self.rows = []
+        self._keys = []  # Per riga: nomi normalizzati (nome, alternativi, alias)
+        self._postings = {}  # trigramma -> indici delle righe
+
+        for row in rows:
+            if row.get("id") is None or not row.get("name"):
+                continue
+            name = fold(row["name"])
+            keys = [name] + [fold(row[k]) for k in extra_keys if row.get(k)]
+            for alias, target in (aliases or {}).items():
+                if target in name:
+                    keys.append(alias)
+            keys = list(dict.fromkeys(k for k in keys if k))
+
+            index = len(self.rows)
+            self.rows.append(row)
+            self._keys.append(keys)
+            for gram in set().union(*(trigrams(k) for k in keys)):
+                self._postings.setdefault(gram, []).append(index)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def search(self, query: str, limit: int = 5, min_score: float = MIN_SCORE) -> list:
+        """Candidati ordinati per punteggio: la riga originale più "score"."""
+        query = fold(query)
+        if not query:
+            return []
+
+        shared = Counter()
+        for gram in trigrams(query):
+            shared.update(self._postings.get(gram, ()))
+
+        scored = []
+        for index, _ in shared.most_common(MAX_CANDIDATES):
+            score = max(match_score(query, key) for key in self._keys[index])
+            if score >= min_score:
+                scored.append((score, index))
+
+        # A parità di punteggio il nome più corto (più vicino alla ricerca)
+        scored.sort(key=lambda s: (-s[0], len(self.rows[s[1]]["name"]), self.rows[s[1]]["name"]))
+        return [{**self.rows[index], "score": round(score, 2)} for score, index in scored[:limit]]
+
+    def resolve(self, query: str):
+        """ID del candidato migliore, None se nessuno supera RESOLVE_MIN_SCORE."""
+        candidates = self.search(query, limit=1, min_score=RESOLVE_MIN_SCORE)
+        return candidates[0]["id"] if candidates else None
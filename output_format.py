@@ -0,0 +1,113 @@
+"""
+YellowOracle - Serializzazione risposte dei tool MCP
+
+Tre formati, scelti dal parametro `format` di ogni tool:
+- compact: JSON senza spazi (default)
+- json: JSON indentato, leggibile a colpo d'occhio
+- table: come compact, ma le liste di oggetti diventano {"columns": [...], "rows": [[...]]}
+  con le chiavi annidate appiattite in colonne "a.b" (i nomi dei campi compaiono una volta sola)
+
+Il parametro `fields` seleziona i campi da restituire con percorsi separati da virgola
+(es. "player_name,yellow_cards" oppure "overall_top5.name,overall_top5.combined_score");
+le liste sono trasparenti: il percorso si applica a ogni elemento.
+"""
+
+import json
+
+try:
+    import orjson
+except ImportError:
+    # Fallback al modulo standard (più lento, stesso output)
+    orjson = None
+
+OUTPUT_FORMATS = ("compact", "json", "table")
+DEFAULT_FORMAT = "compact"
+
+
+def parse_fields(fields: str = None) -> list:
+    """Percorsi richiesti come liste di chiavi: "a.b,c" -> [["a", "b"], ["c"]]."""
+    if not fields:
+        return []
+    return [field.strip().split(".") for field in fields.split(",") if field.strip()]
+
+
+def select_columns(fields: str = None, default: str = "*", required: list = None) -> str:
+    """
+    Colonne per select() di PostgREST: solo le chiavi di primo livello richieste, o default.
+    required: colonne lette comunque (es. quelle del cursore di paginazione), poi scartate da render.
+    """
+    columns = list(dict.fromkeys(path[0] for path in parse_fields(fields)))
+    if not columns:
+        return default
+    return ", ".join(columns + [column for column in required or [] if column not in columns])
+
+
+def select_fields(data, paths: list):
+    """Tiene solo i percorsi richiesti (le liste vengono filtrate elemento per elemento)."""
+    if isinstance(data, list):
+        return [select_fields(item, paths) for item in data]
+    if not isinstance(data, dict) or not paths:
+        return data
+
+    selected = {}
+    for key, value in data.items():
+        rest = [path[1:] for path in paths if path[0] == key]
+        if not rest:
+            continue
+        # Percorso completo (es. "breakdown"): valore intero
+        selected[key] = value if any(not path for path in rest) else select_fields(value, rest)
+    return selected
+
+
+def _flatten(row: dict, prefix: str = "") -> dict:
+    flat = {}
+    for key, value in row.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict) and value:
+            flat.update(_flatten(value, f"{name}."))
+        else:
+            flat[name] = tabulate(value)
+    return flat
+
+
+def tabulate(data):
+    """Codifica colonnare: ogni lista di oggetti diventa colonne + righe (ricorsivo)."""
+    if isinstance(data, list) and data and all(isinstance(item, dict) for item in data):
+        rows = [_flatten(item) for item in data]
+        columns = list(dict.fromkeys(column for row in rows for column in row))
+        return {"columns": columns, "rows": [[row.get(column) for column in columns] for row in rows]}
+    if isinstance(data, dict):
+        return {key: tabulate(value) for key, value in data.items()}
+    if isinstance(data, list):
+        return [tabulate(item) for item in data]
+    return data
+
+
+def dumps(data, indent: bool = False) -> str:
+    """JSON con orjson se installato, altrimenti json (date e tipi non JSON come stringhe)."""
+    if orjson is not None:
+        option = orjson.OPT_NON_STR_KEYS | (orjson.OPT_INDENT_2 if indent else 0)
+        return orjson.dumps(data, default=str, option=option).decode()
+    if indent:
+        return json.dumps(data, indent=2, default=str, ensure_ascii=False)
+    return json.dumps(data, separators=(",", ":"), default=str, ensure_ascii=False)
+
+
+def render(data, format: str = DEFAULT_FORMAT, fields: str = None, items_key: str = None) -> str:
+    """
+    Risposta di un tool nel formato richiesto.
+    items_key: per le risposte paginate, fields si applica solo alla lista data[items_key].
+
+    Raises:
+        ValueError: formato non supportato
+    """
+    if format not in OUTPUT_FORMATS:
+        raise ValueError(f"Formato '{format}' non valido. Usa: {', '.join(OUTPUT_FORMATS)}")
+
+    if items_key:
+        data = {**data, items_key: select_fields(data[items_key], parse_fields(fields))}
+    else:
+        data = select_fields(data, parse_fields(fields))
+    if format == "table":
+        data = tabulate(data)
+    return dumps(data, indent=format == "json")
@@ -0,0 +1,183 @@
+"""
+YellowOracle - Motore di scoring rischio cartellino
+
+Formula unica usata da analyze_match_risk e analyze_matchday (mcp_server.py),
+calcolata su array NumPy: una riga per giocatore, una colonna per fattore.
+Così si possono valutare rose intere (o tutte le squadre di una giornata) in un passaggio.
+"""
+
+import numpy as np
+
+# Pesi per il calcolo dello score (con arbitro)
+WEIGHT_SEASONAL = 0.35
+WEIGHT_REFEREE = 0.30
+WEIGHT_H2H = 0.15
+WEIGHT_FOULS = 0.20
+# Pesi senza arbitro
+WEIGHT_SEASONAL_NO_REF = 0.45
+WEIGHT_H2H_NO_REF = 0.25
+WEIGHT_FOULS_NO_REF = 0.30
+
+DEFAULT_REFEREE_SCORE = 25
+H2H_THRESHOLD = 25
+
+# Moltiplicatori home/away (studio CIES)
+HOME_MULTIPLIER = 0.94
+AWAY_MULTIPLIER = 1.06
+
+# Ruoli più esposti ai falli (×1.2 sul fattore falli)
+FOUL_PRONE_POSITIONS = ["Midfield", "Defence"]
+FOUL_PRONE_MULTIPLIER = 1.2
+
+
+def seasonal_scores(yellows_per_90) -> np.ndarray:
+    """Score stagionale: gialli/90 × 100, max 100 (serve anche per scegliere i candidati H2H)."""
+    return np.minimum(np.asarray(yellows_per_90, dtype=float) * 100, 100)
+
+
+def score_players(
+    rows: list,
+    referee_cards: list,
+    h2h: list,
+    has_referee,
+    team_foul_to_card,
+    derby_multiplier,
+    home_away_mult,
+    referee_adjustment,
+    possession_mult
+) -> dict:
+    """
+    Score di tutti i giocatori in forma vettoriale.
+
+    Args:
+        rows: Righe di player_risk_features (una per giocatore)
+        referee_cards: Per ogni riga, storico con l'arbitro (times_booked,
+            matches_with_referee, booking_percentage) o None
+        h2h: Per ogni riga, storico scontri diretti (total_h2h_matches, total_yellows) o None
+        has_referee, team_foul_to_card e moltiplicatori: scalari o array allineati a rows
+
+    Returns:
+        Dict di array (una posizione per riga): seasonal, referee, h2h, fouls,
+        position_multiplier, base, combined + contesto usato (per il breakdown)
+    """
+    n = len(rows)
+
+    def column(value, dtype=float):
+        return np.broadcast_to(np.asarray(value, dtype=dtype), (n,))
+
+    yellows_per_90 = np.array([float(r.get("yellows_per_90") or 0) for r in rows], dtype=float)
+    positions = np.array([r.get("position") or "" for r in rows], dtype=object)
+    referee_pct = np.array(
+        [float(c.get("booking_percentage", 0)) if c else np.nan for c in referee_cards], dtype=float
+    ).reshape(n)
+    h2h_matches = np.array([float(h.get("total_h2h_matches", 0)) if h else 0 for h in h2h], dtype=float).reshape(n)
+    h2h_yellows = np.array([float(h.get("total_yellows", 0)) if h else 0 for h in h2h], dtype=float).reshape(n)
+
+    has_referee = column(has_referee, bool)
+    team_foul_to_card = column(team_foul_to_card)
+    derby_multiplier = column(derby_multiplier)
+    home_away_mult = column(home_away_mult)
+    referee_adjustment = column(referee_adjustment)
+    possession_mult = column(possession_mult)
+
+    # 1. SEASONAL SCORE (35%)
+    seasonal = seasonal_scores(yellows_per_90)
+
+    # 2. REFEREE SCORE (30%): storico con l'arbitro, altrimenti default
+    referee = np.where(has_referee, np.where(np.isnan(referee_pct), DEFAULT_REFEREE_SCORE, referee_pct), 0.0)
+
+    # 3. H2H SCORE (15%): solo sopra soglia stagionale e con almeno uno scontro diretto
+    h2h_valid = (seasonal > H2H_THRESHOLD) & (h2h_matches > 0)
+    h2h_score = np.where(
+        h2h_valid,
+        np.divide(h2h_yellows, h2h_matches, out=np.zeros(n), where=h2h_matches > 0) * 100,
+        0.0
+    )
+
+    # 4. FOULS SCORE (20%)
+    position_multiplier = np.where(np.isin(positions, FOUL_PRONE_POSITIONS), FOUL_PRONE_MULTIPLIER, 1.0)
+    fouls = np.minimum(
+        ((team_foul_to_card * 0.5) + np.minimum(yellows_per_90 * 50, 50)) * position_multiplier,
+        100
+    )
+
+    # SCORE BASE COMBINATO
+    base = np.where(
+        has_referee,
+        seasonal * WEIGHT_SEASONAL + referee * WEIGHT_REFEREE + h2h_score * WEIGHT_H2H + fouls * WEIGHT_FOULS,
+        seasonal * WEIGHT_SEASONAL_NO_REF + h2h_score * WEIGHT_H2H_NO_REF + fouls * WEIGHT_FOULS_NO_REF
+    )
+
+    # APPLICA MOLTIPLICATORI CONTESTUALI (league normalization già incorporata nei dati stagionali)
+    combined = np.minimum(base * derby_multiplier * home_away_mult * referee_adjustment * possession_mult, 100)
+
+    return {
+        "per_90": yellows_per_90,
+        "seasonal": seasonal,
+        "referee": referee,
+        "h2h": h2h_score,
+        "h2h_valid": h2h_valid,
+        "fouls": fouls,
+        "position_multiplier": position_multiplier,
+        "base": base,
+        "combined": combined,
+        "has_referee": has_referee,
+        "team_foul_to_card": team_foul_to_card,
+        "derby": derby_multiplier,
+        "home_away": home_away_mult,
+        "referee_adj": referee_adjustment,
+        "possession": possession_mult,
+    }
+
+
+def ranking(scores: dict) -> np.ndarray:
+    """Indici delle righe per score combinato (arrotondato come nell'output) decrescente."""
+    return np.argsort(-np.round(scores["combined"], 1), kind="stable")
+
+
+def player_breakdown(row: dict, scores: dict, i: int, referee_card: dict = None, h2h: dict = None) -> dict:
+    """Dict di output (nome, score, breakdown) della riga i, nel formato di analyze_match_risk."""
+    has_referee = bool(scores["has_referee"][i])
+
+    referee_info = None
+    if has_referee and referee_card:
+        referee_info = f"{referee_card.get('times_booked', 0)} in {referee_card.get('matches_with_referee', 0)} partite"
+
+    h2h_info = None
+    if scores["h2h_valid"][i]:
+        h2h_info = f"{h2h.get('total_yellows', 0)} in {h2h.get('total_h2h_matches', 0)} H2H"
+
+    return {
+        "name": row.get("player_name", ""),
+        "team": row.get("team_name"),
+        "position": row.get("position", ""),
+        "combined_score": round(float(scores["combined"][i]), 1),
+        "base_score": round(float(scores["base"][i]), 1),
+        "breakdown": {
+            "seasonal": {
+                "score": round(float(scores["seasonal"][i]), 1),
+                "yellows": row.get("yellow_cards", 0),
+                "matches": row.get("matches_played", 0),
+                "per_90": round(float(scores["per_90"][i]), 2)
+            },
+            "referee": {
+                "score": round(float(scores["referee"][i]), 1),
+                "detail": referee_info
+            } if has_referee else None,
+            "h2h": {
+                "score": round(float(scores["h2h"][i]), 1),
+                "detail": h2h_info
+            },
+            "fouls": {
+                "score": round(float(scores["fouls"][i]), 1),
+                "team_foul_to_card_pct": round(float(scores["team_foul_to_card"][i]), 1),
+                "position_multiplier": float(scores["position_multiplier"][i])
+            },
+            "multipliers": {
+                "derby": float(scores["derby"][i]),
+                "home_away": float(scores["home_away"][i]),
+                "referee_adj": float(scores["referee_adj"][i]),
+                "possession": float(scores["possession"][i])
+            }
+        }
+    }
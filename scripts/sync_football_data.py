@@ -24,11 +24,20 @@ Richiede piano "Free + Deep Data" (€29/mese) + "Statistics Add-On" (€15/mese
 """
 
 import os
+import re
 import sys
+import json
 import time
+import zlib
+import sqlite3
 import argparse
 import asyncio
-from datetime import datetime, timedelta
+import contextvars
+import functools
+import threading
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
 from typing import Optional
 
 import aiohttp
@@ -61,11 +70,49 @@ COMPETITIONS = {
 }
 
 # Rate limiting: 30 chiamate/minuto con piano a pagamento
-RATE_LIMIT_DELAY = 2.5  # secondi tra le chiamate (per sync sequenziale)
+API_REQUESTS_PER_MINUTE = 30  # Budget del piano (finestra mobile di 60s)
+RATE_LIMIT_WINDOW = 60  # Secondi della finestra mobile
+
+# Parallelizzazione: richieste in volo contemporaneamente (il budget lo decide il limiter)
+MAX_CONCURRENT_REQUESTS = 10
+
+# Orchestratore: sync_season (competizione/stagione) eseguiti insieme nello stesso event loop
+MAX_PARALLEL_JOBS = 4
+
+# Pipeline fetch → DB: payload in attesa di scrittura e writer concorrenti
+PIPELINE_QUEUE_SIZE = 50  # Limita la memoria: mai più di N payload scaricati e non salvati
+DB_WRITER_WORKERS = 3
+DB_WRITE_BATCH_SIZE = 25  # Payload massimi passati a un writer in una volta
+
+# Cache su disco delle risposte API (JSON compresso in SQLite)
+CACHE_PATH = os.getenv(
+    "FOOTBALL_CACHE_PATH",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".cache", "football_data.sqlite")
+)
+# TTL per endpoint (prima regola che corrisponde). 0 = sempre rivalidare con ETag/If-Modified-Since.
+# I dettagli /matches/{id} FINISHED non vengono mai riscaricati (payload definitivo).
+CACHE_TTL_RULES = [
+    (re.compile(r"^/competitions/[A-Z0-9]+$"), 7 * 24 * 3600),   # Info competizione
+    (re.compile(r"^/competitions/[A-Z0-9]+/teams"), 24 * 3600),  # Squadre della stagione
+    (re.compile(r"^/teams/\d+$"), 24 * 3600),                     # Rose
+    (re.compile(r"^/persons/\d+$"), 7 * 24 * 3600),               # Anagrafica giocatore
+]
+CACHE_IMMUTABLE_PATTERN = re.compile(r"^/matches/\d+$")
+CACHE_MAX_AGE_DAYS = 30  # Voci non definitive più vecchie vengono eliminate all'avvio
+
+# Refresh squadre e rose (/competitions/{code}/teams, /teams/{id}): saltato se l'ultimo
+# refresh riuscito della competizione (sync_checkpoints, fase "players") è più recente del TTL.
+# Durante le finestre di mercato vale il TTL breve. SQUAD_TTL_DAYS=0 forza il refresh.
+SQUAD_TTL_DAYS = float(os.getenv("SQUAD_TTL_DAYS", "7"))
+SQUAD_TTL_TRANSFER_DAYS = float(os.getenv("SQUAD_TTL_TRANSFER_DAYS", "1"))
+TRANSFER_WINDOWS = [((6, 1), (9, 1)), ((1, 1), (2, 3))]  # (mese, giorno) inizio/fine, finestre europee
+
+# Scritture DB: upsert in blocco (righe per singola chiamata PostgREST)
+DB_BATCH_SIZE = 500
+DB_PAGE_SIZE = 1000  # Righe massime restituite da PostgREST per singola select
 
-# Parallelizzazione: batch di richieste rispettando 30 req/min
-PARALLEL_BATCH_SIZE = 25  # Richieste per batch (lasciamo margine sotto 30)
-PARALLEL_BATCH_DELAY = 60  # Secondi tra batch (per rispettare rate limit)
+# Journal dei run (sync_runs / sync_checkpoints): checkpoint scritti ogni N unità
+JOURNAL_FLUSH_SIZE = 50
 
 # Stagioni supportate (piano Free + Deep Data: ultime 3 stagioni)
 # Nota: stagioni più vecchie richiedono piano superiore
@@ -76,6 +123,268 @@ ALL_SEASONS = [
 ]
 
 
+class RateLimiter:
+    """
+    Token bucket a finestra mobile condiviso da chiamate sequenziali e parallele.
+
+    Tiene i timestamp delle richieste degli ultimi RATE_LIMIT_WINDOW secondi e, quando
+    disponibili, si allinea agli header X-Requests-Available-Minute / X-RequestCounter-Reset
+    di football-data.org: una richiesta parte appena si libera budget, senza pause fisse.
+    Lo stato è protetto da un lock di threading, quindi è condivisibile tra event loop e
+    thread: chi attende registra un risveglio (future del proprio loop o threading.Event).
+
+    Con più job in corso (vedi SYNC_JOB) gli slot vengono assegnati a turno: ottiene il
+    prossimo slot il job in attesa servito meno di recente, così una competizione con
+    migliaia di richieste in coda non blocca le altre. Chi non è di turno dorme finché uno
+    slot viene assegnato o un job smette di attendere; chi aspetta budget dorme fino allo
+    scorrimento della finestra (o a un aggiornamento dagli header). Nessun polling.
+    """
+
+    def __init__(self, max_requests: int = API_REQUESTS_PER_MINUTE, window: float = RATE_LIMIT_WINDOW):
+        self.max_requests = max_requests
+        self.window = window
+        self._sent = deque()  # timestamp (monotonic) delle richieste nella finestra
+        self._server_available = None  # budget residuo dichiarato dall'API
+        self._server_reset_at = 0.0  # quando il contatore dell'API si azzera
+        self._lock = threading.Lock()
+        self._waiting = {}  # job -> richieste in attesa
+        self._last_grant = {}  # job -> progressivo dell'ultimo slot assegnato
+        self._grants = 0
+        self._wakers = set()  # callback di risveglio dei chiamanti in attesa
+
+    def _reserve(self, job: Optional[str]) -> Optional[float]:
+        """
+        Prenota uno slot per job (da chiamare con il lock acquisito).
+
+        Ritorna 0 se prenotato, i secondi fino allo scorrimento della finestra se manca
+        budget, None se lo slot spetta a un altro job (attendere un risveglio).
+        """
+        now = time.monotonic()
+
+        while self._sent and now - self._sent[0] >= self.window:
+            self._sent.popleft()
+
+        if self._server_available is not None and now >= self._server_reset_at:
+            self._server_available = None
+
+        if self._server_available is not None and self._server_available <= 0:
+            return max(self._server_reset_at - now, 0.1)
+
+        if len(self._sent) >= self.max_requests:
+            return max(self._sent[0] + self.window - now, 0.1)
+
+        # Turno: lo slot spetta al job in attesa servito meno di recente
+        my_turn = self._last_grant.get(job, -1)
+        if any(self._last_grant.get(other, -1) < my_turn for other in self._waiting if other != job):
+            return None
+
+        self._sent.append(now)
+        if self._server_available is not None:
+            self._server_available -= 1
+        self._last_grant[job] = self._grants
+        self._grants += 1
+        # Il turno è cambiato: gli altri job ricontrollano
+        self._notify()
+        return 0
+
+    def _notify(self):
+        """Risveglia tutti i chiamanti in attesa (da chiamare con il lock acquisito)."""
+        for wake in self._wakers:
+            wake()
+        self._wakers.clear()
+
+    def _enter(self, job: Optional[str]):
+        with self._lock:
+            self._waiting[job] = self._waiting.get(job, 0) + 1
+
+    def _leave(self, job: Optional[str]):
+        with self._lock:
+            self._waiting[job] -= 1
+            if not self._waiting[job]:
+                del self._waiting[job]
+                # Il job non ha più richieste in coda: il turno può passare ad altri
+                self._notify()
+
+    async def acquire(self):
+        """Attende (senza bloccare l'event loop) uno slot libero."""
+        job = SYNC_JOB.get()
+        loop = asyncio.get_running_loop()
+        self._enter(job)
+        try:
+            while True:
+                waiter = loop.create_future()
+                wake = functools.partial(loop.call_soon_threadsafe, _resolve_waiter, waiter)
+                with self._lock:
+                    wait = self._reserve(job)
+                    if wait == 0:
+                        return
+                    self._wakers.add(wake)
+                try:
+                    await asyncio.wait_for(waiter, wait)
+                except asyncio.TimeoutError:
+                    pass
+                finally:
+                    with self._lock:
+                        self._wakers.discard(wake)
+        finally:
+            self._leave(job)
+
+    def acquire_sync(self):
+        """Come acquire(), per le chiamate sequenziali con requests."""
+        job = SYNC_JOB.get()
+        self._enter(job)
+        try:
+            while True:
+                event = threading.Event()
+                with self._lock:
+                    wait = self._reserve(job)
+                    if wait == 0:
+                        return
+                    self._wakers.add(event.set)
+                event.wait(wait)
+                with self._lock:
+                    self._wakers.discard(event.set)
+        finally:
+            self._leave(job)
+
+    def update_from_headers(self, headers):
+        """Allinea il budget agli header di risposta dell'API (se presenti)."""
+        available = headers.get("X-Requests-Available-Minute")
+        reset = headers.get("X-RequestCounter-Reset")
+        if available is None or reset is None:
+            return
+        try:
+            available, reset = int(available), int(reset)
+        except ValueError:
+            return
+        with self._lock:
+            self._server_available = available
+            self._server_reset_at = time.monotonic() + reset
+            # Il budget può essere cresciuto: chi attende ricalcola l'attesa
+            self._notify()
+
+    def on_rate_limited(self, headers) -> float:
+        """Dopo un 429: budget esaurito fino al reset indicato dall'API. Ritorna l'attesa."""
+        try:
+            reset = int(headers.get("X-RequestCounter-Reset") or self.window)
+        except ValueError:
+            reset = self.window
+        with self._lock:
+            self._server_available = 0
+            self._server_reset_at = time.monotonic() + reset
+        return reset
+
+
+def _resolve_waiter(waiter: asyncio.Future):
+    """Completa la future di un chiamante in attesa (eseguita nel suo event loop)."""
+    if not waiter.done():
+        waiter.set_result(None)
+
+
+# Job corrente ("SA 2025-2026"): impostato dall'orchestratore in ogni task, ereditato
+# da asyncio.to_thread. Usato dal limiter per i turni e per etichettare i log.
+SYNC_JOB = contextvars.ContextVar("sync_job", default=None)
+
+# Limiter unico per tutto il processo
+RATE_LIMITER = RateLimiter()
+
+
+def job_label() -> str:
+    """Prefisso "[SA 2025-2026] " per i log delle pipeline quando più job girano insieme."""
+    job = SYNC_JOB.get()
+    return f"[{job}] " if job else ""
+
+
+CachedResponse = namedtuple("CachedResponse", ["data", "etag", "last_modified", "fresh"])
+
+
+class ResponseCache:
+    """
+    Cache persistente delle risposte football-data.org, chiave = endpoint.
+
+    Payload salvati come JSON compresso (zlib) in SQLite. Una voce è "fresca" se è
+    definitiva (dettaglio partita FINISHED) o se non ha superato il TTL dell'endpoint;
+    le voci scadute vengono rivalidate con If-None-Match / If-Modified-Since.
+    """
+
+    def __init__(self, path: str = CACHE_PATH):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Un'unica connessione condivisa tra thread, serializzata dal lock
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS responses (
+                    endpoint TEXT PRIMARY KEY,
+                    body BLOB NOT NULL,
+                    etag TEXT,
+                    last_modified TEXT,
+                    fetched_at REAL NOT NULL,
+                    immutable INTEGER NOT NULL DEFAULT 0
+                )
+            """)
+            self._conn.execute(
+                "DELETE FROM responses WHERE immutable = 0 AND fetched_at < ?",
+                (time.time() - CACHE_MAX_AGE_DAYS * 86400,)
+            )
+        self.hits = 0
+        self.revalidated = 0
+
+    @staticmethod
+    def ttl(endpoint: str) -> int:
+        for pattern, ttl in CACHE_TTL_RULES:
+            if pattern.search(endpoint):
+                return ttl
+        return 0
+
+    def lookup(self, endpoint: str, max_age: Optional[float] = None) -> Optional[CachedResponse]:
+        """Voce in cache per endpoint; max_age (secondi) sostituisce il TTL della regola."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT body, etag, last_modified, fetched_at, immutable FROM responses WHERE endpoint = ?",
+                (endpoint,)
+            ).fetchone()
+            if not row:
+                return None
+
+            body, etag, last_modified, fetched_at, immutable = row
+            ttl = self.ttl(endpoint) if max_age is None else max_age
+            fresh = bool(immutable) or time.time() - fetched_at < ttl
+            # Contatori aggiornati dai thread di asyncio.to_thread: stesso lock dell'accesso SQLite
+            if fresh:
+                self.hits += 1
+        return CachedResponse(json.loads(zlib.decompress(body)), etag, last_modified, fresh)
+
+    def store(self, endpoint: str, data: dict, headers):
+        immutable = bool(CACHE_IMMUTABLE_PATTERN.search(endpoint)) and data.get("status") == "FINISHED"
+        body = zlib.compress(json.dumps(data, separators=(",", ":")).encode("utf-8"))
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (endpoint, body, etag, last_modified, fetched_at, immutable) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (endpoint, body, headers.get("ETag"), headers.get("Last-Modified"), time.time(), int(immutable))
+            )
+
+    def touch(self, endpoint: str):
+        """Risposta 304: il payload in cache è ancora valido, riparte il TTL."""
+        with self._lock, self._conn:
+            self.revalidated += 1
+            self._conn.execute("UPDATE responses SET fetched_at = ? WHERE endpoint = ?", (time.time(), endpoint))
+
+    @staticmethod
+    def conditional_headers(cached: Optional[CachedResponse]) -> dict:
+        headers = {}
+        if cached and cached.etag:
+            headers["If-None-Match"] = cached.etag
+        if cached and cached.last_modified:
+            headers["If-Modified-Since"] = cached.last_modified
+        return headers
+
+
+# Cache risposte API (None = disattivata, vedi --no-cache)
+RESPONSE_CACHE: Optional[ResponseCache] = None
+
+
 def get_supabase_client() -> Client:
     """Crea connessione a Supabase."""
     if not SUPABASE_URL or not SUPABASE_KEY:
@@ -84,52 +393,324 @@ def get_supabase_client() -> Client:
     return create_client(SUPABASE_URL, SUPABASE_KEY)
 
 
-def api_request(endpoint: str) -> dict:
-    """Esegue una richiesta all'API football-data.org."""
+def upsert_returning_ids(supabase: Client, table: str, rows: list, on_conflict: str = "external_id", key: str = "external_id") -> dict:
+    """
+    Upsert a blocchi di DB_BATCH_SIZE righe, con gli ID interni letti dalla stessa risposta
+    (PostgREST restituisce le righe scritte). Ritorna dict key -> id interno.
+    """
+    # Deduplica per chiave: PostgREST rifiuta un upsert che tocca due volte la stessa riga
+    unique_rows = list({row[key]: row for row in rows}.values())
+    id_map = {}
+
+    for i in range(0, len(unique_rows), DB_BATCH_SIZE):
+        chunk = unique_rows[i:i+DB_BATCH_SIZE]
+        try:
+            result = supabase.table(table).upsert(chunk, on_conflict=on_conflict).execute()
+            for row in result.data or []:
+                id_map[row[key]] = row["id"]
+        except Exception as e:
+            print(f"  ❌ Errore upsert {table} (blocco {i // DB_BATCH_SIZE + 1}, {len(chunk)} righe): {e}")
+
+    return id_map
+
+
+def fetch_all_rows(query_factory) -> list:
+    """
+    Legge tutte le righe di una select paginando con range() (PostgREST restituisce
+    al massimo DB_PAGE_SIZE righe per chiamata). query_factory() crea la query da zero.
+    """
+    rows = []
+    offset = 0
+    while True:
+        page = query_factory().range(offset, offset + DB_PAGE_SIZE - 1).execute().data or []
+        rows.extend(page)
+        if len(page) < DB_PAGE_SIZE:
+            return rows
+        offset += DB_PAGE_SIZE
+
+
+def load_player_map(supabase: Client, team_map: dict) -> dict:
+    """Mappa external_id -> internal_id dei giocatori delle squadre in team_map, letta dal DB."""
+    team_ids = list(team_map.values())
+    if not team_ids:
+        return {}
+
+    rows = fetch_all_rows(
+        lambda: supabase.table("players").select("id, external_id").in_("current_team_id", team_ids).order("id")
+    )
+    return {row["external_id"]: row["id"] for row in rows}
+
+
+def load_players_by_external_id(supabase: Client, external_ids: list) -> dict:
+    """Mappa external_id -> internal_id dei giocatori già nel DB, qualunque sia la squadra attuale."""
+    player_map = {}
+    for start in range(0, len(external_ids), DB_BATCH_SIZE):
+        rows = supabase.table("players").select("id, external_id").in_(
+            "external_id", external_ids[start:start + DB_BATCH_SIZE]
+        ).execute().data or []
+        player_map.update({row["external_id"]: row["id"] for row in rows})
+    return player_map
+
+
+def squad_ttl(now: datetime = None) -> timedelta:
+    """TTL delle rose: breve durante le finestre di mercato (TRANSFER_WINDOWS), lungo fuori."""
+    now = now or datetime.now()
+    for start, end in TRANSFER_WINDOWS:
+        if start <= (now.month, now.day) < end:
+            return timedelta(days=SQUAD_TTL_TRANSFER_DAYS)
+    return timedelta(days=SQUAD_TTL_DAYS)
+
+
+class SyncJournal:
+    """
+    Journal di un run di sync_season (tabelle sync_runs / sync_checkpoints).
+
+    Registra le fasi completate e, per dettagli partite e statistiche giocatori, gli
+    endpoint scaricati e salvati. Con --resume riprende l'ultimo run non completato della
+    stessa competizione/stagione saltando le unità già salvate. Se le tabelle non esistono
+    (migration 005 non applicata) il journal si disattiva senza bloccare il sync.
+    """
+
+    def __init__(self, supabase: Client, competition_code: str, season: str, mode: str, resume: bool = False):
+        self.supabase = supabase
+        self.competition_code = competition_code
+        self.run_id = None
+        self.resumed = False
+        self.date_from = None
+        self.date_to = None
+        self._units = {}  # (stage, unit_key) -> {"fetched_at": ..., "persisted_at": ...}
+        self._dirty = set()
+        self._lock = threading.Lock()
+
+        try:
+            if resume:
+                last_run = supabase.table("sync_runs")\
+                    .select("id, status, date_from, date_to, started_at")\
+                    .eq("competition_code", competition_code)\
+                    .eq("season", season)\
+                    .order("started_at", desc=True)\
+                    .limit(1)\
+                    .execute()
+                if last_run.data and last_run.data[0]["status"] != "COMPLETED":
+                    run = last_run.data[0]
+                    self.run_id = run["id"]
+                    self.resumed = True
+                    self.date_from = run.get("date_from")
+                    self.date_to = run.get("date_to")
+                    self._load_checkpoints()
+                    supabase.table("sync_runs").update({
+                        "status": "RUNNING",
+                        "updated_at": datetime.now().isoformat()
+                    }).eq("id", self.run_id).execute()
+                    done = sum(1 for (_, key), unit in self._units.items() if key and unit.get("persisted_at"))
+                    print(f"\n♻️  Ripresa run del {run['started_at'][:16]}: {done} unità già salvate")
+                else:
+                    print("\n♻️  Nessun run interrotto da riprendere, avvio un nuovo run")
+
+            if not self.run_id:
+                result = supabase.table("sync_runs").insert({
+                    "competition_code": competition_code,
+                    "season": season,
+                    "mode": mode
+                }).execute()
+                self.run_id = result.data[0]["id"]
+        except Exception as e:
+            print(f"  ⚠️ Journal sync non disponibile ({e}), proseguo senza checkpoint")
+            self.run_id = None
+
+    def _load_checkpoints(self):
+        rows = fetch_all_rows(
+            lambda: self.supabase.table("sync_checkpoints")
+            .select("stage, unit_key, fetched_at, persisted_at")
+            .eq("run_id", self.run_id)
+            .order("id")
+        )
+        for row in rows:
+            self._units[(row["stage"], row["unit_key"])] = {
+                "fetched_at": row["fetched_at"],
+                "persisted_at": row["persisted_at"]
+            }
+
+    def last_completed(self, stage: str) -> Optional[datetime]:
+        """Ultimo completamento della fase in qualsiasi run della competizione (anche altre stagioni)."""
+        if not self.run_id:
+            return None
+        try:
+            result = self.supabase.table("sync_checkpoints")\
+                .select("persisted_at, sync_runs!inner(competition_code)")\
+                .eq("sync_runs.competition_code", self.competition_code)\
+                .eq("stage", stage)\
+                .eq("unit_key", "")\
+                .not_.is_("persisted_at", "null")\
+                .order("persisted_at", desc=True)\
+                .limit(1)\
+                .execute()
+        except Exception as e:
+            print(f"  ⚠️ Errore journal: {e}")
+            return None
+        if not result.data:
+            return None
+        completed = datetime.fromisoformat(result.data[0]["persisted_at"])
+        return completed if completed.tzinfo else completed.replace(tzinfo=timezone.utc)
+
+    def stage_done(self, stage: str) -> bool:
+        return bool(self._units.get((stage, ""), {}).get("persisted_at"))
+
+    def unit_done(self, stage: str, unit_key: str) -> bool:
+        return bool(self._units.get((stage, unit_key), {}).get("persisted_at"))
+
+    def set_window(self, date_from: Optional[str], date_to: Optional[str]):
+        """Salva la finestra partite del run, così la ripresa lavora sulle stesse partite."""
+        self.date_from, self.date_to = date_from, date_to
+        if self.run_id:
+            try:
+                self.supabase.table("sync_runs").update({
+                    "date_from": date_from,
+                    "date_to": date_to
+                }).eq("id", self.run_id).execute()
+            except Exception as e:
+                print(f"  ⚠️ Errore journal: {e}")
+
+    def _mark(self, stage: str, unit_keys: list, column: str):
+        now = datetime.now().isoformat()
+        with self._lock:
+            for key in unit_keys:
+                self._units.setdefault((stage, key), {"fetched_at": None, "persisted_at": None})[column] = now
+                self._dirty.add((stage, key))
+
+    def mark_fetched(self, stage: str, unit_keys: list):
+        self._mark(stage, unit_keys, "fetched_at")
+
+    def mark_persisted(self, stage: str, unit_keys: list):
+        self._mark(stage, unit_keys, "persisted_at")
+        if len(self._dirty) >= JOURNAL_FLUSH_SIZE:
+            self.flush()
+
+    def complete_stage(self, stage: str):
+        self._mark(stage, [""], "persisted_at")
+        self.flush()
+        self._touch()
+
+    def _touch(self):
+        """Aggiorna updated_at del run: è la "versione dati" che invalida la cache del server MCP."""
+        if not self.run_id:
+            return
+        try:
+            self.supabase.table("sync_runs").update({
+                "updated_at": datetime.now().isoformat()
+            }).eq("id", self.run_id).execute()
+        except Exception as e:
+            print(f"  ⚠️ Errore journal: {e}")
+
+    def flush(self):
+        """Scrive i checkpoint in sospeso con un solo upsert."""
+        with self._lock:
+            dirty, self._dirty = self._dirty, set()
+            rows = [{
+                "run_id": self.run_id,
+                "stage": stage,
+                "unit_key": key,
+                **self._units[(stage, key)]
+            } for stage, key in dirty]
+        if not rows or not self.run_id:
+            return
+        try:
+            self.supabase.table("sync_checkpoints").upsert(rows, on_conflict="run_id,stage,unit_key").execute()
+        except Exception as e:
+            print(f"  ⚠️ Errore salvando {len(rows)} checkpoint: {e}")
+
+    def finish(self, status: str = "COMPLETED"):
+        self.flush()
+        if not self.run_id:
+            return
+        now = datetime.now().isoformat()
+        try:
+            self.supabase.table("sync_runs").update({
+                "status": status,
+                "finished_at": now if status == "COMPLETED" else None,
+                "updated_at": now
+            }).eq("id", self.run_id).execute()
+        except Exception as e:
+            print(f"  ⚠️ Errore chiudendo il run: {e}")
+
+
+def api_request(endpoint: str, max_age: Optional[float] = None) -> dict:
+    """
+    Esegue una richiesta all'API football-data.org (passando dalla cache, se attiva).
+    max_age: età massima in secondi della risposta in cache (default: TTL dell'endpoint).
+    """
     if not FOOTBALL_API_KEY:
         print("❌ Errore: FOOTBALL_API_KEY deve essere impostato in .env")
         sys.exit(1)
 
+    cached = RESPONSE_CACHE.lookup(endpoint, max_age) if RESPONSE_CACHE else None
+    if cached and cached.fresh:
+        print(f"  💾 Cache: {endpoint}")
+        return cached.data
+
     url = f"{API_BASE}{endpoint}"
-    headers = {"X-Auth-Token": FOOTBALL_API_KEY}
+    headers = {"X-Auth-Token": FOOTBALL_API_KEY, **ResponseCache.conditional_headers(cached)}
 
     print(f"  📡 API: {endpoint}")
 
+    RATE_LIMITER.acquire_sync()
     response = requests.get(url, headers=headers)
+    RATE_LIMITER.update_from_headers(response.headers)
 
     if response.status_code == 429:
-        print("  ⏳ Rate limit raggiunto, attendo 60 secondi...")
-        time.sleep(60)
+        wait = RATE_LIMITER.on_rate_limited(response.headers)
+        print(f"  ⏳ Rate limit raggiunto, riprovo tra {wait}s...")
+        RATE_LIMITER.acquire_sync()
         response = requests.get(url, headers=headers)
+        RATE_LIMITER.update_from_headers(response.headers)
+
+    if response.status_code == 304 and cached:
+        RESPONSE_CACHE.touch(endpoint)
+        return cached.data
 
     if response.status_code != 200:
         print(f"  ❌ Errore API: {response.status_code} - {response.text[:200]}")
         return {}
 
-    time.sleep(RATE_LIMIT_DELAY)
-    return response.json()
+    data = response.json()
+    if RESPONSE_CACHE:
+        RESPONSE_CACHE.store(endpoint, data, response.headers)
+    return data
 
 
 async def api_request_async(session: aiohttp.ClientSession, endpoint: str) -> dict:
-    """Esegue una richiesta asincrona all'API football-data.org."""
+    """Esegue una richiesta asincrona all'API football-data.org (passando dalla cache, se attiva)."""
+    cached = RESPONSE_CACHE.lookup(endpoint) if RESPONSE_CACHE else None
+    if cached and cached.fresh:
+        return cached.data
+
     url = f"{API_BASE}{endpoint}"
-    headers = {"X-Auth-Token": FOOTBALL_API_KEY}
+    headers = {"X-Auth-Token": FOOTBALL_API_KEY, **ResponseCache.conditional_headers(cached)}
 
     try:
-        async with session.get(url, headers=headers) as response:
-            if response.status == 429:
-                # Rate limit - questo non dovrebbe mai accadere con batch corretti
-                print(f"  ⚠️ Rate limit su {endpoint}, riprovo...")
-                await asyncio.sleep(60)
-                async with session.get(url, headers=headers) as retry_response:
-                    if retry_response.status == 200:
-                        return await retry_response.json()
-                    return {}
+        for attempt in range(2):
+            await RATE_LIMITER.acquire()
+            async with session.get(url, headers=headers) as response:
+                RATE_LIMITER.update_from_headers(response.headers)
+
+                if response.status == 429 and attempt == 0:
+                    # Budget esaurito da un altro client: attendi il reset indicato dall'API
+                    wait = RATE_LIMITER.on_rate_limited(response.headers)
+                    print(f"  ⚠️ Rate limit su {endpoint}, riprovo tra {wait}s...")
+                    continue
+
+                if response.status == 304 and cached:
+                    RESPONSE_CACHE.touch(endpoint)
+                    return cached.data
 
-            if response.status != 200:
-                return {}
+                if response.status != 200:
+                    return {}
 
-            return await response.json()
+                data = await response.json()
+                if RESPONSE_CACHE:
+                    RESPONSE_CACHE.store(endpoint, data, response.headers)
+                return data
+        return {}
     except Exception as e:
         print(f"  ⚠️ Errore async {endpoint}: {e}")
         return {}
@@ -137,64 +718,144 @@ async def api_request_async(session: aiohttp.ClientSession, endpoint: str) -> di
 
 async def api_request_batch(endpoints: list, description: str = "richieste") -> list:
     """
-    Esegue un batch di richieste in parallelo rispettando il rate limit.
-    Divide le richieste in batch da PARALLEL_BATCH_SIZE con pause tra batch.
+    Esegue un elenco di richieste in parallelo rispettando il rate limit.
+    Fino a MAX_CONCURRENT_REQUESTS richieste in volo; ognuna parte appena RATE_LIMITER
+    ha budget. Ritorna i risultati nello stesso ordine degli endpoint.
     """
-    all_results = []
     total_endpoints = len(endpoints)
-    total_batches = (total_endpoints + PARALLEL_BATCH_SIZE - 1) // PARALLEL_BATCH_SIZE
-    successful = 0
-    failed = 0
+    if not total_endpoints:
+        return []
 
     print(f"\n  {'='*50}")
-    print(f"  🚀 PARALLELIZZAZIONE: {total_endpoints} {description}")
-    print(f"  📦 {total_batches} batch da {PARALLEL_BATCH_SIZE} richieste")
-    print(f"  ⏱️  Tempo stimato: ~{total_batches * PARALLEL_BATCH_DELAY // 60} min")
+    print(f"  🚀 {job_label()}PARALLELIZZAZIONE: {total_endpoints} {description}")
+    print(f"  ⏱️  Tempo stimato: ~{total_endpoints / API_REQUESTS_PER_MINUTE:.1f} min")
     print(f"  {'='*50}")
 
     start_total = time.time()
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+    done = 0
 
     async with aiohttp.ClientSession() as session:
-        for i in range(0, len(endpoints), PARALLEL_BATCH_SIZE):
-            batch = endpoints[i:i+PARALLEL_BATCH_SIZE]
-            batch_num = i // PARALLEL_BATCH_SIZE + 1
-            batch_start = time.time()
-
-            print(f"\n  📡 Batch {batch_num}/{total_batches}: {len(batch)} richieste in parallelo...")
-
-            # Esegui batch in parallelo
-            tasks = [api_request_async(session, endpoint) for endpoint in batch]
-            results = await asyncio.gather(*tasks)
-            all_results.extend(results)
-
-            # Conta successi/fallimenti
-            batch_success = sum(1 for r in results if r)
-            batch_failed = len(batch) - batch_success
-            successful += batch_success
-            failed += batch_failed
-
-            batch_time = time.time() - batch_start
-            print(f"  ✅ Batch {batch_num} completato in {batch_time:.1f}s - Successi: {batch_success}/{len(batch)}")
-
-            # Pausa tra batch per rispettare rate limit (solo se ci sono altri batch)
-            if i + PARALLEL_BATCH_SIZE < len(endpoints):
-                remaining = total_batches - batch_num
+        async def fetch(endpoint: str) -> dict:
+            nonlocal done
+            async with semaphore:
+                result = await api_request_async(session, endpoint)
+            done += 1
+            if done % API_REQUESTS_PER_MINUTE == 0 and done < total_endpoints:
                 elapsed = time.time() - start_total
-                eta = (elapsed / batch_num) * remaining
-                print(f"  ⏳ Pausa {PARALLEL_BATCH_DELAY}s per rate limit... (ETA: {eta/60:.1f} min)")
-                await asyncio.sleep(PARALLEL_BATCH_DELAY)
+                eta = elapsed / done * (total_endpoints - done)
+                print(f"  📡 {job_label()}{done}/{total_endpoints} completate (ETA: {eta/60:.1f} min)")
+            return result
+
+        all_results = await asyncio.gather(*(fetch(endpoint) for endpoint in endpoints))
+
+    successful = sum(1 for r in all_results if r)
+    failed = total_endpoints - successful
 
     # Riepilogo finale
     total_time = time.time() - start_total
     print(f"\n  {'='*50}")
-    print(f"  🏁 PARALLELIZZAZIONE COMPLETATA")
+    print(f"  🏁 {job_label()}PARALLELIZZAZIONE COMPLETATA")
     print(f"  ⏱️  Tempo totale: {total_time/60:.1f} min")
     print(f"  ✅ Successi: {successful}/{total_endpoints} ({successful*100//total_endpoints}%)")
     if failed > 0:
         print(f"  ❌ Falliti: {failed}")
     print(f"  {'='*50}\n")
 
-    return all_results
+    return list(all_results)
+
+
+async def api_fetch_pipeline(items: list, process_batch, description: str = "richieste", batch_size: int = 1, on_fetched=None) -> list:
+    """
+    Pipeline produttore/consumatore per sincronizzazioni grandi.
+    I payload scaricati finiscono in una coda limitata a PIPELINE_QUEUE_SIZE e
+    DB_WRITER_WORKERS writer li salvano appena arrivano: le scritture su Supabase si
+    sovrappongono alle attese del rate limit e la memoria non cresce con la stagione.
+
+    Args:
+        items: Lista di (endpoint, context)
+        process_batch: Coroutine che riceve una lista di (data, context) e la salva
+        batch_size: Payload massimi passati a process_batch in una volta
+        on_fetched: Callback opzionale (endpoint) chiamata per ogni payload scaricato
+
+    Returns:
+        Lista dei valori restituiti da process_batch (in ordine di completamento)
+    """
+    total_items = len(items)
+    if not total_items:
+        return []
+
+    print(f"\n  {'='*50}")
+    print(f"  🚀 {job_label()}PIPELINE: {total_items} {description}")
+    print(f"  ⏱️  Tempo stimato: ~{total_items / API_REQUESTS_PER_MINUTE:.1f} min")
+    print(f"  {'='*50}")
+
+    start_total = time.time()
+    pending = deque(items)
+    queue = asyncio.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+    outcomes = []
+    fetched = 0
+    failed = 0
+
+    async def fetcher(session: aiohttp.ClientSession):
+        nonlocal fetched, failed
+        while pending:
+            endpoint, context = pending.popleft()
+            data = await api_request_async(session, endpoint)
+            fetched += 1
+            if not data:
+                failed += 1
+            elif on_fetched:
+                on_fetched(endpoint)
+            if fetched % API_REQUESTS_PER_MINUTE == 0 and fetched < total_items:
+                elapsed = time.time() - start_total
+                eta = elapsed / fetched * (total_items - fetched)
+                print(f"  📡 {job_label()}{fetched}/{total_items} scaricate, {queue.qsize()} in coda (ETA: {eta/60:.1f} min)")
+            # Attende se i writer sono indietro: la coda piena rallenta i fetcher
+            await queue.put((data, context))
+
+    async def writer():
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+            batch = [item]
+            stop = False
+            while len(batch) < batch_size:
+                try:
+                    item = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+            try:
+                outcomes.append(await process_batch(batch))
+            except Exception as e:
+                print(f"  ❌ Errore salvando {len(batch)} {description}: {e}")
+            if stop:
+                return
+
+    async with aiohttp.ClientSession() as session:
+        writers = [asyncio.create_task(writer()) for _ in range(DB_WRITER_WORKERS)]
+        await asyncio.gather(*(fetcher(session) for _ in range(min(MAX_CONCURRENT_REQUESTS, total_items))))
+        for _ in writers:
+            await queue.put(None)
+        await asyncio.gather(*writers)
+
+    # Riepilogo finale
+    total_time = time.time() - start_total
+    successful = fetched - failed
+    print(f"\n  {'='*50}")
+    print(f"  🏁 {job_label()}PIPELINE COMPLETATA")
+    print(f"  ⏱️  Tempo totale: {total_time/60:.1f} min")
+    print(f"  ✅ Successi: {successful}/{total_items} ({successful*100//total_items}%)")
+    if failed > 0:
+        print(f"  ❌ Falliti: {failed}")
+    print(f"  {'='*50}\n")
+
+    return outcomes
 
 
 def get_last_match_date(supabase: Client, competition_code: str, season: str) -> Optional[str]:
@@ -300,10 +961,9 @@ def sync_competition(supabase: Client, competition_code: str) -> str:
             "updated_at": datetime.now().isoformat()
         }, on_conflict="code").execute()
 
-        # Recupera l'ID interno
-        query = supabase.table("competitions").select("id").eq("code", competition_code).execute()
-        if query.data:
-            competition_id = query.data[0]["id"]
+        # L'ID interno è già nella risposta dell'upsert
+        if result.data:
+            competition_id = result.data[0]["id"]
             print(f"  ✅ Competizione {comp_info['name']} ({competition_code}) sincronizzata")
             return competition_id
 
@@ -312,81 +972,65 @@ def sync_competition(supabase: Client, competition_code: str) -> str:
         sys.exit(1)
 
 
-def sync_teams(supabase: Client, competition_code: str, season: str) -> dict:
-    """Sincronizza le squadre della competizione."""
+def sync_teams(supabase: Client, competition_code: str, season: str, max_age: Optional[float] = None) -> dict:
+    """
+    Sincronizza le squadre della competizione.
+    max_age: se indicato, riusa la lista squadre in cache fino a questa età (secondi).
+    """
     print("\n📋 Sincronizzazione squadre...")
 
     # Determina l'anno per l'API (es. "2024-2025" -> 2024)
     api_season = season.split("-")[0]
 
-    data = api_request(f"/competitions/{competition_code}/teams?season={api_season}")
+    data = api_request(f"/competitions/{competition_code}/teams?season={api_season}", max_age=max_age)
 
     if not data.get("teams"):
         print("  ⚠️ Nessuna squadra trovata")
         return {}
 
-    team_map = {}  # external_id -> internal_id
-
-    for team in data["teams"]:
-        try:
-            result = supabase.table("teams").upsert({
-                "external_id": team["id"],
-                "name": team["name"],
-                "short_name": team.get("shortName"),
-                "tla": team.get("tla"),
-                "crest_url": team.get("crest"),
-                "stadium": team.get("venue"),
-                "updated_at": datetime.now().isoformat()
-            }, on_conflict="external_id").execute()
+    now = datetime.now().isoformat()
+    rows = [{
+        "external_id": team["id"],
+        "name": team["name"],
+        "short_name": team.get("shortName"),
+        "tla": team.get("tla"),
+        "crest_url": team.get("crest"),
+        "stadium": team.get("venue"),
+        "updated_at": now
+    } for team in data["teams"]]
 
-            # Recupera l'ID interno
-            query = supabase.table("teams").select("id").eq("external_id", team["id"]).execute()
-            if query.data:
-                team_map[team["id"]] = query.data[0]["id"]
-
-        except Exception as e:
-            print(f"  ❌ Errore salvando {team['name']}: {e}")
+    team_map = upsert_returning_ids(supabase, "teams", rows)  # external_id -> internal_id
 
     print(f"  ✅ Sincronizzate {len(team_map)} squadre")
     return team_map
 
 
-def process_team_players(supabase: Client, data: dict, internal_team_id: str) -> dict:
-    """Processa i giocatori di una singola squadra. Ritorna dict external_id -> internal_id."""
-    player_map = {}
-
-    if not data or not data.get("squad"):
-        return player_map
-
-    for player in data["squad"]:
-        try:
-            position = player.get("position", "")
-
-            supabase.table("players").upsert({
-                "external_id": player["id"],
-                "name": player["name"],
-                "first_name": player.get("firstName"),
-                "last_name": player.get("lastName"),
-                "date_of_birth": player.get("dateOfBirth"),
-                "nationality": player.get("nationality"),
-                "position": position,
-                "shirt_number": player.get("shirtNumber"),
-                "current_team_id": internal_team_id,
-                "updated_at": datetime.now().isoformat()
-            }, on_conflict="external_id").execute()
+def build_player_row(player: dict, internal_team_id: str, now: str) -> dict:
+    """Riga players da un giocatore della rosa (/teams/{id}) o da /persons/{id}."""
+    return {
+        "external_id": player["id"],
+        "name": player["name"],
+        "first_name": player.get("firstName"),
+        "last_name": player.get("lastName"),
+        "date_of_birth": player.get("dateOfBirth"),
+        "nationality": player.get("nationality"),
+        "position": player.get("position") or "",
+        "shirt_number": player.get("shirtNumber"),
+        "current_team_id": internal_team_id,
+        "updated_at": now
+    }
 
-            # Recupera l'ID interno
-            query = supabase.table("players").select("id").eq("external_id", player["id"]).execute()
-            if query.data:
-                player_map[player["id"]] = query.data[0]["id"]
 
-        except Exception:
-            pass
+def build_team_player_rows(data: dict, internal_team_id: str) -> list:
+    """Costruisce le righe players della rosa di una squadra (nessuna scrittura su DB)."""
+    if not data or not data.get("squad"):
+        return []
 
-    return player_map
+    now = datetime.now().isoformat()
+    return [build_player_row(player, internal_team_id, now) for player in data["squad"]]
 
 
-def sync_players(supabase: Client, team_map: dict) -> dict:
+async def sync_players(supabase: Client, team_map: dict) -> dict:
     """
     Sincronizza i giocatori di tutte le squadre.
     USA PARALLELIZZAZIONE per velocizzare il sync.
@@ -404,49 +1048,93 @@ def sync_players(supabase: Client, team_map: dict) -> dict:
     endpoints = [f"/teams/{ext_id}" for ext_id, _ in team_items]
 
     # Esegui tutte le chiamate in parallelo
-    all_results = asyncio.run(api_request_batch(endpoints, description="rose squadre"))
+    all_results = await api_request_batch(endpoints, description="rose squadre")
 
-    # Processa i risultati
+    # Processa i risultati: tutte le rose in un unico upsert a blocchi
     print(f"  💾 Processando giocatori...")
-    player_map = {}
-    total = 0
-
+    rows = []
     for (external_team_id, internal_team_id), data in zip(team_items, all_results):
-        team_player_map = process_team_players(supabase, data, internal_team_id)
-        player_map.update(team_player_map)
-        total += len(team_player_map)
+        rows.extend(build_team_player_rows(data, internal_team_id))
+
+    player_map = await asyncio.to_thread(upsert_returning_ids, supabase, "players", rows)
 
-    print(f"  ✅ Sincronizzati {total} giocatori")
+    print(f"  ✅ Sincronizzati {len(player_map)} giocatori")
     return player_map
 
 
-def sync_referees(supabase: Client, matches_data: list) -> dict:
-    """Sincronizza gli arbitri dalle partite."""
-    print("\n🎯 Sincronizzazione arbitri...")
+def collect_unknown_players(data: dict, team_map: dict, player_map: dict) -> dict:
+    """
+    Giocatori di un dettaglio partita assenti da player_map (es. acquistati dopo l'ultimo
+    refresh delle rose). Ritorna external_id -> internal_id della squadra in cui compaiono.
+    """
+    unknown = {}
+    if not data:
+        return unknown
 
-    referee_map = {}  # external_id -> internal_id
-    seen = set()
+    def add(player: dict, team: dict):
+        player_id = (player or {}).get("id")
+        team_int_id = team_map.get((team or {}).get("id"))
+        if player_id and team_int_id and player_id not in player_map:
+            unknown[player_id] = team_int_id
 
-    for match in matches_data:
-        for referee in match.get("referees", []):
-            if referee["id"] in seen:
-                continue
-            seen.add(referee["id"])
+    for team_key in ("homeTeam", "awayTeam"):
+        team_data = data.get(team_key, {})
+        for player in team_data.get("lineup", []) + team_data.get("bench", []):
+            add(player, team_data)
+    for goal in data.get("goals") or []:
+        add(goal.get("scorer"), goal.get("team"))
+    for booking in data.get("bookings") or []:
+        add(booking.get("player"), booking.get("team"))
+    for sub in data.get("substitutions") or []:
+        add(sub.get("playerOut"), sub.get("team"))
+        add(sub.get("playerIn"), sub.get("team"))
+    return unknown
+
+
+async def sync_unknown_players(supabase: Client, unknown: dict, team_map: dict, player_map: dict):
+    """
+    Risolve i giocatori sconosciuti e aggiorna player_map.
+    Prima per external_id nel DB: giocatori già salvati ma con la squadra attuale fuori da
+    team_map (prestiti, trasferimenti) non vengono caricati da load_player_map e non vanno
+    né riscaricati né riscritti. Solo quelli mai visti passano da /persons/{id}.
+    unknown: external_id -> internal_id della squadra in cui compaiono nella partita.
+    """
+    known = await asyncio.to_thread(load_players_by_external_id, supabase, list(unknown))
+    player_map.update(known)
 
-            try:
-                result = supabase.table("referees").upsert({
-                    "external_id": referee["id"],
-                    "name": referee["name"],
-                    "nationality": referee.get("nationality"),
-                    "updated_at": datetime.now().isoformat()
-                }, on_conflict="external_id").execute()
+    external_ids = [ext_id for ext_id in unknown if ext_id not in known]
+    if not external_ids:
+        return
+    results = await api_request_batch([f"/persons/{ext_id}" for ext_id in external_ids], description="giocatori non in rosa")
 
-                query = supabase.table("referees").select("id").eq("external_id", referee["id"]).execute()
-                if query.data:
-                    referee_map[referee["id"]] = query.data[0]["id"]
+    now = datetime.now().isoformat()
+    rows = []
+    for ext_id, data in zip(external_ids, results):
+        if not data or not data.get("id"):
+            continue
+        # Squadra attuale solo se è della competizione: la squadra della partita può essere
+        # quella vecchia (giocatore poi trasferito)
+        team_int_id = team_map.get((data.get("currentTeam") or {}).get("id"))
+        rows.append(build_player_row(data, team_int_id, now))
 
-            except Exception as e:
-                print(f"  ❌ Errore salvando arbitro {referee.get('name')}: {e}")
+    if rows:
+        player_map.update(await asyncio.to_thread(upsert_returning_ids, supabase, "players", rows))
+        print(f"  👤 Aggiunti {len(rows)} giocatori non presenti nelle rose")
+
+
+def sync_referees(supabase: Client, matches_data: list) -> dict:
+    """Sincronizza gli arbitri dalle partite."""
+    print("\n🎯 Sincronizzazione arbitri...")
+
+    now = datetime.now().isoformat()
+    rows = [{
+        "external_id": referee["id"],
+        "name": referee["name"],
+        "nationality": referee.get("nationality"),
+        "updated_at": now
+    } for match in matches_data for referee in match.get("referees", [])]
+
+    referee_map = upsert_returning_ids(supabase, "referees", rows)  # external_id -> internal_id
 
     print(f"  ✅ Sincronizzati {len(referee_map)} arbitri")
     return referee_map
@@ -475,286 +1163,361 @@ def sync_matches(supabase: Client, competition_code: str, competition_id: str, s
         return []
 
     print(f"  📊 {len(matches)} partite da sincronizzare")
-    match_ids = []  # Lista di (external_id, internal_id)
+    now = datetime.now().isoformat()
+    rows = []
 
     for match in matches:
-        try:
-            # Trova gli ID interni
-            home_team_id = team_map.get(match["homeTeam"]["id"])
-            away_team_id = team_map.get(match["awayTeam"]["id"])
-
-            referee_id = None
-            var_referee_id = None
-            for ref in match.get("referees", []):
-                ref_type = ref.get("type", "")
-                ref_int_id = referee_map.get(ref["id"])
-                if ref_type == "REFEREE":
-                    referee_id = ref_int_id
-                elif ref_type == "VIDEO_ASSISTANT_REFEREE_N1":
-                    var_referee_id = ref_int_id
-
-            score = match.get("score", {})
-            full_time = score.get("fullTime", {})
-            half_time = score.get("halfTime", {})
-
-            result = supabase.table("matches").upsert({
-                "external_id": match["id"],
-                "competition_id": competition_id,
-                "season": season,
-                "matchday": match.get("matchday"),
-                "match_date": match["utcDate"],
-                "status": match["status"],
-                "home_team_id": home_team_id,
-                "away_team_id": away_team_id,
-                "home_score": full_time.get("home"),
-                "away_score": full_time.get("away"),
-                "home_score_halftime": half_time.get("home"),
-                "away_score_halftime": half_time.get("away"),
-                "winner": score.get("winner"),
-                "referee_id": referee_id,
-                "var_referee_id": var_referee_id,
-                "updated_at": datetime.now().isoformat()
-            }, on_conflict="external_id").execute()
-
-            # Recupera l'ID interno
-            query = supabase.table("matches").select("id").eq("external_id", match["id"]).execute()
-            if query.data:
-                match_ids.append((match["id"], query.data[0]["id"]))
-
-        except Exception as e:
-            print(f"  ❌ Errore salvando partita {match['id']}: {e}")
+        # Trova gli ID interni
+        home_team_id = team_map.get(match["homeTeam"]["id"])
+        away_team_id = team_map.get(match["awayTeam"]["id"])
+
+        referee_id = None
+        var_referee_id = None
+        for ref in match.get("referees", []):
+            ref_type = ref.get("type", "")
+            ref_int_id = referee_map.get(ref["id"])
+            if ref_type == "REFEREE":
+                referee_id = ref_int_id
+            elif ref_type == "VIDEO_ASSISTANT_REFEREE_N1":
+                var_referee_id = ref_int_id
+
+        score = match.get("score", {})
+        full_time = score.get("fullTime", {})
+        half_time = score.get("halfTime", {})
+
+        rows.append({
+            "external_id": match["id"],
+            "competition_id": competition_id,
+            "season": season,
+            "matchday": match.get("matchday"),
+            "match_date": match["utcDate"],
+            "status": match["status"],
+            "home_team_id": home_team_id,
+            "away_team_id": away_team_id,
+            "home_score": full_time.get("home"),
+            "away_score": full_time.get("away"),
+            "home_score_halftime": half_time.get("home"),
+            "away_score_halftime": half_time.get("away"),
+            "winner": score.get("winner"),
+            "referee_id": referee_id,
+            "var_referee_id": var_referee_id,
+            "updated_at": now
+        })
+
+    id_map = upsert_returning_ids(supabase, "matches", rows)
+
+    # Lista di (external_id, internal_id), nell'ordine restituito dall'API
+    match_ids = [(match["id"], id_map[match["id"]]) for match in matches if match["id"] in id_map]
 
     print(f"  ✅ Sincronizzate {len(match_ids)} partite")
     return match_ids
 
 
-def process_match_detail(supabase: Client, data: dict, internal_id: str, team_map: dict, player_map: dict) -> tuple:
-    """Processa i dettagli di una singola partita e salva nel DB. Ritorna (events, lineups, stats)."""
-    total_events = 0
-    total_lineups = 0
-    total_stats = 0
+def build_match_detail_rows(data: dict, internal_id: str, team_map: dict, player_map: dict) -> tuple:
+    """
+    Costruisce in memoria le righe di una partita per lineups, match_events e match_statistics.
+    I minuti delle sostituzioni sono già inclusi nelle righe formazione. Ritorna (lineups, events, stats).
+    """
+    lineups = {}
+    events = []
+    stats = []
 
     if not data:
-        return (0, 0, 0)
+        return ([], [], [])
+
+    # --- SOSTITUZIONI (minuti entrata/uscita per giocatore) ---
+    subbed_in = {}
+    subbed_out = {}
+    for sub in data.get("substitutions") or []:
+        minute = sub.get("minute") or 90  # L'API manda anche "minute": null
+        player_out_id = player_map.get((sub.get("playerOut") or {}).get("id"))
+        player_in_id = player_map.get((sub.get("playerIn") or {}).get("id"))
+        if player_out_id:
+            subbed_out[player_out_id] = minute
+        if player_in_id:
+            subbed_in[player_in_id] = minute
+
+        team_int_id = team_map.get((sub.get("team") or {}).get("id"))
+        if player_out_id and player_in_id and team_int_id:
+            events.append({
+                "match_id": internal_id,
+                "team_id": team_int_id,
+                "player_id": player_out_id,
+                "player_in_id": player_in_id,
+                "event_type": "SUBSTITUTION",
+                "minute": minute,
+                "detail": None
+            })
 
     # --- FORMAZIONI ---
     if data.get("homeTeam", {}).get("lineup"):
-        for lineup_data in [(data["homeTeam"], True), (data["awayTeam"], True)]:
-            team_data, is_home = lineup_data
-            team_ext_id = team_data["id"]
-            team_int_id = team_map.get(team_ext_id)
-
+        for team_key in ("homeTeam", "awayTeam"):
+            team_data = data.get(team_key, {})
+            team_int_id = team_map.get(team_data.get("id"))
             if not team_int_id:
                 continue
 
-            # Titolari
-            for player in team_data.get("lineup", []):
-                player_int_id = player_map.get(player["id"])
-                if not player_int_id:
-                    continue
-                try:
-                    supabase.table("lineups").upsert({
+            for players, is_starter in ((team_data.get("lineup", []), True), (team_data.get("bench", []), False)):
+                for player in players:
+                    player_int_id = player_map.get(player["id"])
+                    if not player_int_id:
+                        continue
+
+                    minute_in = subbed_in.get(player_int_id)
+                    minute_out = subbed_out.get(player_int_id)
+                    if minute_in is not None and minute_out is not None:
+                        minutes_played = max(0, minute_out - minute_in)
+                    elif minute_in is not None:
+                        minutes_played = max(0, 90 - minute_in)
+                    else:
+                        minutes_played = minute_out
+
+                    # Chiave (match_id, player_id): un upsert in blocco non può toccare due volte la stessa riga
+                    lineups[player_int_id] = {
                         "match_id": internal_id,
                         "team_id": team_int_id,
                         "player_id": player_int_id,
-                        "is_starter": True,
-                        "is_substitute": False,
+                        "is_starter": is_starter,
+                        "is_substitute": not is_starter,
                         "shirt_number": player.get("shirtNumber"),
-                        "position": player.get("position")
-                    }, on_conflict="match_id,player_id").execute()
-                    total_lineups += 1
-                except:
-                    pass
-
-            # Panchina
-            for player in team_data.get("bench", []):
-                player_int_id = player_map.get(player["id"])
-                if not player_int_id:
-                    continue
-                try:
-                    supabase.table("lineups").upsert({
-                        "match_id": internal_id,
-                        "team_id": team_int_id,
-                        "player_id": player_int_id,
-                        "is_starter": False,
-                        "is_substitute": True,
-                        "shirt_number": player.get("shirtNumber"),
-                        "position": player.get("position")
-                    }, on_conflict="match_id,player_id").execute()
-                    total_lineups += 1
-                except:
-                    pass
+                        "position": player.get("position"),
+                        "subbed_in_minute": minute_in,
+                        "subbed_out_minute": minute_out,
+                        "minutes_played": minutes_played
+                    }
 
     # --- EVENTI (GOL, CARTELLINI) ---
-    if data.get("goals"):
-        for goal in data["goals"]:
-            player_int_id = player_map.get(goal.get("scorer", {}).get("id"))
-            team_int_id = team_map.get(goal.get("team", {}).get("id"))
-            if player_int_id and team_int_id:
-                try:
-                    event_type = "OWN_GOAL" if goal.get("type") == "OWN" else "GOAL"
-                    if goal.get("type") == "PENALTY":
-                        event_type = "PENALTY"
-                    supabase.table("match_events").insert({
-                        "match_id": internal_id,
-                        "team_id": team_int_id,
-                        "player_id": player_int_id,
-                        "event_type": event_type,
-                        "minute": goal.get("minute"),
-                        "detail": goal.get("type")
-                    }).execute()
-                    total_events += 1
-                except:
-                    pass
-
-    if data.get("bookings"):
-        for booking in data["bookings"]:
-            player_int_id = player_map.get(booking.get("player", {}).get("id"))
-            team_int_id = team_map.get(booking.get("team", {}).get("id"))
-            if player_int_id and team_int_id:
-                try:
-                    card_type = "YELLOW_CARD" if booking.get("card") == "YELLOW" else "RED_CARD"
-                    supabase.table("match_events").insert({
-                        "match_id": internal_id,
-                        "team_id": team_int_id,
-                        "player_id": player_int_id,
-                        "event_type": card_type,
-                        "minute": booking.get("minute"),
-                        "detail": booking.get("card")
-                    }).execute()
-                    total_events += 1
-                except:
-                    pass
+    for goal in data.get("goals") or []:
+        player_int_id = player_map.get((goal.get("scorer") or {}).get("id"))
+        team_int_id = team_map.get((goal.get("team") or {}).get("id"))
+        if player_int_id and team_int_id:
+            event_type = "OWN_GOAL" if goal.get("type") == "OWN" else "GOAL"
+            if goal.get("type") == "PENALTY":
+                event_type = "PENALTY"
+            events.append({
+                "match_id": internal_id,
+                "team_id": team_int_id,
+                "player_id": player_int_id,
+                "player_in_id": None,
+                "event_type": event_type,
+                "minute": goal.get("minute"),
+                "detail": goal.get("type")
+            })
+
+    for booking in data.get("bookings") or []:
+        player_int_id = player_map.get((booking.get("player") or {}).get("id"))
+        team_int_id = team_map.get((booking.get("team") or {}).get("id"))
+        if player_int_id and team_int_id:
+            card_type = "YELLOW_CARD" if booking.get("card") == "YELLOW" else "RED_CARD"
+            events.append({
+                "match_id": internal_id,
+                "team_id": team_int_id,
+                "player_id": player_int_id,
+                "player_in_id": None,
+                "event_type": card_type,
+                "minute": booking.get("minute"),
+                "detail": booking.get("card")
+            })
 
     # --- STATISTICHE PARTITA (Statistics Add-On) ---
-    for team_key, is_home in [('homeTeam', True), ('awayTeam', False)]:
+    for team_key in ("homeTeam", "awayTeam"):
         team_data = data.get(team_key, {})
-        match_stats = team_data.get('statistics', {})
-        if match_stats:
-            team_ext_id = team_data.get('id')
-            team_int_id = team_map.get(team_ext_id)
-            if team_int_id:
-                try:
-                    supabase.table("match_statistics").upsert({
-                        "match_id": internal_id,
-                        "team_id": team_int_id,
-                        "ball_possession": match_stats.get("ball_possession"),
-                        "shots_on_goal": match_stats.get("shots_on_goal"),
-                        "shots_off_goal": match_stats.get("shots_off_goal"),
-                        "total_shots": match_stats.get("shots"),
-                        "corner_kicks": match_stats.get("corner_kicks"),
-                        "free_kicks": match_stats.get("free_kicks"),
-                        "goal_kicks": match_stats.get("goal_kicks"),
-                        "throw_ins": match_stats.get("throw_ins"),
-                        "saves": match_stats.get("saves"),
-                        "offsides": match_stats.get("offsides"),
-                        "fouls_committed": match_stats.get("fouls"),
-                        "yellow_cards": match_stats.get("yellow_cards"),
-                        "red_cards": match_stats.get("red_cards")
-                    }, on_conflict="match_id,team_id").execute()
-                    total_stats += 1
-                except:
-                    pass
+        match_stats = team_data.get("statistics", {})
+        team_int_id = team_map.get(team_data.get("id"))
+        if match_stats and team_int_id:
+            stats.append({
+                "match_id": internal_id,
+                "team_id": team_int_id,
+                "ball_possession": match_stats.get("ball_possession"),
+                "shots_on_goal": match_stats.get("shots_on_goal"),
+                "shots_off_goal": match_stats.get("shots_off_goal"),
+                "total_shots": match_stats.get("shots"),
+                "corner_kicks": match_stats.get("corner_kicks"),
+                "free_kicks": match_stats.get("free_kicks"),
+                "goal_kicks": match_stats.get("goal_kicks"),
+                "throw_ins": match_stats.get("throw_ins"),
+                "saves": match_stats.get("saves"),
+                "offsides": match_stats.get("offsides"),
+                "fouls_committed": match_stats.get("fouls"),
+                "yellow_cards": match_stats.get("yellow_cards"),
+                "red_cards": match_stats.get("red_cards")
+            })
+
+    return (list(lineups.values()), events, stats)
+
+
+def process_match_details_batch(supabase: Client, batch: list, team_map: dict, player_map: dict) -> tuple:
+    """
+    Salva i dettagli di un blocco di partite con una scrittura in blocco per tabella.
+    batch: lista di (data, internal_id). Ritorna (events, lineups, stats).
 
-    # --- SOSTITUZIONI (per calcolare minuti giocati) ---
-    if data.get("substitutions"):
-        for sub in data["substitutions"]:
-            minute = sub.get("minute", 90)
-            player_out_ext = sub.get("playerOut", {}).get("id")
-            player_in_ext = sub.get("playerIn", {}).get("id")
-
-            if player_out_ext:
-                player_out_id = player_map.get(player_out_ext)
-                if player_out_id:
-                    try:
-                        supabase.table("lineups").update({
-                            "subbed_out_minute": minute,
-                            "minutes_played": minute
-                        }).eq("match_id", internal_id).eq("player_id", player_out_id).execute()
-                    except:
-                        pass
-
-            if player_in_ext:
-                player_in_id = player_map.get(player_in_ext)
-                if player_in_id:
-                    try:
-                        minutes_in = max(0, 90 - minute)
-                        supabase.table("lineups").update({
-                            "subbed_in_minute": minute,
-                            "minutes_played": minutes_in
-                        }).eq("match_id", internal_id).eq("player_id", player_in_id).execute()
-                    except:
-                        pass
-
-            if player_out_ext and player_in_ext:
-                player_out_id = player_map.get(player_out_ext)
-                player_in_id = player_map.get(player_in_ext)
-                team_ext_id = sub.get("team", {}).get("id")
-                team_int_id = team_map.get(team_ext_id)
-                if player_out_id and player_in_id and team_int_id:
-                    try:
-                        supabase.table("match_events").insert({
-                            "match_id": internal_id,
-                            "team_id": team_int_id,
-                            "player_id": player_out_id,
-                            "player_in_id": player_in_id,
-                            "event_type": "SUBSTITUTION",
-                            "minute": minute
-                        }).execute()
-                        total_events += 1
-                    except:
-                        pass
-
-    return (total_events, total_lineups, total_stats)
-
-
-def sync_match_details(supabase: Client, match_ids: list, team_map: dict, player_map: dict):
+    Gli eventi non hanno una chiave naturale: quelli delle partite del blocco vengono
+    sostituiti in una sola transazione (replace_match_events), così rieseguire il sync non
+    crea duplicati e un errore non lascia le partite senza eventi.
+    Dopo la scrittura aggiorna match_card_summary per le stesse partite.
+    """
+    all_lineups, all_events, all_stats = [], [], []
+    match_ids = []
+    for data, internal_id in batch:
+        if not data:
+            continue
+        lineups, events, stats = build_match_detail_rows(data, internal_id, team_map, player_map)
+        all_lineups.extend(lineups)
+        all_events.extend(events)
+        all_stats.extend(stats)
+        match_ids.append(internal_id)
+
+    if not match_ids:
+        return (0, 0, 0)
+
+    for start in range(0, len(all_lineups), DB_BATCH_SIZE):
+        supabase.table("lineups").upsert(all_lineups[start:start + DB_BATCH_SIZE], on_conflict="match_id,player_id").execute()
+
+    # Cancellazione e reinserimento in una transazione (migration 018): un errore lascia gli eventi precedenti
+    supabase.rpc("replace_match_events", {"p_match_ids": match_ids, "p_events": all_events}).execute()
+
+    if all_stats:
+        supabase.table("match_statistics").upsert(all_stats, on_conflict="match_id,team_id").execute()
+
+    # Riepilogo per partita letto dalle viste arbitri/lega/squadre (migration 016).
+    # Un errore fa fallire il blocco: non viene segnato come salvato e la ripresa lo riscrive
+    supabase.rpc("refresh_match_card_summary", {"p_match_ids": match_ids}).execute()
+
+    return (len(all_events), len(all_lineups), len(all_stats))
+
+
+async def sync_match_details(supabase: Client, match_ids: list, team_map: dict, player_map: dict, journal: SyncJournal = None):
     """
     Sincronizza i dettagli delle partite (eventi, formazioni, statistiche).
-    USA PARALLELIZZAZIONE per velocizzare il sync.
+    USA PIPELINE fetch → DB: le partite scaricate vengono salvate a blocchi di
+    DB_WRITE_BATCH_SIZE (una scrittura per tabella per blocco).
+
+    Args:
+        journal: Se specificato, salta le partite già salvate e registra i checkpoint
     """
-    if not match_ids:
+    items = [(f"/matches/{ext_id}", internal_id) for ext_id, internal_id in match_ids]
+    if journal:
+        items = [(endpoint, internal_id) for endpoint, internal_id in items if not journal.unit_done("match_details", endpoint)]
+        if len(items) < len(match_ids):
+            print(f"\n♻️  {len(match_ids) - len(items)} partite già salvate nel run precedente")
+
+    if not items:
         print("\n📊 Nessuna partita da sincronizzare")
         return
 
-    total_matches = len(match_ids)
-    total_batches = (total_matches + PARALLEL_BATCH_SIZE - 1) // PARALLEL_BATCH_SIZE
-
     print(f"\n{'='*60}")
     print(f"📊 SYNC DETTAGLI PARTITE (eventi, formazioni, statistiche)")
     print(f"{'='*60}")
 
-    # Costruisci lista di endpoint
-    endpoints = [f"/matches/{ext_id}" for ext_id, _ in match_ids]
+    def write_details(batch: list) -> tuple:
+        counts = process_match_details_batch(
+            supabase, [(data, internal_id) for data, (_, internal_id) in batch], team_map, player_map
+        )
+        if journal:
+            journal.mark_persisted("match_details", [endpoint for data, (endpoint, _) in batch if data])
+        return counts
+
+    async def process_batch(batch: list) -> tuple:
+        # Giocatori delle partite non ancora in player_map: scaricati in blocco prima di salvare
+        unknown = {}
+        for data, _ in batch:
+            unknown.update(collect_unknown_players(data, team_map, player_map))
+        if unknown:
+            await sync_unknown_players(supabase, unknown, team_map, player_map)
+        # Il client Supabase è sincrono: la scrittura gira in un thread
+        return await asyncio.to_thread(write_details, batch)
+
+    on_fetched = (lambda endpoint: journal.mark_fetched("match_details", [endpoint])) if journal else None
+    items = [(endpoint, (endpoint, internal_id)) for endpoint, internal_id in items]
+    outcomes = await api_fetch_pipeline(
+        items, process_batch, description="dettagli partite", batch_size=DB_WRITE_BATCH_SIZE, on_fetched=on_fetched
+    )
 
-    # Esegui tutte le chiamate in parallelo
-    all_results = asyncio.run(api_request_batch(endpoints, description="dettagli partite"))
+    total_events = sum(o[0] for o in outcomes)
+    total_lineups = sum(o[1] for o in outcomes)
+    total_stats = sum(o[2] for o in outcomes)
 
-    # Processa i risultati
-    print(f"  💾 Processando risultati...")
-    total_events = 0
-    total_lineups = 0
-    total_stats = 0
+    print(f"  ✅ Sincronizzati {total_events} eventi, {total_lineups} formazioni, {total_stats} statistiche")
 
-    for (external_id, internal_id), data in zip(match_ids, all_results):
-        events, lineups, stats = process_match_detail(supabase, data, internal_id, team_map, player_map)
-        total_events += events
-        total_lineups += lineups
-        total_stats += stats
 
-    print(f"  ✅ Sincronizzati {total_events} eventi, {total_lineups} formazioni, {total_stats} statistiche")
+def save_player_stats_batch(supabase: Client, batch: list, season: str) -> tuple:
+    """
+    Salva un blocco di risposte /persons/{id}/matches in player_season_stats.
+    batch: lista di (data, (external_id, internal_id)). Ritorna (salvati, saltati).
+    """
+    valid = [(data["aggregations"], ids) for data, ids in batch if data and data.get("aggregations")]
+    skipped = len(batch) - len(valid)
+    if not valid:
+        return (0, skipped)
+
+    # Team corrente di tutti i giocatori del blocco in una sola query
+    internal_ids = [internal_id for _, (_, internal_id) in valid]
+    teams_query = supabase.table("players").select("id, current_team_id").in_("id", internal_ids).execute()
+    team_by_player = {row["id"]: row["current_team_id"] for row in teams_query.data or []}
+
+    now = datetime.now().isoformat()
+    rows = []
+    for agg, (external_id, internal_id) in valid:
+        # Calcola rossi totali (rossi diretti + doppi gialli)
+        red_cards = agg.get("redCards", 0) + agg.get("yellowRedCards", 0)
+
+        rows.append({
+            "player_id": internal_id,
+            "team_id": team_by_player.get(internal_id),
+            "season": season,
+            "matches_played": agg.get("matchesOnPitch", 0),
+            "matches_started": agg.get("startingXI", 0),
+            "minutes_played": agg.get("minutesPlayed", 0),
+            "goals": agg.get("goals", 0),
+            "assists": agg.get("assists", 0),
+            "yellow_cards": agg.get("yellowCards", 0),
+            "red_cards": red_cards,
+            "updated_at": now
+        })
+
+    try:
+        supabase.table("player_season_stats").upsert(rows, on_conflict="player_id,season").execute()
+    except Exception as e:
+        print(f"    ⚠️ Errore salvando {len(rows)} giocatori: {e}")
+        return (0, len(batch))
+
+    return (len(rows), skipped)
 
 
-def sync_player_stats(supabase: Client, player_map: dict, competition_code: str, season: str, filter_player_ids: set = None):
+def derive_player_season_stats(supabase: Client, season: str, internal_ids: list) -> set:
     """
-    Sincronizza statistiche aggregate giocatori da API /persons/{id}/matches.
-    USA PARALLELIZZAZIONE per velocizzare il sync (batch di 25 richieste).
+    Calcola player_season_stats dai dati già nel DB (lineups + match_events) con la
+    funzione SQL refresh_player_season_stats (migration 007), in un'unica passata.
+    Ritorna gli internal_id NON derivabili, da sincronizzare con l'API /persons.
+    """
+    derived_ids = set()
+    for start in range(0, len(internal_ids), DB_BATCH_SIZE):
+        result = supabase.rpc("refresh_player_season_stats", {
+            "p_season": season,
+            "p_player_ids": internal_ids[start:start + DB_BATCH_SIZE]
+        }).execute()
+        derived_ids.update(row["player_id"] for row in result.data or [] if row["derived"])
+    return set(internal_ids) - derived_ids
+
 
-    NOTA: Chiama l'API SENZA filtro competizione per ottenere i totali stagionali.
-    Le statistiche per singola competizione sono calcolate dalle viste (player_season_cards).
+async def sync_player_stats(supabase: Client, player_map: dict, competition_code: str, season: str, filter_player_ids: set = None, journal: SyncJournal = None, source: str = "api"):
+    """
+    Sincronizza statistiche aggregate giocatori (player_season_stats).
+
+    source="api" (default): una chiamata /persons/{id}/matches per giocatore, SENZA filtro
+    competizione (totali stagionali di tutte le competizioni, anche quelle non sincronizzate).
+    source="derived" (opt-in): calcola le statistiche da formazioni ed eventi già salvati e
+    chiama /persons/{id}/matches solo per i giocatori non derivabili (nessuna presenza nelle
+    partite sincronizzate o dettagli partite mancanti). Conta SOLO le competizioni
+    sincronizzate: presenze in coppe/competizioni non sincronizzate non entrano nei totali,
+    e gli assist restano quelli dell'ultimo sync API.
+    Le chiamate API USANO PIPELINE fetch → DB (budget condiviso di RATE_LIMITER, salvataggio a blocchi).
+    Le statistiche per singola competizione sono in player_season_cards (ricalcolata a fine sync).
 
     Args:
         filter_player_ids: Se specificato, sincronizza solo questi external_id (modalità incrementale)
+        journal: Se specificato, salta i giocatori già salvati e registra i checkpoint
+        source: "api" (default) o "derived"
     """
     if filter_player_ids:
         player_items = [(ext_id, int_id) for ext_id, int_id in player_map.items() if ext_id in filter_player_ids]
@@ -773,137 +1536,140 @@ def sync_player_stats(supabase: Client, player_map: dict, competition_code: str,
     print(f"📊 SYNC STATISTICHE GIOCATORI - Modalità {mode}")
     print(f"{'='*60}")
 
-    # Costruisci lista di endpoint
-    endpoints = [f"/persons/{ext_id}/matches?season={api_season}&limit=100" for ext_id, _ in player_items]
+    if source == "derived":
+        try:
+            pending_ids = await asyncio.to_thread(
+                derive_player_season_stats, supabase, season, [int_id for _, int_id in player_items]
+            )
+        except Exception as e:
+            print(f"  ⚠️ Calcolo da DB non riuscito ({e}), uso l'API per tutti i giocatori")
+            pending_ids = {int_id for _, int_id in player_items}
+        derived = len(player_items) - len(pending_ids)
+        print(f"  🧮 {derived} giocatori calcolati da formazioni/eventi, {len(pending_ids)} da API")
+        player_items = [(ext_id, int_id) for ext_id, int_id in player_items if int_id in pending_ids]
+        if not player_items:
+            return derived
+    else:
+        derived = 0
+
+    items = [(f"/persons/{ext_id}/matches?season={api_season}&limit=100", (ext_id, int_id)) for ext_id, int_id in player_items]
+    if journal:
+        pending = [(endpoint, ids) for endpoint, ids in items if not journal.unit_done("player_stats", endpoint)]
+        if len(pending) < len(items):
+            print(f"  ♻️  {len(items) - len(pending)} giocatori già salvati nel run precedente")
+        items = pending
+        if not items:
+            return derived
+
+    endpoint_by_player = {ids: endpoint for endpoint, ids in items}
+
+    def write_stats(batch: list) -> tuple:
+        saved = save_player_stats_batch(supabase, batch, season)
+        if journal:
+            journal.mark_persisted("player_stats", [endpoint_by_player[ids] for data, ids in batch if data])
+        return saved
+
+    async def process_batch(batch: list) -> tuple:
+        return await asyncio.to_thread(write_stats, batch)
+
+    on_fetched = (lambda endpoint: journal.mark_fetched("player_stats", [endpoint])) if journal else None
+    outcomes = await api_fetch_pipeline(
+        items, process_batch, description="statistiche giocatori", batch_size=DB_WRITE_BATCH_SIZE, on_fetched=on_fetched
+    )
 
-    # Esegui tutte le chiamate in parallelo (con batch per rate limit)
-    all_results = asyncio.run(api_request_batch(endpoints, description="statistiche giocatori"))
+    total_synced = sum(o[0] for o in outcomes)
+    total_skipped = sum(o[1] for o in outcomes)
 
-    # Processa i risultati e salva nel database
-    print(f"  💾 Salvataggio risultati nel database...")
-    total_synced = 0
-    total_skipped = 0
+    print(f"  ✅ Sincronizzati {total_synced} giocatori da API, {total_skipped} saltati")
+    return derived + total_synced
 
-    for i, ((external_id, internal_id), data) in enumerate(zip(player_items, all_results)):
-        if not data:
-            total_skipped += 1
-            continue
 
-        agg = data.get("aggregations", {})
-        if not agg:
-            total_skipped += 1
-            continue
+def update_referee_stats(supabase: Client, referee_ids: list = None):
+    """
+    Aggiorna statistiche aggregate arbitri calcolandole dalle partite nel database.
+    L'API non fornisce statistiche arbitri, quindi le calcoliamo internamente con
+    la funzione SQL refresh_referee_stats (una sola chiamata, vedi migration 006).
 
-        try:
-            # Trova team_id corrente del giocatore
-            player_query = supabase.table("players").select("current_team_id").eq("id", internal_id).execute()
-            team_id = player_query.data[0]["current_team_id"] if player_query.data else None
-
-            # Calcola rossi totali (rossi diretti + doppi gialli)
-            red_cards = agg.get("redCards", 0) + agg.get("yellowRedCards", 0)
-
-            supabase.table("player_season_stats").upsert({
-                "player_id": internal_id,
-                "team_id": team_id,
-                "season": season,
-                "matches_played": agg.get("matchesOnPitch", 0),
-                "matches_started": agg.get("startingXI", 0),
-                "minutes_played": agg.get("minutesPlayed", 0),
-                "goals": agg.get("goals", 0),
-                "assists": agg.get("assists", 0),
-                "yellow_cards": agg.get("yellowCards", 0),
-                "red_cards": red_cards,
-                "updated_at": datetime.now().isoformat()
-            }, on_conflict="player_id,season").execute()
+    Args:
+        referee_ids: Arbitri da ricalcolare (quelli delle partite del run). None = tutti
+    """
+    print("\n🎯 Aggiornamento statistiche arbitri...")
 
-            total_synced += 1
+    if referee_ids is not None and not referee_ids:
+        print("  ⚠️ Nessun arbitro nelle partite sincronizzate")
+        return
 
-        except Exception as e:
-            print(f"    ⚠️ Errore giocatore {external_id}: {e}")
-            total_skipped += 1
+    try:
+        result = supabase.rpc("refresh_referee_stats", {
+            "p_referee_ids": list(referee_ids) if referee_ids is not None else None
+        }).execute()
+        print(f"  ✅ Aggiornati {result.data or 0} arbitri")
 
-    print(f"  ✅ Sincronizzati {total_synced} giocatori, {total_skipped} saltati")
-    return total_synced
+    except Exception as e:
+        print(f"  ❌ Errore aggiornamento arbitri: {e}")
 
 
-def update_referee_stats(supabase: Client):
+def refresh_referee_baselines(supabase: Client, competition_code: str, season: str):
     """
-    Aggiorna statistiche aggregate arbitri calcolandole dalle partite nel database.
-    L'API non fornisce statistiche arbitri, quindi le calcoliamo internamente.
+    Ricalcola le medie gialli per arbitro e per lega della partizione (stagione, competizione)
+    del run con la funzione SQL refresh_referee_season_baselines (migration 017).
+    Le analisi leggono referee_season_baselines per stagione invece di aggregare le partite.
     """
-    print("\n🎯 Aggiornamento statistiche arbitri...")
+    print("\n⚖️ Aggiornamento medie arbitri/lega per stagione...")
 
     try:
-        # Recupera tutti gli arbitri
-        referees = supabase.table("referees").select("id, external_id").execute()
-
-        if not referees.data:
-            print("  ⚠️ Nessun arbitro nel database")
-            return
+        result = supabase.rpc("refresh_referee_season_baselines", {
+            "p_season": season,
+            "p_competition_code": competition_code
+        }).execute()
+        print(f"  ✅ Aggiornati {result.data or 0} arbitri ({competition_code} {season})")
 
-        updated = 0
-        for ref in referees.data:
-            ref_id = ref["id"]
-
-            # Conta partite arbitrate
-            matches = supabase.table("matches")\
-                .select("id", count="exact")\
-                .eq("referee_id", ref_id)\
-                .eq("status", "FINISHED")\
-                .execute()
-            total_matches = matches.count or 0
+    except Exception as e:
+        print(f"  ❌ Errore aggiornamento medie arbitri: {e}")
 
-            if total_matches == 0:
-                continue
 
-            # Recupera statistiche cartellini dalle partite arbitrate
-            match_ids_query = supabase.table("matches")\
-                .select("id")\
-                .eq("referee_id", ref_id)\
-                .eq("status", "FINISHED")\
-                .execute()
+def refresh_season_cards(supabase: Client, competition_code: str, season: str):
+    """
+    Ricalcola le tabelle player_season_cards e player_season_cards_total per la sola
+    partizione (stagione, competizione) del run, con la funzione SQL
+    refresh_player_season_cards (migration 015). Le letture non vengono bloccate.
+    """
+    print("\n🧮 Aggiornamento cartellini per competizione...")
 
-            if not match_ids_query.data:
-                continue
+    try:
+        result = supabase.rpc("refresh_player_season_cards", {
+            "p_season": season,
+            "p_competition_code": competition_code
+        }).execute()
+        print(f"  ✅ Aggiornati {result.data or 0} giocatori ({competition_code} {season})")
 
-            match_ids = [m["id"] for m in match_ids_query.data]
+    except Exception as e:
+        print(f"  ❌ Errore aggiornamento cartellini: {e}")
 
-            # Conta cartellini totali da match_statistics
-            total_yellows = 0
-            total_reds = 0
-            total_fouls = 0
 
-            for match_id in match_ids:
-                stats = supabase.table("match_statistics")\
-                    .select("yellow_cards, red_cards, fouls_committed")\
-                    .eq("match_id", match_id)\
-                    .execute()
+def refresh_risk_features(supabase: Client, season: str, team_ids: list = None):
+    """
+    Ricalcola lo snapshot player_risk_features (gialli/90, minuti, ruolo, falli e possesso
+    squadra) letto dall'analisi, con la funzione SQL refresh_player_risk_features (migration 011).
 
-                for s in stats.data:
-                    total_yellows += s.get("yellow_cards") or 0
-                    total_reds += s.get("red_cards") or 0
-                    total_fouls += s.get("fouls_committed") or 0
-
-            # Calcola medie
-            avg_yellows = round(total_yellows / total_matches, 2) if total_matches > 0 else 0
-            avg_fouls = round(total_fouls / total_matches, 2) if total_matches > 0 else 0
-
-            # Aggiorna arbitro
-            supabase.table("referees").update({
-                "total_matches": total_matches,
-                "total_yellows": total_yellows,
-                "total_reds": total_reds,
-                "avg_yellows_per_match": avg_yellows,
-                "avg_fouls_per_match": avg_fouls,
-                "updated_at": datetime.now().isoformat()
-            }).eq("id", ref_id).execute()
+    Args:
+        team_ids: Squadre da ricalcolare (quelle della competizione). None = tutte
+    """
+    print("\n📸 Aggiornamento snapshot rischio giocatori...")
 
-            updated += 1
+    if team_ids is not None and not team_ids:
+        print("  ⚠️ Nessuna squadra da ricalcolare")
+        return
 
-        print(f"  ✅ Aggiornati {updated} arbitri")
+    try:
+        result = supabase.rpc("refresh_player_risk_features", {
+            "p_season": season,
+            "p_team_ids": list(team_ids) if team_ids is not None else None
+        }).execute()
+        print(f"  ✅ Aggiornati {result.data or 0} giocatori")
 
     except Exception as e:
-        print(f"  ❌ Errore aggiornamento arbitri: {e}")
+        print(f"  ❌ Errore aggiornamento snapshot: {e}")
 
 
 def verify_sync(supabase: Client, competition_code: str, season: str) -> dict:
@@ -1061,12 +1827,16 @@ def verify_sync(supabase: Client, competition_code: str, season: str) -> dict:
     return report
 
 
-def sync_season(competition_code: str, season: str, full_sync: bool = False, days: int = None, incremental: bool = False):
+async def sync_season(supabase: Client, competition_code: str, season: str, full_sync: bool = False, days: int = None, incremental: bool = False, resume: bool = False, player_stats_source: str = "api"):
     """
     Sincronizza tutti i dati per una stagione e competizione.
+    Coroutine: più stagioni/competizioni girano insieme in run_sync_jobs; le chiamate
+    Supabase (client sincrono) e le richieste sequenziali girano in asyncio.to_thread.
 
     Args:
         incremental: Se True, sincronizza dall'ultima partita nel DB fino a oggi
+        resume: Se True, riprende l'ultimo run interrotto (vedi SyncJournal)
+        player_stats_source: "api" (/persons per giocatore, default) o "derived" (da formazioni/eventi nel DB)
     """
     comp_name = COMPETITIONS.get(competition_code, {}).get('name', competition_code)
 
@@ -1074,19 +1844,58 @@ def sync_season(competition_code: str, season: str, full_sync: bool = False, day
     print(f"🏆 SINCRONIZZAZIONE {comp_name} {season}")
     print(f"{'='*60}")
 
-    supabase = get_supabase_client()
+    mode = "incremental" if incremental else "days" if days is not None else "full" if full_sync else "basic"
+    journal = await asyncio.to_thread(SyncJournal, supabase, competition_code, season, mode, resume)
+
+    try:
+        report = await _sync_season_stages(supabase, journal, competition_code, season, full_sync, days, incremental, player_stats_source)
+    except BaseException:
+        await asyncio.to_thread(journal.finish, "FAILED")
+        raise
+
+    if report is None:
+        await asyncio.to_thread(journal.finish, "FAILED")
+        return None
+
+    await asyncio.to_thread(journal.finish)
+
+    print(f"\n{'='*60}")
+    print(f"✅ SINCRONIZZAZIONE {comp_name} {season} COMPLETATA")
+    print(f"{'='*60}")
+
+    return report
+
+
+async def _sync_season_stages(supabase: Client, journal: SyncJournal, competition_code: str, season: str, full_sync: bool, days: Optional[int], incremental: bool, player_stats_source: str) -> Optional[dict]:
+    """Fasi di sync_season; ogni fase completata viene registrata nel journal."""
 
     # 0. Competizione
-    competition_id = sync_competition(supabase, competition_code)
+    competition_id = await asyncio.to_thread(sync_competition, supabase, competition_code)
 
-    # 1. Squadre
-    team_map = sync_teams(supabase, competition_code, season)
+    # Rose aggiornate di recente (TTL, più breve durante il mercato): niente chiamate squadre/rose
+    ttl = squad_ttl()
+    last_squads = await asyncio.to_thread(journal.last_completed, "players")
+    squads_fresh = bool(last_squads) and datetime.now(timezone.utc) - last_squads < ttl
+
+    # 1. Squadre (1 chiamata API, servita dalla cache se le rose sono fresche)
+    team_map = await asyncio.to_thread(
+        sync_teams, supabase, competition_code, season, ttl.total_seconds() if squads_fresh else None
+    )
     if not team_map:
         print("❌ Impossibile continuare senza squadre")
         return None
-
-    # 2. Giocatori
-    player_map = sync_players(supabase, team_map)
+    await asyncio.to_thread(journal.complete_stage, "teams")
+
+    # 2. Giocatori (rose fresche o ripresa: mappa letta dal DB con una query)
+    if journal.stage_done("players"):
+        player_map = await asyncio.to_thread(load_player_map, supabase, team_map)
+        print(f"\n♻️  Giocatori già sincronizzati nel run precedente: {len(player_map)} dal DB")
+    elif squads_fresh:
+        player_map = await asyncio.to_thread(load_player_map, supabase, team_map)
+        print(f"\n👥 Rose aggiornate il {last_squads:%Y-%m-%d %H:%M} (TTL {ttl.days}g): {len(player_map)} giocatori dal DB")
+    else:
+        player_map = await sync_players(supabase, team_map)
+        await asyncio.to_thread(journal.complete_stage, "players")
 
     # 3. Partite (recupera anche gli arbitri)
     # Build API URL with optional date range
@@ -1094,9 +1903,14 @@ def sync_season(competition_code: str, season: str, full_sync: bool = False, day
     date_from = None
     date_to = datetime.now().strftime("%Y-%m-%d")
 
-    if incremental:
+    if journal.resumed:
+        # Ripresa: stessa finestra del run interrotto (l'ultima partita nel DB può essere cambiata)
+        date_from, date_to = journal.date_from, journal.date_to or date_to
+        if date_from:
+            print(f"\n📅 Ripresa finestra del run precedente: {date_from} → {date_to}")
+    elif incremental:
         # Modalità incrementale: dall'ultima partita nel DB a oggi
-        last_match_date = get_last_match_date(supabase, competition_code, season)
+        last_match_date = await asyncio.to_thread(get_last_match_date, supabase, competition_code, season)
         if last_match_date:
             date_from = last_match_date
             print(f"\n📅 Modalità INCREMENTALE: {date_from} → {date_to}")
@@ -1107,23 +1921,30 @@ def sync_season(competition_code: str, season: str, full_sync: bool = False, day
         date_from = (datetime.now() - timedelta(days=days)).strftime("%Y-%m-%d")
         print(f"\n📅 Modalità DAYS: ultimi {days} giorni ({date_from} → {date_to})")
 
+    if not journal.resumed:
+        await asyncio.to_thread(journal.set_window, date_from, date_to)
+
     if date_from:
         matches_endpoint = f"/competitions/{competition_code}/matches?season={api_season}&dateFrom={date_from}&dateTo={date_to}"
     else:
         matches_endpoint = f"/competitions/{competition_code}/matches?season={api_season}"
 
-    matches_data = api_request(matches_endpoint)
+    matches_data = await asyncio.to_thread(api_request, matches_endpoint)
     matches_list = matches_data.get("matches", [])
 
     # 4. Arbitri
-    referee_map = sync_referees(supabase, matches_list)
+    referee_map = await asyncio.to_thread(sync_referees, supabase, matches_list)
 
     # 5. Salva partite (passa i dati già recuperati per evitare doppia chiamata API)
-    match_ids = sync_matches(supabase, competition_code, competition_id, season, team_map, referee_map, matches_data=matches_list)
+    match_ids = await asyncio.to_thread(
+        sync_matches, supabase, competition_code, competition_id, season, team_map, referee_map, matches_data=matches_list
+    )
+    await asyncio.to_thread(journal.complete_stage, "matches")
 
     # 6. Dettagli partite (solo se full_sync o poche partite)
     if full_sync or len(match_ids) <= 50:
-        sync_match_details(supabase, match_ids, team_map, player_map)
+        await sync_match_details(supabase, match_ids, team_map, player_map, journal=journal)
+        await asyncio.to_thread(journal.complete_stage, "match_details")
     else:
         print(f"\n⚠️ {len(match_ids)} partite trovate. Usa --full per sincronizzare i dettagli.")
         print("   (Questo richiede molte chiamate API)")
@@ -1132,28 +1953,82 @@ def sync_season(competition_code: str, season: str, full_sync: bool = False, day
     if full_sync:
         if incremental and match_ids:
             # Modalità incrementale: sincronizza solo giocatori delle partite recenti
-            recent_player_ids = get_players_from_recent_matches(supabase, match_ids)
+            recent_player_ids = await asyncio.to_thread(get_players_from_recent_matches, supabase, match_ids)
             if recent_player_ids:
-                sync_player_stats(supabase, player_map, competition_code, season, filter_player_ids=recent_player_ids)
+                await sync_player_stats(supabase, player_map, competition_code, season, filter_player_ids=recent_player_ids, journal=journal, source=player_stats_source)
             else:
                 print("\n⚠️ Nessun giocatore trovato nelle partite recenti")
         else:
             # Modalità completa: sincronizza tutti i giocatori
-            sync_player_stats(supabase, player_map, competition_code, season)
+            await sync_player_stats(supabase, player_map, competition_code, season, journal=journal, source=player_stats_source)
+        await asyncio.to_thread(journal.complete_stage, "player_stats")
     else:
         print("\n⚠️ Usa --full per sincronizzare statistiche giocatori (player_season_stats)")
 
-    # 8. Aggiorna statistiche arbitri (calcolo interno, 0 chiamate API)
-    update_referee_stats(supabase)
+    # 8. Aggiorna statistiche arbitri delle partite del run (calcolo interno, 0 chiamate API)
+    # e medie arbitri/lega della partizione del run (nessuna partita nuova: invariate)
+    await asyncio.to_thread(update_referee_stats, supabase, list(set(referee_map.values())))
+    if match_ids:
+        await asyncio.to_thread(refresh_referee_baselines, supabase, competition_code, season)
+    await asyncio.to_thread(journal.complete_stage, "referee_stats")
 
-    # 9. Verifica completezza e genera report
-    report = verify_sync(supabase, competition_code, season)
+    # 9. Cartellini per competizione della partizione del run (nessuna partita nuova: invariati)
+    if match_ids:
+        await asyncio.to_thread(refresh_season_cards, supabase, competition_code, season)
+    else:
+        print("\n🧮 Nessuna partita nel run: cartellini per competizione invariati")
+    await asyncio.to_thread(journal.complete_stage, "season_cards")
 
-    print(f"\n{'='*60}")
-    print(f"✅ SINCRONIZZAZIONE {comp_name} {season} COMPLETATA")
-    print(f"{'='*60}")
+    # 10. Snapshot feature di rischio delle squadre della competizione (letto da analyze_match_risk)
+    await asyncio.to_thread(refresh_risk_features, supabase, season, list(set(team_map.values())))
+    await asyncio.to_thread(journal.complete_stage, "risk_features")
 
-    return report
+    # 11. Verifica completezza e genera report
+    return await asyncio.to_thread(verify_sync, supabase, competition_code, season)
+
+
+async def run_sync_jobs(jobs: list, full_sync: bool = False, days: int = None, incremental: bool = False, resume: bool = False, max_parallel: int = MAX_PARALLEL_JOBS, player_stats_source: str = "api") -> list:
+    """
+    Orchestratore: esegue i sync_season di jobs [(competizione, stagione), ...] nello
+    stesso event loop, fino a max_parallel alla volta, con un unico client Supabase e
+    il budget API condiviso di RATE_LIMITER (slot assegnati a turno tra i job).
+    Mentre un job scrive sul DB o attende una risposta, gli altri usano il budget libero.
+
+    Returns:
+        Lista dei report (i job falliti hanno status FAILED, i saltati non compaiono)
+    """
+    supabase = get_supabase_client()
+    semaphore = asyncio.Semaphore(max(1, max_parallel))
+
+    # Thread per le scritture DB dei writer di ogni job più le chiamate sequenziali
+    asyncio.get_running_loop().set_default_executor(
+        ThreadPoolExecutor(max_workers=max(1, max_parallel) * (DB_WRITER_WORKERS + 2))
+    )
+
+    if len(jobs) > 1:
+        print(f"\n🧵 {len(jobs)} sincronizzazioni, fino a {max_parallel} in parallelo (budget API condiviso)")
+
+    async def run_job(competition_code: str, season: str) -> Optional[dict]:
+        async with semaphore:
+            # Ogni task ha una copia del contesto: l'etichetta resta locale al job
+            SYNC_JOB.set(f"{competition_code} {season}" if len(jobs) > 1 else None)
+            try:
+                return await sync_season(
+                    supabase, competition_code, season, full_sync, days, incremental,
+                    resume=resume, player_stats_source=player_stats_source
+                )
+            except Exception as e:
+                print(f"\n❌ Sincronizzazione {competition_code} {season} fallita: {e}")
+                return {
+                    "competition": competition_code,
+                    "season": season,
+                    "status": "FAILED",
+                    "tables": {},
+                    "warnings": [f"Errore: {e}"]
+                }
+
+    reports = await asyncio.gather(*(run_job(comp, season) for comp, season in jobs))
+    return [report for report in reports if report]
 
 
 def main():
@@ -1215,9 +2090,38 @@ def main():
         action="store_true",
         help="Sync incrementale: dall'ultima partita nel DB a oggi (CONSIGLIATO per update settimanali)"
     )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Riprende l'ultimo run interrotto (salta fasi e unità già salvate, vedi sync_runs)"
+    )
+    parser.add_argument(
+        "--player-stats",
+        choices=["api", "derived"],
+        default="api",
+        help="Fonte di player_season_stats: api = una chiamata /persons per giocatore, totali di tutte le competizioni "
+             "(default); derived = calcolo da formazioni/eventi nel DB, API solo per i giocatori non derivabili "
+             "(conta solo le competizioni sincronizzate, assist non aggiornati)"
+    )
+    parser.add_argument(
+        "--max-parallel",
+        type=int,
+        default=MAX_PARALLEL_JOBS,
+        help=f"Competizioni/stagioni sincronizzate in parallelo con budget API condiviso (default: {MAX_PARALLEL_JOBS})"
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help=f"Ignora la cache locale delle risposte API ({CACHE_PATH})"
+    )
 
     args = parser.parse_args()
 
+    # Cache risposte API
+    global RESPONSE_CACHE
+    if not args.no_cache:
+        RESPONSE_CACHE = ResponseCache()
+
     # Determina lista competizioni
     if args.all_competitions:
         competitions_list = list(COMPETITIONS.keys())
@@ -1241,19 +2145,24 @@ def main():
     else:
         seasons_list = [args.season]
 
-    # Esegui sincronizzazione
-    all_reports = []
-    for comp in competitions_list:
-        for season in seasons_list:
-            report = sync_season(comp, season, args.full, args.days, args.incremental)
-            if report:
-                all_reports.append(report)
+    # Esegui sincronizzazione (tutte le coppie competizione/stagione in un unico processo)
+    jobs = [(comp, season) for comp in competitions_list for season in seasons_list]
+    start_total = time.time()
+    all_reports = asyncio.run(run_sync_jobs(
+        jobs, args.full, args.days, args.incremental, resume=args.resume, max_parallel=args.max_parallel,
+        player_stats_source=args.player_stats
+    ))
 
     # Genera summary finale
     print("\n" + "="*60)
     print("📋 SUMMARY FINALE")
     print("="*60)
 
+    print(f"\n⏱️  Tempo totale: {(time.time() - start_total)/60:.1f} min per {len(jobs)} sincronizzazioni")
+
+    if RESPONSE_CACHE:
+        print(f"\n💾 Cache API: {RESPONSE_CACHE.hits} risposte servite da cache, {RESPONSE_CACHE.revalidated} rivalidate (304)")
+
     has_warnings = False
     for report in all_reports:
         status_icon = "✅" if report["status"] == "OK" else "⚠️"
@@ -1292,6 +2201,10 @@ def main():
 
     print("\n🎉 Done!")
 
+    # Exit con errore se almeno un job è fallito (weekly_sync.sh / GitHub Actions)
+    if any(report["status"] == "FAILED" for report in all_reports):
+        sys.exit(1)
+
 
 if __name__ == "__main__":
     main()
@@ -16,7 +16,7 @@ LOG_DIR="$PROJECT_DIR/logs"
 LOG_FILE="$LOG_DIR/sync_$(date +%Y%m%d_%H%M%S).log"
 
 # Competizioni di default (tutte)
-ALL_COMPETITIONS="SA PL PD BL1 FL1 CL EL"
+ALL_COMPETITIONS="SA PL PD BL1 FL1 CL BSA"
 COMPETITIONS="${1:-$ALL_COMPETITIONS}"
 
 # Crea directory log se non esiste
@@ -45,29 +45,20 @@ if [ ! -f "$VENV_PYTHON" ]; then
     exit 1
 fi
 
-# Contatori
-TOTAL=0
-SUCCESS=0
-FAILED=0
-
-# Loop su tutte le competizioni
-for COMP in $COMPETITIONS; do
-    TOTAL=$((TOTAL + 1))
-    log ""
-    log "--- Sincronizzazione $COMP ---"
+# Un solo processo per tutte le competizioni: budget API condiviso e turni equi
+COMP_LIST="${COMPETITIONS// /,}"
+log ""
+log "--- Sincronizzazione $COMP_LIST ---"
 
-    $VENV_PYTHON "$SYNC_SCRIPT" --competition "$COMP" --season 2025-2026 --incremental --full 2>&1 | tee -a "$LOG_FILE"
+$VENV_PYTHON "$SYNC_SCRIPT" --competitions "$COMP_LIST" --season 2025-2026 --incremental --full 2>&1 | tee -a "$LOG_FILE"
 
-    SYNC_EXIT_CODE=${PIPESTATUS[0]}
+SYNC_EXIT_CODE=${PIPESTATUS[0]}
 
-    if [ $SYNC_EXIT_CODE -eq 0 ]; then
-        log "✅ $COMP completato"
-        SUCCESS=$((SUCCESS + 1))
-    else
-        log "❌ $COMP fallito (exit code: $SYNC_EXIT_CODE)"
-        FAILED=$((FAILED + 1))
-    fi
-done
+if [ $SYNC_EXIT_CODE -eq 0 ]; then
+    log "✅ Sincronizzazione completata"
+else
+    log "❌ Almeno una competizione fallita (exit code: $SYNC_EXIT_CODE, dettagli nel SUMMARY FINALE)"
+fi
 
 # Pulizia log vecchi (mantieni ultimi 30 giorni)
 log ""
@@ -78,7 +69,6 @@ find "$LOG_DIR" -name "sync_*.log" -mtime +30 -delete 2>/dev/null
 log ""
 log "=========================================="
 log "Fine sincronizzazione"
-log "Totale: $TOTAL | Successo: $SUCCESS | Falliti: $FAILED"
 log "=========================================="
 
 # Mostra riepilogo
@@ -87,7 +77,7 @@ echo "Log salvato in: $LOG_FILE"
 echo "Per vedere i log recenti: ls -la $LOG_DIR"
 
 # Exit con errore se almeno una sync è fallita
-if [ $FAILED -gt 0 ]; then
+if [ $SYNC_EXIT_CODE -ne 0 ]; then
     exit 1
 fi
 exit 0
@@ -0,0 +1,391 @@
+"""
+Parità tra analyze_match_risk_v2 (migration 009, calcolo nel DB) e il calcolo Python
+di analyze_match_risk (mcp_server.py + scoring.py).
+
+Carica schema e migration in un database Postgres usa e getta, inserisce un piccolo
+campionato deterministico e confronta top 5 (casa, trasferta, complessiva) e
+combined_score dei due percorsi, con e senza arbitro.
+
+Serve un Postgres locale con le estensioni pg_trgm, unaccent e uuid-ossp:
+    YELLOWORACLE_TEST_DATABASE_URL=postgresql://postgres@localhost/postgres pytest tests/
+Senza la variabile il test viene saltato.
+"""
+
+import glob
+import json
+import os
+import re
+import sys
+import uuid
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from pathlib import Path
+
+import pytest
+
+psycopg = pytest.importorskip("psycopg")
+from psycopg import sql  # noqa: E402
+from psycopg.rows import dict_row  # noqa: E402
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))  # mcp_server.py e scoring.py stanno nella root del repo
+mcp_server = pytest.importorskip("mcp_server")
+
+DATABASE_URL = os.getenv("YELLOWORACLE_TEST_DATABASE_URL")
+SEASON = "2025-2026"
+SCORE_TOLERANCE = 0.1  # Arrotondamento: float in Python, NUMERIC (half-up) nel DB
+
+pytestmark = pytest.mark.skipif(not DATABASE_URL, reason="YELLOWORACLE_TEST_DATABASE_URL non impostata")
+
+
+# === FIXTURE: un piccolo campionato (Serie A 2025-2026) ===
+
+TEAMS = ["Inter", "Milan", "Juventus", "Lecce"]
+
+# Rose: (nome, ruolo). Il ruolo decide il moltiplicatore falli (Midfield/Defence = 1.2)
+PLAYERS = {
+    "Inter": [
+        ("Yann Sommer", "Goalkeeper"), ("Alessandro Bastoni", "Defence"), ("Francesco Acerbi", "Defence"),
+        ("Nicolò Barella", "Midfield"), ("Hakan Calhanoglu", "Midfield"), ("Henrikh Mkhitaryan", "Midfield"),
+        ("Lautaro Martínez", "Offence"), ("Davide Frattesi", "Midfield"),
+    ],
+    "Milan": [
+        ("Mike Maignan", "Goalkeeper"), ("Fikayo Tomori", "Defence"), ("Theo Hernández", "Defence"),
+        ("Tijjani Reijnders", "Midfield"), ("Youssouf Fofana", "Midfield"), ("Ruben Loftus-Cheek", "Midfield"),
+        ("Rafael Leão", "Offence"), ("Samuel Chukwueze", "Offence"),
+    ],
+    "Juventus": [
+        ("Michele Di Gregorio", "Goalkeeper"), ("Gleison Bremer", "Defence"),
+        ("Manuel Locatelli", "Midfield"), ("Dusan Vlahovic", "Offence"),
+    ],
+    "Lecce": [
+        ("Wladimiro Falcone", "Goalkeeper"), ("Federico Baschirotto", "Defence"),
+        ("Ylber Ramadani", "Midfield"), ("Nikola Krstovic", "Offence"),
+    ],
+}
+
+# Subentrati: non titolari, giocano dal minuto indicato (Frattesi e Chukwueze restano sotto i 90')
+SUBSTITUTES = {"Davide Frattesi": 60, "Samuel Chukwueze": 75}
+
+# Partite concluse: (casa, trasferta, con arbitro, possesso casa, falli casa, falli trasferta, cartellini)
+# Cartellini: (giocatore, tipo). Il Lecce non ha statistiche di squadra (possesso/falli None).
+MATCHES = [
+    ("Inter", "Milan", True, 55, 14, 16, [
+        ("Nicolò Barella", "YELLOW_CARD"), ("Alessandro Bastoni", "YELLOW_CARD"),
+        ("Theo Hernández", "YELLOW_CARD"), ("Youssouf Fofana", "YELLOW_CARD"),
+        ("Fikayo Tomori", "RED_CARD"),
+    ]),
+    ("Milan", "Juventus", True, 48, 12, 15, [
+        ("Theo Hernández", "YELLOW_CARD"), ("Tijjani Reijnders", "YELLOW_CARD"),
+        ("Manuel Locatelli", "YELLOW_CARD"), ("Samuel Chukwueze", "YELLOW_CARD"),
+    ]),
+    ("Juventus", "Inter", False, 51, 13, 11, [
+        ("Gleison Bremer", "YELLOW_CARD"), ("Hakan Calhanoglu", "YELLOW_CARD"),
+        ("Nicolò Barella", "YELLOW_CARD"),
+    ]),
+    ("Lecce", "Inter", True, None, None, 9, [
+        ("Ylber Ramadani", "YELLOW_CARD"), ("Federico Baschirotto", "YELLOW_CARD"),
+        ("Francesco Acerbi", "YELLOW_CARD"), ("Davide Frattesi", "YELLOW_CARD"),
+    ]),
+    ("Milan", "Lecce", False, 62, 10, None, [
+        ("Ruben Loftus-Cheek", "YELLOW_CARD"), ("Ylber Ramadani", "YELLOW_CARD"),
+        ("Nikola Krstovic", "YELLOW_CARD"),
+    ]),
+    ("Milan", "Inter", True, 46, 17, 13, [
+        ("Theo Hernández", "YELLOW_CARD"), ("Youssouf Fofana", "YELLOW_CARD"),
+        ("Lautaro Martínez", "YELLOW_CARD"), ("Nicolò Barella", "YELLOW_CARD"),
+    ]),
+    ("Lecce", "Juventus", True, None, None, 12, [
+        ("Nikola Krstovic", "YELLOW_CARD"), ("Dusan Vlahovic", "YELLOW_CARD"),
+    ]),
+]
+
+REFEREE = "Daniele Orsato"
+DERBY = ("Inter", "Milan", "Derby della Madonnina", 3)
+
+
+def fixture_id(*parts) -> uuid.UUID:
+    """ID stabile tra un'esecuzione e l'altra: a parità di score l'ordine dipende da player_id."""
+    return uuid.uuid5(uuid.NAMESPACE_URL, "yelloworacle-test/" + "/".join(map(str, parts)))
+
+
+def seed(conn):
+    """Inserisce il campionato di prova e ricalcola tabelle derivate e snapshot."""
+    ids = {name: fixture_id("team", name) for name in TEAMS}
+    competition_id, referee_id = fixture_id("competition", "SA"), fixture_id("referee", REFEREE)
+    player_ids = {}
+
+    conn.execute("INSERT INTO competitions (id, code, name) VALUES (%s, 'SA', 'Serie A')", (competition_id,))
+    conn.execute("INSERT INTO referees (id, name) VALUES (%s, %s)", (referee_id, REFEREE))
+    for team in TEAMS:
+        conn.execute("INSERT INTO teams (id, name, short_name) VALUES (%s, %s, %s)", (ids[team], team, team))
+        for player, position in PLAYERS[team]:
+            player_ids[player] = fixture_id("player", player)
+            conn.execute(
+                "INSERT INTO players (id, name, position, current_team_id) VALUES (%s, %s, %s, %s)",
+                (player_ids[player], player, position, ids[team]),
+            )
+
+    home_team, away_team, rivalry, intensity = DERBY
+    conn.execute(
+        "INSERT INTO rivalries (team1_id, team2_id, rivalry_name, rivalry_type, intensity) VALUES (%s, %s, %s, 'DERBY', %s)",
+        (ids[home_team], ids[away_team], rivalry, intensity),
+    )
+
+    kickoff = datetime(2025, 9, 1, 20, 45)
+    for day, (home, away, refereed, possession, home_fouls, away_fouls, cards) in enumerate(MATCHES):
+        match_id = fixture_id("match", day)
+        conn.execute(
+            """INSERT INTO matches (id, competition_id, season, match_date, status, home_team_id, away_team_id, referee_id)
+               VALUES (%s, %s, %s, %s, 'FINISHED', %s, %s, %s)""",
+            (match_id, competition_id, SEASON, kickoff + timedelta(days=7 * day),
+             ids[home], ids[away], referee_id if refereed else None),
+        )
+        for team, fouls, suffered, share in [
+            (home, home_fouls, away_fouls, possession),
+            (away, away_fouls, home_fouls, None if possession is None else 100 - possession),
+        ]:
+            if fouls is not None:
+                team_cards = [c for c in cards if c[0] in dict(PLAYERS[team])]
+                conn.execute(
+                    """INSERT INTO match_statistics (match_id, team_id, ball_possession, fouls_committed,
+                           fouls_suffered, yellow_cards, red_cards)
+                       VALUES (%s, %s, %s, %s, %s, %s, %s)""",
+                    (match_id, ids[team], share, fouls, suffered or 0,
+                     sum(1 for _, t in team_cards if t == "YELLOW_CARD"),
+                     sum(1 for _, t in team_cards if t == "RED_CARD")),
+                )
+            for player, _ in PLAYERS[team]:
+                subbed_in = SUBSTITUTES.get(player)
+                conn.execute(
+                    """INSERT INTO lineups (match_id, team_id, player_id, is_starter, is_substitute,
+                           minutes_played, subbed_in_minute)
+                       VALUES (%s, %s, %s, %s, %s, %s, %s)""",
+                    (match_id, ids[team], player_ids[player], subbed_in is None, subbed_in is not None,
+                     None if subbed_in is None else 90 - subbed_in, subbed_in),
+                )
+        for minute, (player, card) in enumerate(cards, start=10):
+            team = home if player in dict(PLAYERS[home]) else away
+            conn.execute(
+                "INSERT INTO match_events (match_id, team_id, player_id, event_type, minute) VALUES (%s, %s, %s, %s, %s)",
+                (match_id, ids[team], player_ids[player], card, minute),
+            )
+
+    # Stesso ordine della sync: riepiloghi partita, arbitri, medie stagionali, snapshot rose
+    conn.execute("SELECT refresh_match_card_summary()")
+    conn.execute("SELECT refresh_referee_stats()")
+    conn.execute("SELECT refresh_referee_season_baselines(%s)", (SEASON,))
+    conn.execute("SELECT refresh_player_risk_features(%s)", (SEASON,))
+
+
+@pytest.fixture(scope="module")
+def database():
+    """Database usa e getta con schema, viste di partenza, migration 001-018 e campionato di prova."""
+    name = f"yelloworacle_parity_{uuid.uuid4().hex[:8]}"
+    try:
+        admin = psycopg.connect(DATABASE_URL, autocommit=True)
+    except psycopg.OperationalError as e:
+        pytest.skip(f"Postgres non raggiungibile: {e}")
+    with admin:
+        admin.execute(sql.SQL("CREATE DATABASE {}").format(sql.Identifier(name)))
+    url = psycopg.conninfo.make_conninfo(DATABASE_URL, dbname=name)
+    try:
+        with psycopg.connect(url, autocommit=True, row_factory=dict_row) as conn:
+            conn.execute("CREATE SCHEMA IF NOT EXISTS extensions")  # Presente di default su Supabase
+            scripts = [ROOT / "database" / "schema_v2.sql", ROOT / "database" / "analysis_views.sql"]
+            for script in scripts + sorted(Path(p) for p in glob.glob(str(ROOT / "database" / "migrations" / "*.sql"))):
+                conn.execute(script.read_text())
+            seed(conn)
+            yield conn
+    finally:
+        with psycopg.connect(DATABASE_URL, autocommit=True) as admin:
+            admin.execute(sql.SQL("DROP DATABASE IF EXISTS {} WITH (FORCE)").format(sql.Identifier(name)))
+
+
+# === CLIENT: le chiamate PostgREST usate da analyze_match_risk, tradotte in SQL ===
+
+def to_json(value):
+    """Valore come lo restituirebbe PostgREST (JSON)."""
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    return value
+
+
+class Result:
+    def __init__(self, data):
+        self.data = data
+
+
+class TableQuery:
+    """Sottoinsieme del query builder di supabase-py: select con embed, filtri, order, limit, range."""
+
+    EMBED = re.compile(r"(\w+)\(([^)]*)\)")
+
+    def __init__(self, conn, table: str):
+        self.conn = conn
+        self.table = table
+        self.columns = []
+        self.embeds = []
+        self.where = []
+        self.params = []
+        self.order_by = []
+        self.limit_value = None
+        self.offset_value = None
+
+    def select(self, columns: str):
+        self.embeds = self.EMBED.findall(columns)
+        self.columns = [c.strip() for c in self.EMBED.sub("", columns).split(",") if c.strip()]
+        return self
+
+    def eq(self, column: str, value):
+        self.where.append(sql.SQL("{} = %s").format(sql.Identifier(self.table, column)))
+        self.params.append(value)
+        return self
+
+    def in_(self, column: str, values):
+        self.where.append(sql.SQL("{}::TEXT = ANY(%s)").format(sql.Identifier(self.table, column)))
+        self.params.append([str(v) for v in values])
+        return self
+
+    def or_(self, filters: str):
+        conditions = []
+        for condition in filters.split(","):
+            column, _, value = condition.split(".", 2)
+            conditions.append(sql.SQL("{}::TEXT = %s").format(sql.Identifier(self.table, column)))
+            self.params.append(value)
+        self.where.append(sql.SQL("({})").format(sql.SQL(" OR ").join(conditions)))
+        return self
+
+    def order(self, column: str, desc: bool = False):
+        self.order_by.append(sql.SQL("{} {}").format(sql.Identifier(self.table, column), sql.SQL("DESC" if desc else "ASC")))
+        return self
+
+    def limit(self, count: int):
+        self.limit_value = count
+        return self
+
+    def range(self, start: int, end: int):
+        self.offset_value, self.limit_value = start, end - start + 1
+        return self
+
+    def _embed_column(self, embedded: str, columns: str):
+        """Sotto-oggetto JSON della tabella collegata per foreign key (come competitions(code))."""
+        fk = self.conn.execute(
+            """SELECT a.attname FROM pg_constraint c
+               JOIN pg_attribute a ON a.attrelid = c.conrelid AND a.attnum = c.conkey[1]
+               WHERE c.contype = 'f' AND c.conrelid = %s::regclass AND c.confrelid = %s::regclass""",
+            (self.table, embedded),
+        ).fetchone()["attname"]
+        fields = [c.strip() for c in columns.split(",")]
+        return sql.SQL("(SELECT jsonb_build_object({}) FROM {} e WHERE e.id = {}) AS {}").format(
+            sql.SQL(", ").join(sql.SQL("{}, {}").format(sql.Literal(f), sql.Identifier("e", f)) for f in fields),
+            sql.Identifier(embedded),
+            sql.Identifier(self.table, fk),
+            sql.Identifier(embedded),
+        )
+
+    def execute(self):
+        columns = [
+            sql.SQL("{}.*").format(sql.Identifier(self.table)) if c == "*" else sql.Identifier(self.table, c)
+            for c in self.columns
+        ] + [self._embed_column(name, cols) for name, cols in self.embeds]
+        query = sql.SQL("SELECT {} FROM {}").format(sql.SQL(", ").join(columns), sql.Identifier(self.table))
+        if self.where:
+            query += sql.SQL(" WHERE ") + sql.SQL(" AND ").join(self.where)
+        if self.order_by:
+            query += sql.SQL(" ORDER BY ") + sql.SQL(", ").join(self.order_by)
+        if self.limit_value is not None:
+            query += sql.SQL(" LIMIT {}").format(sql.Literal(self.limit_value))
+        if self.offset_value:
+            query += sql.SQL(" OFFSET {}").format(sql.Literal(self.offset_value))
+        rows = self.conn.execute(query, self.params).fetchall()
+        return Result([{k: to_json(v) for k, v in row.items()} for row in rows])
+
+
+class RpcCall:
+    """Chiamata RPC: funzioni che restituiscono righe -> lista di dict, scalari (JSONB) -> valore."""
+
+    def __init__(self, conn, function: str, params: dict):
+        self.conn = conn
+        self.function = function
+        self.params = params
+
+    def execute(self):
+        proc = self.conn.execute(
+            """SELECT p.proretset,
+                      jsonb_object_agg(a.name, format_type(a.type, NULL)) FILTER (WHERE a.mode IN ('i', 'b')) AS args
+               FROM pg_proc p
+               CROSS JOIN LATERAL unnest(
+                   COALESCE(p.proallargtypes, p.proargtypes::OID[]),
+                   p.proargnames,
+                   COALESCE(p.proargmodes, array_fill('i'::"char", ARRAY[p.pronargs]))
+               ) AS a(type, name, mode)
+               WHERE p.proname = %s
+               GROUP BY p.oid, p.proretset""",
+            (self.function,),
+        ).fetchone()
+        args = sql.SQL(", ").join(
+            sql.SQL("{} => %s::{}").format(sql.Identifier(name), sql.SQL(proc["args"][name]))
+            for name in self.params
+        )
+        values = [
+            [str(v) for v in value] if isinstance(value, list) else value
+            for value in self.params.values()
+        ]
+        if proc["proretset"]:
+            rows = self.conn.execute(sql.SQL("SELECT * FROM {}({})").format(sql.Identifier(self.function), args), values).fetchall()
+            return Result([{k: to_json(v) for k, v in row.items()} for row in rows])
+        row = self.conn.execute(sql.SQL("SELECT {}({}) AS value").format(sql.Identifier(self.function), args), values).fetchone()
+        return Result(to_json(row["value"]))
+
+
+class PostgresClient:
+    """Sostituto del client Supabase che esegue le stesse query direttamente sul database di prova."""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def table(self, name: str) -> TableQuery:
+        return TableQuery(self.conn, name)
+
+    def rpc(self, function: str, params: dict) -> RpcCall:
+        return RpcCall(self.conn, function, params)
+
+
+@pytest.fixture
+def client(database, monkeypatch):
+    client = PostgresClient(database)
+    monkeypatch.setattr(mcp_server, "get_supabase", lambda: client)
+    mcp_server.REFERENCE_CACHE.clear()
+    mcp_server.NAME_INDEX_CACHE.clear()
+    return client
+
+
+# === TEST ===
+
+def top5(players: list) -> list:
+    """(nome, combined_score) nell'ordine restituito."""
+    return [(p["name"], float(p["combined_score"])) for p in players]
+
+
+@pytest.mark.parametrize("home_team, away_team", [("Inter", "Milan"), ("Lecce", "Juventus")])
+@pytest.mark.parametrize("referee", [REFEREE, None])
+def test_python_and_v2_rank_the_same_players(client, home_team, away_team, referee):
+    output = mcp_server.analyze_match_risk(home_team, away_team, referee, season=SEASON, format="json")
+    python_analysis = json.loads(output)
+    v2_analysis = mcp_server.analyze_match_risk_rpc(client, home_team, away_team, referee, SEASON)
+
+    assert v2_analysis is not None
+    for key in ("home_team_top5", "away_team_top5", "overall_top5"):
+        python_top, v2_top = top5(python_analysis[key]), top5(v2_analysis[key])
+        assert python_top, f"{key} vuota"
+        assert [name for name, _ in python_top] == [name for name, _ in v2_top], key
+        for (name, python_score), (_, v2_score) in zip(python_top, v2_top):
+            assert python_score == pytest.approx(v2_score, abs=SCORE_TOLERANCE), f"{key}: {name}"
+
+    assert python_analysis["multipliers"] == v2_analysis["multipliers"]
+    assert python_analysis["derby"] == v2_analysis["derby"]